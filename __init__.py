@@ -22,6 +22,7 @@ def nt_load_wav(waveform, sample_rate, target_sample_rate):
 # 导入拆分后的节点类
 from .nodes.zero_shot_sampler import NTCosyVoiceZeroShotSampler
 from .nodes.clone_speaker import NTCosyVoiceCloneSpeaker
+from .nodes.bulk_clone_speakers import NTCosyVoiceBulkCloneSpeakers
 from .nodes.select_speaker import NTCosyVoiceSelectSpeaker
 from .nodes.cross_lingual_sampler import NTCosyVoiceCrossLingualSampler
 from .nodes.instruct2_sampler import NTCosyVoiceInstruct2Sampler
@@ -33,6 +34,7 @@ NODE_CLASS_MAPPINGS = {
     "NTCosyVoiceInstruct2Sampler": NTCosyVoiceInstruct2Sampler,
     "NTCosyVoiceCrossLingualSampler": NTCosyVoiceCrossLingualSampler,
     "NTCosyVoiceCloneSpeaker": NTCosyVoiceCloneSpeaker,
+    "NTCosyVoiceBulkCloneSpeakers": NTCosyVoiceBulkCloneSpeakers,
     "NTCosyVoiceSelectSpeaker": NTCosyVoiceSelectSpeaker,
     "NTCosyVoiceDeleteSpeaker": NTCosyVoiceDeleteSpeaker,
     "NTCosyVoiceRefreshSpeakers": NTCosyVoiceRefreshSpeakers
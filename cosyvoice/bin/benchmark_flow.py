@@ -0,0 +1,124 @@
+# Copyright (c) 2025 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import print_function
+
+import argparse
+import logging
+logging.getLogger('matplotlib').setLevel(logging.WARNING)
+import os
+import random
+import sys
+import threading
+import time
+import torch
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append('{}/../..'.format(ROOT_DIR))
+sys.path.append('{}/../../third_party/Matcha-TTS'.format(ROOT_DIR))
+from cosyvoice.cli.cosyvoice import CosyVoice2
+from cosyvoice.utils.file_utils import load_wav, logging
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='benchmark flow inference throughput')
+    parser.add_argument('--model_dir',
+                        type=str,
+                        default='pretrained_models/CosyVoice2-0.5B',
+                        help='local path')
+    parser.add_argument('--prompt_wav',
+                        type=str,
+                        default='{}/../../asset/zero_shot_prompt.wav'.format(ROOT_DIR),
+                        help='prompt wav file')
+    parser.add_argument('--prompt_text',
+                        type=str,
+                        default='希望你以后能够做的比我还好呦。',
+                        help='prompt text')
+    parser.add_argument('--token_len',
+                        type=str,
+                        default='100,300',
+                        help='min,max speech token length of each request')
+    parser.add_argument('--num_requests',
+                        type=int,
+                        default=4,
+                        help='number of requests per concurrent session')
+    parser.add_argument('--concurrency',
+                        type=str,
+                        default='1,2,4,8',
+                        help='comma separated concurrency levels')
+    parser.add_argument('--mode',
+                        default='batch',
+                        choices=['batch'],
+                        help='flow mode to compare against the default batch 1 flow')
+    args = parser.parse_args()
+    print(args)
+    return args
+
+
+def run_concurrent(model, model_input, tokens, concurrency, num_requests):
+    num_frames = [0] * concurrency
+
+    def job(index):
+        for i in range(num_requests):
+            token = tokens[(index * num_requests + i) % len(tokens)]
+            tts_mel, _ = model.flow.inference(token=token.to(model.device),
+                                              token_len=torch.tensor([token.shape[1]], dtype=torch.int32).to(model.device),
+                                              prompt_token=model_input['flow_prompt_speech_token'].to(model.device),
+                                              prompt_token_len=model_input['flow_prompt_speech_token_len'].to(model.device),
+                                              prompt_feat=model_input['prompt_speech_feat'].to(model.device),
+                                              prompt_feat_len=model_input['prompt_speech_feat_len'].to(model.device),
+                                              embedding=model_input['flow_embedding'].to(model.device),
+                                              streaming=False,
+                                              finalize=True)
+            num_frames[index] += tts_mel.shape[2]
+
+    threads = [threading.Thread(target=job, args=(i,)) for i in range(concurrency)]
+    start_time = time.time()
+    for p in threads:
+        p.start()
+    for p in threads:
+        p.join()
+    return sum(num_frames), time.time() - start_time
+
+
+def main():
+    args = get_args()
+    concurrency_list = [int(i) for i in args.concurrency.split(',')]
+    min_len, max_len = [int(i) for i in args.token_len.split(',')]
+    cosyvoice = CosyVoice2(args.model_dir)
+    prompt_speech_16k = load_wav(args.prompt_wav, 16000)
+    model_input = cosyvoice.frontend.frontend_zero_shot('', args.prompt_text, prompt_speech_16k, cosyvoice.sample_rate, '')
+    model = cosyvoice.model
+    random.seed(0)
+    tokens = [torch.randint(0, model.flow.vocab_size, (1, random.randint(min_len, max_len)), dtype=torch.int32) for _ in range(64)]
+    # frames per second of generated speech, used to report rtf
+    mel_frame_rate = model.flow.input_frame_rate * model.flow.token_mel_ratio
+
+    results = {}
+    for mode in ['default', args.mode]:
+        if mode == 'batch':
+            model.load_batch_flow(max(concurrency_list))
+        for concurrency in concurrency_list:
+            num_frames, cost = run_concurrent(model, model_input, tokens, concurrency, args.num_requests)
+            results[(mode, concurrency)] = num_frames / mel_frame_rate / cost
+            logging.info('mode {} concurrency {} frames {} time {:.3f}s'.format(mode, concurrency, num_frames, cost))
+        if mode == 'batch':
+            logging.info('batch stats {}'.format(model.flow.decoder_batcher.get_stats()))
+    for concurrency in concurrency_list:
+        print('concurrency {:>3d} default {:>7.2f} speech s/s {} {:>7.2f} speech s/s speedup {:.2f}x'.format(
+            concurrency, results[('default', concurrency)], args.mode, results[(args.mode, concurrency)],
+            results[(args.mode, concurrency)] / results[('default', concurrency)]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# Copyright (c) 2025 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import print_function
+
+import argparse
+import logging
+logging.getLogger('matplotlib').setLevel(logging.WARNING)
+import os
+import random
+import sys
+import time
+import torch
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append('{}/../..'.format(ROOT_DIR))
+sys.path.append('{}/../../third_party/Matcha-TTS'.format(ROOT_DIR))
+from cosyvoice.cli.cosyvoice import CosyVoice2
+from cosyvoice.utils.file_utils import load_wav, logging
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='benchmark cpu flow rtf of onnxruntime estimator against eager pytorch')
+    parser.add_argument('--model_dir',
+                        type=str,
+                        default='pretrained_models/CosyVoice2-0.5B',
+                        help='local path')
+    parser.add_argument('--prompt_wav',
+                        type=str,
+                        default='{}/../../asset/zero_shot_prompt.wav'.format(ROOT_DIR),
+                        help='prompt wav file')
+    parser.add_argument('--prompt_text',
+                        type=str,
+                        default='希望你以后能够做的比我还好呦。',
+                        help='prompt text')
+    parser.add_argument('--token_len',
+                        type=str,
+                        default='100,300',
+                        help='min,max speech token length of each request')
+    parser.add_argument('--num_requests',
+                        type=int,
+                        default=4,
+                        help='number of requests per config')
+    parser.add_argument('--num_threads',
+                        type=str,
+                        default='1,2,4',
+                        help='comma separated intra op threads, used by both pytorch and onnxruntime')
+    args = parser.parse_args()
+    print(args)
+    return args
+
+
+def run_requests(model, model_input, tokens):
+    num_frames = 0
+    start_time = time.time()
+    for token in tokens:
+        tts_mel, _ = model.flow.inference(token=token,
+                                          token_len=torch.tensor([token.shape[1]], dtype=torch.int32),
+                                          prompt_token=model_input['flow_prompt_speech_token'],
+                                          prompt_token_len=model_input['flow_prompt_speech_token_len'],
+                                          prompt_feat=model_input['prompt_speech_feat'],
+                                          prompt_feat_len=model_input['prompt_speech_feat_len'],
+                                          embedding=model_input['flow_embedding'],
+                                          streaming=False,
+                                          finalize=True)
+        num_frames += tts_mel.shape[2]
+    return num_frames, time.time() - start_time
+
+
+def main():
+    args = get_args()
+    assert torch.cuda.is_available() is False, 'run this benchmark on a cpu only machine, or with CUDA_VISIBLE_DEVICES='
+    num_threads_list = [int(i) for i in args.num_threads.split(',')]
+    min_len, max_len = [int(i) for i in args.token_len.split(',')]
+    cosyvoice = CosyVoice2(args.model_dir)
+    prompt_speech_16k = load_wav(args.prompt_wav, 16000)
+    model_input = cosyvoice.frontend.frontend_zero_shot('', args.prompt_text, prompt_speech_16k, cosyvoice.sample_rate, '')
+    model = cosyvoice.model
+    random.seed(0)
+    tokens = [torch.randint(0, model.flow.vocab_size, (1, random.randint(min_len, max_len)), dtype=torch.int32) for _ in range(args.num_requests)]
+    mel_frame_rate = model.flow.input_frame_rate * model.flow.token_mel_ratio
+
+    results = {}
+    for mode in ['torch', 'onnx']:
+        for num_threads in num_threads_list:
+            # NOTE flow encoder always runs in pytorch
+            torch.set_num_threads(num_threads)
+            if mode == 'onnx':
+                model.load_onnx('{}/flow.decoder.estimator.fp32.onnx'.format(args.model_dir), intra_op_num_threads=num_threads)
+            # warmup
+            run_requests(model, model_input, tokens[:1])
+            num_frames, cost = run_requests(model, model_input, tokens)
+            results[(mode, num_threads)] = cost / (num_frames / mel_frame_rate)
+            logging.info('mode {} threads {} frames {} time {:.3f}s'.format(mode, num_threads, num_frames, cost))
+    for num_threads in num_threads_list:
+        print('threads {:>3d} torch rtf {:.4f} onnx rtf {:.4f} speedup {:.2f}x'.format(
+            num_threads, results[('torch', num_threads)], results[('onnx', num_threads)],
+            results[('torch', num_threads)] / results[('onnx', num_threads)]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# Copyright (c) 2025 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import print_function
+
+import argparse
+import logging
+logging.getLogger('matplotlib').setLevel(logging.WARNING)
+import os
+import sys
+import time
+import torch
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append('{}/../..'.format(ROOT_DIR))
+sys.path.append('{}/../../third_party/Matcha-TTS'.format(ROOT_DIR))
+from cosyvoice.cli.cosyvoice import CosyVoice2
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='benchmark flow estimator with step invariant inputs prepared per step against once per solve')
+    parser.add_argument('--model_dir',
+                        type=str,
+                        default='pretrained_models/CosyVoice2-0.5B',
+                        help='local path')
+    parser.add_argument('--mel_len',
+                        type=str,
+                        default='500,1000,2000',
+                        help='comma separated mel lengths')
+    parser.add_argument('--n_timesteps',
+                        type=int,
+                        default=10,
+                        help='number of ode steps')
+    parser.add_argument('--streaming',
+                        action='store_true',
+                        help='use chunk attention mask')
+    args = parser.parse_args()
+    print(args)
+    return args
+
+
+def sync():
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+def num_allocs():
+    # NOTE number of cuda caching allocator allocations, not available on cpu
+    return torch.cuda.memory_stats()['allocation.all.allocated'] if torch.cuda.is_available() else 0
+
+
+@torch.inference_mode()
+def run_solve(estimator, x, mask, mu, t, spks, cond, n_timesteps, streaming, hoist):
+    sync()
+    start_allocs, start_time = num_allocs(), time.time()
+    prepared = estimator.prepare(mask, mu, spks, cond, streaming) if hoist else None
+    for _ in range(n_timesteps):
+        estimator(x, mask, mu, t, spks, cond, streaming=streaming, prepared=prepared)
+    sync()
+    return time.time() - start_time, num_allocs() - start_allocs
+
+
+def main():
+    args = get_args()
+    cosyvoice = CosyVoice2(args.model_dir)
+    model = cosyvoice.model
+    estimator = model.flow.decoder.estimator
+    dtype = torch.float16 if model.fp16 else torch.float32
+    print('{:>8s} {:>12s} {:>12s} {:>10s} {:>12s} {:>12s}'.format('mel_len', 'per step ms', 'once ms', 'speedup', 'per step alloc', 'once alloc'))
+    for mel_len in [int(i) for i in args.mel_len.split(',')]:
+        # NOTE batch 2 as in cfg inference
+        x = torch.randn(2, 80, mel_len, device=model.device, dtype=dtype)
+        mask = torch.ones(2, 1, mel_len, device=model.device, dtype=dtype)
+        mu = torch.randn(2, 80, mel_len, device=model.device, dtype=dtype)
+        t = torch.rand(2, device=model.device, dtype=dtype)
+        spks = torch.randn(2, 80, device=model.device, dtype=dtype)
+        cond = torch.randn(2, 80, mel_len, device=model.device, dtype=dtype)
+        result = {}
+        for hoist in [False, True]:
+            # warmup
+            run_solve(estimator, x, mask, mu, t, spks, cond, 1, args.streaming, hoist)
+            result[hoist] = run_solve(estimator, x, mask, mu, t, spks, cond, args.n_timesteps, args.streaming, hoist)
+        print('{:>8d} {:>12.2f} {:>12.2f} {:>9.2f}x {:>12d} {:>12d}'.format(mel_len, result[False][0] * 1000, result[True][0] * 1000,
+                                                                              result[False][0] / result[True][0], result[False][1], result[True][1]))
+
+
+if __name__ == "__main__":
+    main()
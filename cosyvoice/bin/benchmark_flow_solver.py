@@ -0,0 +1,129 @@
+# Copyright (c) 2025 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import print_function
+
+import argparse
+import logging
+logging.getLogger('matplotlib').setLevel(logging.WARNING)
+import os
+import random
+import sys
+import time
+import torch
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append('{}/../..'.format(ROOT_DIR))
+sys.path.append('{}/../../third_party/Matcha-TTS'.format(ROOT_DIR))
+from cosyvoice.cli.cosyvoice import CosyVoice2
+from cosyvoice.utils.file_utils import load_wav, logging
+
+# estimator calls per step of every solver
+SOLVER_ORDER = {'euler': 1, 'heun': 2, 'midpoint': 2, 'dpm_multistep': 1}
+# reference first, every config is compared against it
+CONFIGS = [
+    {'solver': 'euler', 'n_timesteps': 10},
+    {'solver': 'euler', 'n_timesteps': 5},
+    {'solver': 'heun', 'n_timesteps': 5},
+    {'solver': 'midpoint', 'n_timesteps': 5},
+    {'solver': 'dpm_multistep', 'n_timesteps': 10},
+    {'solver': 'dpm_multistep', 'n_timesteps': 5},
+    {'solver': 'euler', 'n_timesteps': 10, 'cfg_interval': 0.5},
+    {'solver': 'euler', 'n_timesteps': 10, 't_scheduler': 'linear'},
+]
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='benchmark flow ode solvers, speed against mel distance to the 10 step euler reference')
+    parser.add_argument('--model_dir',
+                        type=str,
+                        default='pretrained_models/CosyVoice2-0.5B',
+                        help='local path')
+    parser.add_argument('--prompt_wav',
+                        type=str,
+                        default='{}/../../asset/zero_shot_prompt.wav'.format(ROOT_DIR),
+                        help='prompt wav file')
+    parser.add_argument('--prompt_text',
+                        type=str,
+                        default='希望你以后能够做的比我还好呦。',
+                        help='prompt text')
+    parser.add_argument('--token_len',
+                        type=str,
+                        default='100,300',
+                        help='min,max speech token length of each request')
+    parser.add_argument('--num_requests',
+                        type=int,
+                        default=8,
+                        help='number of requests per config')
+    args = parser.parse_args()
+    print(args)
+    return args
+
+
+def sync():
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+@torch.inference_mode()
+def run_config(model, model_input, tokens, sampling):
+    mels, cost = [], 0
+    for token in tokens:
+        # NOTE same noise for every config, so mel distance only comes from the solver
+        torch.manual_seed(0)
+        sync()
+        start_time = time.time()
+        tts_mel, _ = model.flow.inference(token=token.to(model.device),
+                                          token_len=torch.tensor([token.shape[1]], dtype=torch.int32).to(model.device),
+                                          prompt_token=model_input['flow_prompt_speech_token'].to(model.device),
+                                          prompt_token_len=model_input['flow_prompt_speech_token_len'].to(model.device),
+                                          prompt_feat=model_input['prompt_speech_feat'].to(model.device),
+                                          prompt_feat_len=model_input['prompt_speech_feat_len'].to(model.device),
+                                          embedding=model_input['flow_embedding'].to(model.device),
+                                          streaming=False,
+                                          finalize=True,
+                                          sampling=sampling)
+        model.hift.inference(speech_feat=tts_mel)
+        sync()
+        cost += time.time() - start_time
+        mels.append(tts_mel.float().cpu())
+    return mels, cost
+
+
+def main():
+    args = get_args()
+    min_len, max_len = [int(i) for i in args.token_len.split(',')]
+    cosyvoice = CosyVoice2(args.model_dir)
+    prompt_speech_16k = load_wav(args.prompt_wav, 16000)
+    model_input = cosyvoice.frontend.frontend_zero_shot('', args.prompt_text, prompt_speech_16k, cosyvoice.sample_rate, '')
+    model = cosyvoice.model
+    random.seed(0)
+    tokens = [torch.randint(0, model.flow.vocab_size, (1, random.randint(min_len, max_len)), dtype=torch.int32) for _ in range(args.num_requests)]
+    mel_frame_rate = model.flow.input_frame_rate * model.flow.token_mel_ratio
+
+    # warmup
+    run_config(model, model_input, tokens[:1], CONFIGS[0])
+    ref_mels = None
+    print('{:>40s} {:>6s} {:>8s} {:>10s}'.format('config', 'nfe', 'rtf', 'mel l1'))
+    for sampling in CONFIGS:
+        mels, cost = run_config(model, model_input, tokens, sampling)
+        if ref_mels is None:
+            ref_mels = mels
+        rtf = cost / (sum(i.shape[2] for i in mels) / mel_frame_rate)
+        l1 = sum((i - j).abs().mean().item() for i, j in zip(mels, ref_mels)) / len(mels)
+        nfe = SOLVER_ORDER[sampling['solver']] * sampling['n_timesteps']
+        print('{:>40s} {:>6d} {:>8.4f} {:>10.4f}'.format(','.join('{}={}'.format(k, v) for k, v in sampling.items()), nfe, rtf, l1))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# Copyright (c) 2025 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import print_function
+
+import argparse
+import logging
+logging.getLogger('matplotlib').setLevel(logging.WARNING)
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append('{}/../..'.format(ROOT_DIR))
+sys.path.append('{}/../../third_party/Matcha-TTS'.format(ROOT_DIR))
+from cosyvoice.cli.cosyvoice import CosyVoice2
+from cosyvoice.utils.common import OrtSessionWrapper
+from cosyvoice.utils.file_utils import load_wav
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='benchmark prompt processing throughput against campplus and speech tokenizer session pool size')
+    parser.add_argument('--model_dir',
+                        type=str,
+                        default='pretrained_models/CosyVoice2-0.5B',
+                        help='local path')
+    parser.add_argument('--prompt_wav',
+                        type=str,
+                        default='{}/../../asset/zero_shot_prompt.wav'.format(ROOT_DIR),
+                        help='prompt wav file')
+    parser.add_argument('--pool_size',
+                        type=str,
+                        default='1,2,4,8',
+                        help='comma separated session pool sizes, also the number of concurrent requests')
+    parser.add_argument('--intra_op_threads',
+                        type=int,
+                        default=1,
+                        help='intra op threads of every session, 0 for onnxruntime default')
+    parser.add_argument('--inter_op_threads',
+                        type=int,
+                        default=0,
+                        help='inter op threads of every session, 0 for onnxruntime default')
+    parser.add_argument('--execution_mode',
+                        type=str,
+                        default='',
+                        help='sequential or parallel, empty to derive from inter_op_threads')
+    parser.add_argument('--provider',
+                        type=str,
+                        default='CPUExecutionProvider',
+                        help='onnxruntime execution provider of both pools')
+    parser.add_argument('--num_prompts',
+                        type=int,
+                        default=64,
+                        help='prompts processed per pool size')
+    args = parser.parse_args()
+    print(args)
+    return args
+
+
+def run(frontend, prompt_speech_16k, sample_rate, concurrency, num_prompts):
+    # NOTE no prompt feat cache, every request runs resample, feat extractor, speech tokenizer and campplus
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # warmup
+        list(executor.map(lambda _: frontend._extract_prompt_speech(prompt_speech_16k, sample_rate), range(concurrency)))
+        start_time = time.time()
+        list(executor.map(lambda _: frontend._extract_prompt_speech(prompt_speech_16k, sample_rate), range(num_prompts)))
+        return time.time() - start_time
+
+
+def main():
+    args = get_args()
+    cosyvoice = CosyVoice2(args.model_dir)
+    frontend = cosyvoice.frontend
+    frontend.prompt_cache = None
+    # NOTE model_dir may be a modelscope id, the onnx files are next to campplus of the loaded frontend
+    model_dir = os.path.dirname(frontend.model_files[0])
+    prompt_speech_16k = load_wav(args.prompt_wav, 16000)
+    print('{:>10s} {:>12s} {:>12s} {:>10s}'.format('pool size', 'seconds', 'prompts/s', 'speedup'))
+    base = None
+    for pool_size in [int(i) for i in args.pool_size.split(',')]:
+        conf = {'ort_concurrent': pool_size, 'intra_op_num_threads': args.intra_op_threads, 'inter_op_num_threads': args.inter_op_threads,
+                'execution_mode': args.execution_mode, 'providers': [args.provider]}
+        frontend.campplus_session = OrtSessionWrapper('{}/campplus.onnx'.format(model_dir), **conf)
+        frontend.speech_tokenizer_session = OrtSessionWrapper('{}/speech_tokenizer_v2.onnx'.format(model_dir), **conf)
+        cost = run(frontend, prompt_speech_16k, cosyvoice.sample_rate, pool_size, args.num_prompts)
+        base = cost if base is None else base
+        print('{:>10d} {:>12.3f} {:>12.2f} {:>9.2f}x'.format(pool_size, cost, args.num_prompts / cost, base / cost))
+
+
+if __name__ == "__main__":
+    main()
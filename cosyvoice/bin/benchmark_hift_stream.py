@@ -0,0 +1,92 @@
+# Copyright (c) 2025 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import print_function
+
+import argparse
+import logging
+logging.getLogger('matplotlib').setLevel(logging.WARNING)
+import os
+import sys
+import time
+import torch
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append('{}/../..'.format(ROOT_DIR))
+sys.path.append('{}/../../third_party/Matcha-TTS'.format(ROOT_DIR))
+from cosyvoice.cli.cosyvoice import CosyVoice2
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='benchmark streaming hift with hift cache and fade in out against stateful hift')
+    parser.add_argument('--model_dir',
+                        type=str,
+                        default='pretrained_models/CosyVoice2-0.5B',
+                        help='local path')
+    parser.add_argument('--mel_len',
+                        type=str,
+                        default='500,1000,2000',
+                        help='comma separated mel lengths')
+    parser.add_argument('--chunk_len',
+                        type=int,
+                        default=50,
+                        help='mel frames per chunk, token_hop_len * token_mel_ratio by default')
+    args = parser.parse_args()
+    print(args)
+    return args
+
+
+def sync():
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+def run_stream(model, mel, chunk_len, stateful):
+    model.stateful_hift = stateful
+    model.hift_cache_dict['benchmark'] = None
+    speech = []
+    sync()
+    start_time = time.time()
+    for i in range(0, mel.shape[2], chunk_len):
+        finalize = i + chunk_len >= mel.shape[2]
+        speech.append(model.mel2wav(mel[:, :, i: i + chunk_len], 'benchmark', finalize=finalize))
+    sync()
+    model.hift_cache_dict.pop('benchmark')
+    return time.time() - start_time, speech
+
+
+def main():
+    args = get_args()
+    cosyvoice = CosyVoice2(args.model_dir)
+    model = cosyvoice.model
+    stateful_hift = model.stateful_hift
+    print('{:>8s} {:>10s} {:>10s} {:>10s} {:>14s} {:>14s} {:>14s}'.format('mel_len', 'cache rtf', 'state rtf', 'speedup', 'cache samples', 'state samples',
+                                                                          'first chunk'))
+    for mel_len in [int(i) for i in args.mel_len.split(',')]:
+        mel = torch.randn(1, 80, mel_len, device=model.device)
+        result = {}
+        for stateful in [False, True]:
+            # warmup
+            run_stream(model, mel[:, :, :args.chunk_len * 2], args.chunk_len, stateful)
+            result[stateful] = run_stream(model, mel, args.chunk_len, stateful)
+        duration = sum([i.shape[1] for i in result[False][1]]) / cosyvoice.sample_rate
+        print('{:>8d} {:>10.4f} {:>10.4f} {:>9.2f}x {:>14d} {:>14d} {:>7d}/{:<6d}'.format(mel_len, result[False][0] / duration, result[True][0] / duration,
+                                                                                      result[False][0] / result[True][0],
+                                                                                      sum([i.shape[1] for i in result[False][1]]),
+                                                                                      sum([i.shape[1] for i in result[True][1]]),
+                                                                                      result[False][1][0].shape[1], result[True][1][0].shape[1]))
+    model.stateful_hift = stateful_hift
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# Copyright (c) 2025 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import print_function
+
+import argparse
+import logging
+logging.getLogger('matplotlib').setLevel(logging.WARNING)
+import os
+import sys
+import time
+import numpy as np
+import torch
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append('{}/../..'.format(ROOT_DIR))
+sys.path.append('{}/../../third_party/Matcha-TTS'.format(ROOT_DIR))
+from cosyvoice.cli.cosyvoice import CosyVoice2
+from cosyvoice.utils.file_utils import logging
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='benchmark llm per token decode latency against sequence length')
+    parser.add_argument('--model_dir',
+                        type=str,
+                        default='pretrained_models/CosyVoice2-0.5B',
+                        help='local path')
+    parser.add_argument('--prompt_len',
+                        type=int,
+                        default=200,
+                        help='prefill length')
+    parser.add_argument('--num_steps',
+                        type=int,
+                        default=2000,
+                        help='number of decode steps')
+    parser.add_argument('--bucket',
+                        type=int,
+                        default=250,
+                        help='report mean latency every bucket steps')
+    args = parser.parse_args()
+    print(args)
+    return args
+
+
+def sync():
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+@torch.inference_mode()
+def run_once(llm, args, device):
+    torch.manual_seed(0)
+    lm_input = torch.randn(1, args.prompt_len, llm.llm_input_size, device=device)
+    cache = llm.new_decode_cache(args.prompt_len + args.num_steps)
+    y_pred, cache = llm.decode_step(lm_input, cache)
+    latency = []
+    for i in range(args.num_steps):
+        # NOTE feed random speech tokens, only the cost of each step matters here
+        lm_input = llm.speech_embedding.weight[i % llm.speech_token_size].reshape(1, 1, -1)
+        sync()
+        start_time = time.time()
+        y_pred, cache = llm.decode_step(lm_input, cache)
+        llm.llm_decoder(y_pred[:, -1])
+        sync()
+        latency.append(time.time() - start_time)
+    return latency
+
+
+def main():
+    args = get_args()
+    cosyvoice = CosyVoice2(args.model_dir)
+    llm, device = cosyvoice.model.llm, cosyvoice.model.device
+
+    results = {}
+    for mode in ['default', 'static']:
+        llm.static_kv_cache = mode == 'static'
+        # warmup
+        run_once(llm, args, device)
+        results[mode] = run_once(llm, args, device)
+        logging.info('mode {} mean per token latency {:.2f}ms'.format(mode, np.mean(results[mode]) * 1000))
+    print('{:>12s} {:>12s} {:>12s}'.format('seq_len', 'default ms', 'static ms'))
+    for start in range(0, args.num_steps, args.bucket):
+        print('{:>12d} {:>12.2f} {:>12.2f}'.format(args.prompt_len + start,
+                                                   np.mean(results['default'][start: start + args.bucket]) * 1000,
+                                                   np.mean(results['static'][start: start + args.bucket]) * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# Copyright (c) 2025 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import print_function
+
+import argparse
+import logging
+logging.getLogger('matplotlib').setLevel(logging.WARNING)
+import os
+import sys
+import threading
+import time
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append('{}/../..'.format(ROOT_DIR))
+sys.path.append('{}/../../third_party/Matcha-TTS'.format(ROOT_DIR))
+from cosyvoice.cli.cosyvoice import CosyVoice2
+from cosyvoice.utils.common import set_all_random_seed
+from cosyvoice.utils.file_utils import load_wav, logging
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='benchmark llm decode throughput')
+    parser.add_argument('--model_dir',
+                        type=str,
+                        default='pretrained_models/CosyVoice2-0.5B',
+                        help='local path')
+    parser.add_argument('--prompt_wav',
+                        type=str,
+                        default='{}/../../asset/zero_shot_prompt.wav'.format(ROOT_DIR),
+                        help='prompt wav file')
+    parser.add_argument('--prompt_text',
+                        type=str,
+                        default='希望你以后能够做的比我还好呦。',
+                        help='prompt text')
+    parser.add_argument('--tts_text',
+                        type=str,
+                        default='收到好友从远方寄来的生日礼物，那份意外的惊喜与深深的祝福让我心中充满了甜蜜的快乐，笑容如花儿般绽放。',
+                        help='tts text')
+    parser.add_argument('--concurrency',
+                        type=str,
+                        default='1,4,8,16',
+                        help='comma separated concurrency levels')
+    parser.add_argument('--mode',
+                        default='batch',
+                        choices=['batch', 'speculative'],
+                        help='decode mode to compare against the default batch 1 decode')
+    args = parser.parse_args()
+    print(args)
+    return args
+
+
+def run_concurrent(llm, model_input, concurrency, device):
+    num_tokens = [0] * concurrency
+
+    def job(index):
+        for _ in llm.inference(text=model_input['text'].to(device),
+                               text_len=model_input['text_len'].clone().to(device),
+                               prompt_text=model_input['prompt_text'].to(device),
+                               prompt_text_len=model_input['prompt_text_len'].to(device),
+                               prompt_speech_token=model_input['llm_prompt_speech_token'].to(device),
+                               prompt_speech_token_len=model_input['llm_prompt_speech_token_len'].to(device),
+                               embedding=model_input['llm_embedding'].to(device),
+                               uuid='benchmark_{}'.format(index)):
+            num_tokens[index] += 1
+
+    threads = [threading.Thread(target=job, args=(i,)) for i in range(concurrency)]
+    start_time = time.time()
+    for p in threads:
+        p.start()
+    for p in threads:
+        p.join()
+    return sum(num_tokens), time.time() - start_time
+
+
+def main():
+    args = get_args()
+    concurrency_list = [int(i) for i in args.concurrency.split(',')]
+    cosyvoice = CosyVoice2(args.model_dir)
+    prompt_speech_16k = load_wav(args.prompt_wav, 16000)
+    model_input = cosyvoice.frontend.frontend_zero_shot(args.tts_text, args.prompt_text, prompt_speech_16k, cosyvoice.sample_rate, '')
+    llm, device = cosyvoice.model.llm, cosyvoice.model.device
+
+    results = {}
+    for mode in ['default', args.mode]:
+        if mode == 'batch':
+            cosyvoice.model.load_batch_decode(max(concurrency_list))
+        elif mode == 'speculative':
+            cosyvoice.model.load_speculative()
+        for concurrency in concurrency_list:
+            set_all_random_seed(0)
+            num_tokens, cost = run_concurrent(llm, model_input, concurrency, device)
+            results[(mode, concurrency)] = num_tokens / cost
+            logging.info('mode {} concurrency {} tokens {} time {:.3f}s tokens/s {:.2f}'.format(mode, concurrency, num_tokens, cost, num_tokens / cost))
+        if mode == 'speculative':
+            logging.info('speculative stats {}'.format(llm.speculative.get_stats()))
+    for concurrency in concurrency_list:
+        print('concurrency {:>3d} default {:>8.2f} tokens/s {} {:>8.2f} tokens/s speedup {:.2f}x'.format(
+            concurrency, results[('default', concurrency)], args.mode, results[(args.mode, concurrency)],
+            results[(args.mode, concurrency)] / results[('default', concurrency)]))
+
+
+if __name__ == "__main__":
+    main()
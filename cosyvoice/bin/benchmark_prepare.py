@@ -0,0 +1,117 @@
+# Copyright (c) 2025 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import print_function
+
+import argparse
+import logging
+logging.getLogger('matplotlib').setLevel(logging.WARNING)
+import os
+import sys
+import time
+import torch
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append('{}/../..'.format(ROOT_DIR))
+sys.path.append('{}/../../third_party/Matcha-TTS'.format(ROOT_DIR))
+from cosyvoice.cli.cosyvoice import CosyVoice2
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='benchmark every module before and after CosyVoiceModel.prepare_for_inference')
+    parser.add_argument('--model_dir',
+                        type=str,
+                        default='pretrained_models/CosyVoice2-0.5B',
+                        help='local path')
+    parser.add_argument('--token_len',
+                        type=int,
+                        default=100,
+                        help='number of speech tokens, mel length is token_len * token_mel_ratio')
+    parser.add_argument('--chunk_len',
+                        type=int,
+                        default=50,
+                        help='mel frames per chunk of streaming hift')
+    parser.add_argument('--num_runs',
+                        type=int,
+                        default=5,
+                        help='best of num_runs is reported')
+    args = parser.parse_args()
+    print(args)
+    return args
+
+
+def sync():
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+@torch.inference_mode()
+def run(fn, num_runs):
+    # warmup
+    output = fn()
+    cost = []
+    for _ in range(num_runs):
+        sync()
+        start_time = time.time()
+        fn()
+        sync()
+        cost.append(time.time() - start_time)
+    return min(cost), output[0] if isinstance(output, tuple) else output
+
+
+def hift_stream(hift, mel, chunk_len):
+    speech, cache = [], None
+    for i in range(0, mel.shape[2], chunk_len):
+        this_speech, cache = hift.inference_stream(mel[:, :, i: i + chunk_len], cache, finalize=i + chunk_len >= mel.shape[2])
+        speech.append(this_speech)
+    return torch.concat(speech, dim=1)
+
+
+def main():
+    args = get_args()
+    cosyvoice = CosyVoice2(args.model_dir, prepare_for_inference=False)
+    model = cosyvoice.model
+    device = model.device
+    mel_len = args.token_len * model.flow.token_mel_ratio
+    inputs = {
+        'llm.llm': lambda: model.llm.llm(torch.randn(1, args.token_len, model.llm.llm_input_size, device=device),
+                                         torch.tensor([args.token_len], device=device)),
+        'flow.encoder': lambda: model.flow.encoder(torch.randn(1, args.token_len, model.flow.input_size, device=device),
+                                                   torch.tensor([args.token_len], device=device)),
+        'flow.decoder.estimator': lambda: model.flow.decoder.estimator(torch.randn(2, 80, mel_len, device=device),
+                                                                       torch.ones(2, 1, mel_len, device=device),
+                                                                       torch.randn(2, 80, mel_len, device=device),
+                                                                       torch.rand(2, device=device),
+                                                                       torch.randn(2, 80, device=device),
+                                                                       torch.randn(2, 80, mel_len, device=device)),
+        'hift.f0_predictor': lambda: model.hift.f0_predictor(torch.randn(1, 80, mel_len, device=device)),
+        'hift': lambda: model.hift.inference(torch.randn(1, 80, mel_len, device=device)),
+        'hift stream': lambda: hift_stream(model.hift, torch.randn(1, 80, mel_len, device=device), args.chunk_len),
+    }
+    result = {}
+    for prepared in [False, True]:
+        if prepared:
+            model.prepare_for_inference()
+        for name, fn in inputs.items():
+            # NOTE same random inputs and hift source noise before and after
+            torch.manual_seed(0)
+            result[(name, prepared)] = run(fn, args.num_runs)
+    print('{:>24s} {:>12s} {:>12s} {:>10s} {:>12s}'.format('module', 'before ms', 'after ms', 'speedup', 'max diff'))
+    for name in inputs.keys():
+        before, after = result[(name, False)], result[(name, True)]
+        print('{:>24s} {:>12.2f} {:>12.2f} {:>9.2f}x {:>12.3e}'.format(name, before[0] * 1000, after[0] * 1000, before[0] / after[0],
+                                                                        (before[1].float() - after[1].float()).abs().max().item()))
+
+
+if __name__ == "__main__":
+    main()
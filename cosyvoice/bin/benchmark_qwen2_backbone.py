@@ -0,0 +1,109 @@
+# Copyright (c) 2025 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import print_function
+
+import argparse
+import logging
+logging.getLogger('matplotlib').setLevel(logging.WARNING)
+import os
+import sys
+import time
+import numpy as np
+import torch
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append('{}/../..'.format(ROOT_DIR))
+sys.path.append('{}/../../third_party/Matcha-TTS'.format(ROOT_DIR))
+from cosyvoice.cli.cosyvoice import CosyVoice2
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='benchmark lean qwen2 backbone against the full Qwen2ForCausalLM call')
+    parser.add_argument('--model_dir',
+                        type=str,
+                        default='pretrained_models/CosyVoice2-0.5B',
+                        help='local path')
+    parser.add_argument('--prompt_len',
+                        type=int,
+                        default=300,
+                        help='prefill length')
+    parser.add_argument('--num_steps',
+                        type=int,
+                        default=500,
+                        help='number of decode steps')
+    args = parser.parse_args()
+    print(args)
+    return args
+
+
+def full_step(qwen2, xs, cache):
+    # the call Qwen2Encoder used to make, all hidden states and text vocab logits
+    outs = qwen2(inputs_embeds=xs, output_hidden_states=True, return_dict=True, use_cache=True, past_key_values=cache)
+    return outs.hidden_states[-1], outs.past_key_values
+
+
+def lean_step(qwen2, xs, cache):
+    outs = qwen2.model(inputs_embeds=xs, return_dict=True, use_cache=True, past_key_values=cache)
+    return outs.last_hidden_state, outs.past_key_values
+
+
+def sync():
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+@torch.inference_mode()
+def run_once(step_fn, llm, args, device):
+    torch.manual_seed(0)
+    if torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats()
+    base_memory = torch.cuda.memory_allocated() if torch.cuda.is_available() else 0
+    sync()
+    start_time = time.time()
+    y_pred, cache = step_fn(llm.llm.model, torch.randn(1, args.prompt_len, llm.llm_input_size, device=device), None)
+    sync()
+    prefill_time = time.time() - start_time
+    latency = []
+    for i in range(args.num_steps):
+        lm_input = llm.speech_embedding.weight[i % llm.speech_token_size].reshape(1, 1, -1)
+        sync()
+        start_time = time.time()
+        y_pred, cache = step_fn(llm.llm.model, lm_input, cache)
+        llm.llm_decoder(y_pred[:, -1])
+        sync()
+        latency.append(time.time() - start_time)
+    peak_memory = torch.cuda.max_memory_allocated() - base_memory if torch.cuda.is_available() else 0
+    return prefill_time, latency, peak_memory
+
+
+def main():
+    args = get_args()
+    cosyvoice = CosyVoice2(args.model_dir)
+    llm, device = cosyvoice.model.llm, cosyvoice.model.device
+    config = llm.llm.model.config
+    dtype_size = next(llm.parameters()).element_size()
+    # activations the full call materializes on top of the lean one, per input position
+    extra_bytes = (config.num_hidden_layers * config.hidden_size + config.vocab_size) * dtype_size
+    print('extra activation per position {:.1f}KB, prefill of {} positions {:.1f}MB'.format(
+        extra_bytes / 1024, args.prompt_len, extra_bytes * args.prompt_len / 1024 / 1024))
+    for name, step_fn in [('full', full_step), ('lean', lean_step)]:
+        # warmup
+        run_once(step_fn, llm, args, device)
+        prefill_time, latency, peak_memory = run_once(step_fn, llm, args, device)
+        print('{} prefill {:.2f}ms decode step mean {:.2f}ms p90 {:.2f}ms peak memory {:.1f}MB'.format(
+            name, prefill_time * 1000, np.mean(latency) * 1000, np.percentile(latency, 90) * 1000, peak_memory / 1024 / 1024))
+
+
+if __name__ == "__main__":
+    main()
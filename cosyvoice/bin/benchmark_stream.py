@@ -0,0 +1,96 @@
+# Copyright (c) 2025 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import print_function
+
+import argparse
+import logging
+logging.getLogger('matplotlib').setLevel(logging.WARNING)
+import os
+import sys
+import time
+import numpy as np
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append('{}/../..'.format(ROOT_DIR))
+sys.path.append('{}/../../third_party/Matcha-TTS'.format(ROOT_DIR))
+from cosyvoice.cli.cosyvoice import CosyVoice2
+from cosyvoice.utils.common import set_all_random_seed
+from cosyvoice.utils.file_utils import load_wav, logging
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='benchmark streaming latency')
+    parser.add_argument('--model_dir',
+                        type=str,
+                        default='pretrained_models/CosyVoice2-0.5B',
+                        help='local path')
+    parser.add_argument('--prompt_wav',
+                        type=str,
+                        default='{}/../../asset/zero_shot_prompt.wav'.format(ROOT_DIR),
+                        help='prompt wav file')
+    parser.add_argument('--prompt_text',
+                        type=str,
+                        default='希望你以后能够做的比我还好呦。',
+                        help='prompt text')
+    parser.add_argument('--tts_text',
+                        type=str,
+                        default='收到好友从远方寄来的生日礼物，那份意外的惊喜与深深的祝福让我心中充满了甜蜜的快乐，笑容如花儿般绽放。',
+                        help='tts text')
+    parser.add_argument('--num_runs',
+                        type=int,
+                        default=5,
+                        help='number of measured runs')
+    args = parser.parse_args()
+    print(args)
+    return args
+
+
+def run_once(cosyvoice, args, prompt_speech_16k):
+    start_time = time.time()
+    first_packet_latency, chunk_latency, speech_len = None, [], 0
+    last_time = start_time
+    for model_output in cosyvoice.inference_zero_shot(args.tts_text, args.prompt_text, prompt_speech_16k, stream=True, text_frontend=False):
+        this_time = time.time()
+        if first_packet_latency is None:
+            first_packet_latency = this_time - start_time
+        else:
+            chunk_latency.append(this_time - last_time)
+        last_time = this_time
+        speech_len += model_output['tts_speech'].shape[1] / cosyvoice.sample_rate
+    return first_packet_latency, chunk_latency, (time.time() - start_time) / speech_len
+
+
+def main():
+    args = get_args()
+    cosyvoice = CosyVoice2(args.model_dir)
+    prompt_speech_16k = load_wav(args.prompt_wav, 16000)
+    # warmup
+    run_once(cosyvoice, args, prompt_speech_16k)
+
+    first_packet_latency, chunk_latency, rtf = [], [], []
+    for i in range(args.num_runs):
+        set_all_random_seed(i)
+        this_first_packet_latency, this_chunk_latency, this_rtf = run_once(cosyvoice, args, prompt_speech_16k)
+        logging.info('run {} first packet latency {:.3f}s rtf {:.3f}'.format(i, this_first_packet_latency, this_rtf))
+        first_packet_latency.append(this_first_packet_latency)
+        chunk_latency += this_chunk_latency
+        rtf.append(this_rtf)
+    print('first packet latency mean {:.3f}s p90 {:.3f}s'.format(np.mean(first_packet_latency), np.percentile(first_packet_latency, 90)))
+    if len(chunk_latency) != 0:
+        print('chunk interval mean {:.3f}s p90 {:.3f}s'.format(np.mean(chunk_latency), np.percentile(chunk_latency, 90)))
+    print('rtf mean {:.3f}'.format(np.mean(rtf)))
+
+
+if __name__ == "__main__":
+    main()
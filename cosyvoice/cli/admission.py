@@ -0,0 +1,256 @@
+# Copyright (c) 2025 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+import numpy as np
+
+
+class AdmissionRejected(RuntimeError):
+    pass
+
+
+class AdmissionTicket:
+    """One request waiting in or running under AdmissionController."""
+
+    def __init__(self, priority: int, deadline: float, interactive: bool, text_len: int, cost: float):
+        self.priority = priority
+        self.deadline = deadline
+        self.interactive = interactive
+        self.text_len = text_len
+        # estimated run time in seconds
+        self.cost = cost
+        self.submit_time = time.time()
+        self.start_time = None
+        self.running = False
+        self.done = False
+        # paused by AdmissionController.checkpoint until _resume_preempted
+        self.preempted = False
+        self.num_preempted = 0
+
+    def sort_key(self, seq):
+        return (0 if self.interactive else 1, self.priority, self.deadline if self.deadline is not None else float('inf'), seq)
+
+
+class AdmissionController:
+    """Priority and deadline aware admission in front of CosyVoice/CosyVoice2 inference_*.
+
+    At most max_concurrency requests run at the same time, the others wait in a queue
+    ordered by (interactive first, priority, deadline). Run time is estimated from text
+    token count and prompt length, scaled by the measured rtf, a request whose deadline
+    can not be met is rejected with AdmissionRejected instead of queued.
+
+    Running non interactive requests are checked between llm decode steps, see
+    CosyVoiceModel.append_speech_token, they give up their slot while an interactive
+    request is waiting and resume once it is admitted. A preempted request is paused
+    where it is decoded: ContinuousBatchScheduler takes it out of the decode batch,
+    batch 1 decode waits in CosyVoiceModel.llm_job, see is_paused.
+    """
+
+    def __init__(self, cosyvoice, max_concurrency: int = 2, max_queue: int = 64,
+                 speech_per_text_token: float = 0.25, rtf: float = 1.0, prompt_cost: float = 0.05):
+        self.cosyvoice = cosyvoice
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        # estimated seconds of speech per text token, and seconds of compute per second of speech, both updated online
+        self.speech_per_text_token = speech_per_text_token
+        self.rtf = rtf
+        # seconds of compute per second of prompt speech, covers prefill of the prompt
+        self.prompt_cost = prompt_cost
+        self.cond = threading.Condition()
+        self.queue = []
+        self.seq = itertools.count()
+        self.num_running = 0
+        self.local = threading.local()
+        self.uuid2ticket = {}
+        # preempted tickets, resumed first in first out
+        self.preempted = []
+        # statistics
+        self.num_admitted = 0
+        self.num_rejected = 0
+        self.num_preempted = 0
+        self.wait_time = deque(maxlen=1000)
+        cosyvoice.model.admission = self
+        if hasattr(cosyvoice.model.llm, 'batch_scheduler'):
+            cosyvoice.model.llm.batch_scheduler.pause_fn = self.is_paused
+
+    def get_text_len(self, tts_text):
+        # NOTE streaming text input has unknown length
+        if not isinstance(tts_text, str):
+            return 0
+        _, text_len = self.cosyvoice.frontend._extract_text_token(tts_text)
+        return int(text_len.item())
+
+    def estimate_cost(self, text_len: int, prompt_len: float = 0):
+        return text_len * self.speech_per_text_token * self.rtf + prompt_len * self.prompt_cost
+
+    def _waiting_interactive(self):
+        return any(t.interactive for _, t in self.queue)
+
+    def _can_start(self, ticket):
+        return self.num_running < self.max_concurrency and len(self.queue) != 0 and self.queue[0][1] is ticket
+
+    def _expected_wait(self, key):
+        # work ahead of this request, spread over all slots
+        ahead = sum(t.cost for k, t in self.queue if k < key)
+        return ahead / self.max_concurrency if self.num_running + len(self.queue) >= self.max_concurrency else 0
+
+    def _enqueue(self, ticket):
+        with self.cond:
+            if len(self.queue) >= self.max_queue:
+                self.num_rejected += 1
+                raise AdmissionRejected('queue is full, depth {}'.format(len(self.queue)))
+            key = ticket.sort_key(next(self.seq))
+            if ticket.deadline is not None and time.time() + self._expected_wait(key) + ticket.cost > ticket.deadline:
+                self.num_rejected += 1
+                raise AdmissionRejected('can not meet deadline, estimated cost {:.3f}s'.format(ticket.cost))
+            heapq.heappush(self.queue, (key, ticket))
+            while not self._can_start(ticket):
+                if ticket.deadline is not None and time.time() + ticket.cost > ticket.deadline:
+                    self.queue.remove((key, ticket))
+                    heapq.heapify(self.queue)
+                    self.num_rejected += 1
+                    self._resume_preempted()
+                    self.cond.notify_all()
+                    raise AdmissionRejected('deadline expired while queued')
+                self.cond.wait(timeout=0.05 if ticket.deadline is not None else None)
+            heapq.heappop(self.queue)
+            self.num_running += 1
+            self.num_admitted += 1
+            ticket.running = True
+            ticket.start_time = time.time()
+            self.wait_time.append(ticket.start_time - ticket.submit_time)
+            self._resume_preempted()
+            self.cond.notify_all()
+
+    def _release(self, ticket, speech_len):
+        with self.cond:
+            if ticket.running is True:
+                self.num_running -= 1
+                ticket.running = False
+            ticket.done = True
+            if ticket.preempted is True:
+                ticket.preempted = False
+                self.preempted.remove(ticket)
+            for k in [k for k, t in self.uuid2ticket.items() if t is ticket]:
+                self.uuid2ticket.pop(k)
+            if speech_len > 0 and ticket.text_len > 0:
+                self.speech_per_text_token = 0.9 * self.speech_per_text_token + 0.1 * speech_len / ticket.text_len
+            # preempted requests spent part of their time paused, their rtf is not representative
+            if speech_len > 0 and ticket.num_preempted == 0:
+                self.rtf = 0.9 * self.rtf + 0.1 * (time.time() - ticket.start_time) / speech_len
+            self._resume_preempted()
+            self.cond.notify_all()
+
+    def _resume_preempted(self):
+        """Called with cond held whenever slots or the queue change."""
+        resumed = False
+        while len(self.preempted) != 0 and not self._waiting_interactive() and self.num_running < self.max_concurrency:
+            ticket = self.preempted.pop(0)
+            ticket.preempted = False
+            ticket.running = True
+            self.num_running += 1
+            resumed = True
+        if resumed is True and hasattr(self.cosyvoice.model.llm, 'batch_scheduler'):
+            self.cosyvoice.model.llm.batch_scheduler.wake()
+
+    def bind(self, uuid):
+        """Called by CosyVoiceModel.tts in the caller thread, links the model uuid to the current ticket."""
+        ticket = getattr(self.local, 'ticket', None)
+        if ticket is not None:
+            with self.cond:
+                self.uuid2ticket[uuid] = ticket
+
+    def unbind(self, uuid):
+        with self.cond:
+            self.uuid2ticket.pop(uuid, None)
+            # an unbound session is never paused, wake up wait_resumed
+            self.cond.notify_all()
+
+    def is_paused(self, uuid):
+        """Whether the session of uuid is preempted, asked by the decode loop every step so no lock is taken."""
+        ticket = self.uuid2ticket.get(uuid)
+        return ticket is not None and ticket.preempted is True
+
+    def wait_resumed(self, uuid):
+        """Block a batch 1 decode thread while its session is preempted."""
+        with self.cond:
+            self.cond.wait_for(lambda: not self.is_paused(uuid))
+
+    def checkpoint(self, uuid):
+        """Called between decode steps, preempts a non interactive request while interactive ones wait, never blocks."""
+        with self.cond:
+            ticket = self.uuid2ticket.get(uuid)
+            if ticket is None or ticket.interactive is True or ticket.running is False:
+                return
+            if not (self._waiting_interactive() and self.num_running >= self.max_concurrency):
+                return
+            ticket.running = False
+            ticket.preempted = True
+            ticket.num_preempted += 1
+            self.preempted.append(ticket)
+            self.num_running -= 1
+            self.num_preempted += 1
+            self.cond.notify_all()
+
+    def inference(self, method, tts_text, *args, priority=1, deadline=None, interactive=None, prompt_len=0, **kwargs):
+        """Run cosyvoice.<method> once admitted, deadline is seconds from now."""
+        if interactive is None:
+            interactive = kwargs.get('stream', False)
+        text_len = self.get_text_len(tts_text)
+        ticket = AdmissionTicket(priority, time.time() + deadline if deadline is not None else None, interactive,
+                                 text_len, self.estimate_cost(text_len, prompt_len))
+        self._enqueue(ticket)
+        speech_len = 0
+        try:
+            model_outputs = getattr(self.cosyvoice, method)(tts_text, *args, **kwargs)
+            while True:
+                # NOTE the generator may be advanced from different threads, e.g. by the asyncio api
+                self.local.ticket = ticket
+                try:
+                    model_output = next(model_outputs)
+                except StopIteration:
+                    break
+                finally:
+                    self.local.ticket = None
+                speech_len += model_output['tts_speech'].shape[1] / self.cosyvoice.sample_rate
+                yield model_output
+        finally:
+            self._release(ticket, speech_len)
+
+    def inference_sft(self, tts_text, spk_id, **kwargs):
+        return self.inference('inference_sft', tts_text, spk_id, **kwargs)
+
+    def inference_zero_shot(self, tts_text, prompt_text, prompt_speech_16k, **kwargs):
+        return self.inference('inference_zero_shot', tts_text, prompt_text, prompt_speech_16k,
+                              prompt_len=prompt_speech_16k.shape[1] / 16000, **kwargs)
+
+    def inference_cross_lingual(self, tts_text, prompt_speech_16k, **kwargs):
+        return self.inference('inference_cross_lingual', tts_text, prompt_speech_16k,
+                              prompt_len=prompt_speech_16k.shape[1] / 16000, **kwargs)
+
+    def inference_instruct2(self, tts_text, instruct_text, prompt_speech_16k, **kwargs):
+        return self.inference('inference_instruct2', tts_text, instruct_text, prompt_speech_16k,
+                              prompt_len=prompt_speech_16k.shape[1] / 16000, **kwargs)
+
+    def get_stats(self):
+        with self.cond:
+            wait_time = list(self.wait_time)
+            stats = {'queue_depth': len(self.queue), 'running': self.num_running, 'paused': len(self.preempted), 'admitted': self.num_admitted,
+                     'rejected': self.num_rejected, 'preempted': self.num_preempted, 'rtf': self.rtf}
+        stats['wait_time_mean'] = float(np.mean(wait_time)) if len(wait_time) != 0 else 0.0
+        stats['wait_time_p90'] = float(np.percentile(wait_time, 90)) if len(wait_time) != 0 else 0.0
+        return stats
@@ -13,20 +13,70 @@
 # limitations under the License.
 import os
 import time
+import asyncio
+import threading
 from typing import Generator
 from tqdm import tqdm
 from hyperpyyaml import load_hyperpyyaml
 from modelscope import snapshot_download
 import torch
+from cosyvoice.cli.admission import AdmissionController
 from cosyvoice.cli.frontend import CosyVoiceFrontEnd
 from cosyvoice.cli.model import CosyVoiceModel, CosyVoice2Model
-from cosyvoice.utils.file_utils import logging
+from cosyvoice.utils.file_utils import logging, load_wav, read_prompt_dir
 from cosyvoice.utils.class_utils import get_model_type
 
 
+# serving options of CosyVoice/CosyVoice2, passed as serving_conf and merged group by group, e.g.
+# serving_conf={'batching': {'llm_batch_size': 8}, 'caches': {'prompt_cache_size': 16}}
+DEFAULT_SERVING_CONF = {
+    # llm continuous batch decode, flow decoder and hift batch sizes, 0 to disable
+    # NOTE batched hift is not bit-exact with batch 1 vocoding (about 1e-5), so it is opt-in
+    'batching': {'llm_batch_size': 0, 'flow_batch_size': 0, 'hift_batch_size': 0},
+    # batch 1 llm decode, only used without llm batching, sampler_seed also applies to batch decode
+    'decode': {'static_kv_cache': False, 'num_draft': 0, 'sampler_seed': None},
+    'caches': {'prefix_cache_mb': 0, 'encoder_chunk_cache': False, 'decoder_chunk_cache_len': 0, 'spk_cond_cache_size': 0,
+               'spk_cond_cache_warmup': 0, 'prompt_cache_size': 0, 'prompt_cache_dir': '', 'stateful_hift': False},
+    # cpu flow decoder estimator, see CosyVoice2Model.load_onnx
+    'onnx': {'load_onnx': False, 'onnx_concurrent': 1, 'intra_op_num_threads': 0, 'inter_op_num_threads': 0},
+    # onnxruntime session pools of campplus and the speech tokenizer, see CosyVoiceFrontEnd
+    'frontend': {'campplus_conf': None, 'speech_tokenizer_conf': None},
+    # AdmissionController keywords, None to run without admission control
+    'admission': None,
+}
+# serving options supported by CosyVoice, the others are only implemented for CosyVoice2
+COSYVOICE_SERVING_CONF = {
+    'caches': ['prompt_cache_size', 'prompt_cache_dir'],
+    'frontend': ['campplus_conf', 'speech_tokenizer_conf'],
+    'admission': None,
+}
+
+
+def get_serving_conf(serving_conf=None, supported=None):
+    """Merge serving_conf into DEFAULT_SERVING_CONF, supported limits the groups and keys which may be passed."""
+    conf = {k: dict(v) if isinstance(v, dict) else v for k, v in DEFAULT_SERVING_CONF.items()}
+    for group, value in (serving_conf or {}).items():
+        assert group in conf, 'unknown serving_conf group {}'.format(group)
+        assert supported is None or group in supported, 'serving_conf group {} is not supported by this model'.format(group)
+        if isinstance(conf[group], dict):
+            unknown = set(value.keys()) - set(conf[group].keys())
+            assert len(unknown) == 0, 'unknown serving_conf keys {} in {}'.format(sorted(unknown), group)
+            unsupported = set(value.keys()) - set(supported[group]) if supported is not None else set()
+            assert len(unsupported) == 0, 'serving_conf keys {} in {} are not supported by this model'.format(sorted(unsupported), group)
+            conf[group].update(value)
+        else:
+            conf[group] = value
+    return conf
+
+
 class CosyVoice:
+    # max chunks produced ahead of the consumer of ainference_* async generators
+    async_queue_size = 2
 
-    def __init__(self, model_dir, load_jit=False, load_trt=False, fp16=False, trt_concurrent=1):
+    def __init__(self, model_dir, load_jit=False, load_trt=False, fp16=False, trt_concurrent=1, prepare_for_inference=False,
+                 serving_conf=None):
+        serving_conf = get_serving_conf(serving_conf, supported=COSYVOICE_SERVING_CONF)
+        caches, frontend = serving_conf['caches'], serving_conf['frontend']
         self.instruct = True if '-Instruct' in model_dir else False
         self.model_dir = model_dir
         self.fp16 = fp16
@@ -43,7 +93,13 @@ class CosyVoice:
                                           '{}/campplus.onnx'.format(model_dir),
                                           '{}/speech_tokenizer_v1.onnx'.format(model_dir),
                                           '{}/spk2info.pt'.format(model_dir),
-                                          configs['allowed_special'])
+                                          configs['allowed_special'],
+                                          frontend['campplus_conf'],
+                                          frontend['speech_tokenizer_conf'],
+                                          configs['flow'].input_frame_rate)
+        if caches['prompt_cache_size'] > 0 or caches['prompt_cache_dir'] != '':
+            # NOTE prompt_cache_size 0 with prompt_cache_dir keeps nothing in memory, only on disk
+            self.frontend.load_prompt_cache(max_entries=caches['prompt_cache_size'], cache_dir=caches['prompt_cache_dir'])
         self.sample_rate = configs['sample_rate']
         if torch.cuda.is_available() is False and (load_jit is True or load_trt is True or fp16 is True):
             load_jit, load_trt, fp16 = False, False, False
@@ -52,6 +108,8 @@ class CosyVoice:
         self.model.load('{}/llm.pt'.format(model_dir),
                         '{}/flow.pt'.format(model_dir),
                         '{}/hift.pt'.format(model_dir))
+        if prepare_for_inference:
+            self.model.prepare_for_inference()
         if load_jit:
             self.model.load_jit('{}/llm.text_encoder.{}.zip'.format(model_dir, 'fp16' if self.fp16 is True else 'fp32'),
                                 '{}/llm.llm.{}.zip'.format(model_dir, 'fp16' if self.fp16 is True else 'fp32'),
@@ -61,6 +119,8 @@ class CosyVoice:
                                 '{}/flow.decoder.estimator.fp32.onnx'.format(model_dir),
                                 trt_concurrent,
                                 self.fp16)
+        if serving_conf['admission'] is not None:
+            AdmissionController(self, **serving_conf['admission'])
         del configs
 
     def list_available_spks(self):
@@ -73,23 +133,63 @@ class CosyVoice:
         del model_input['text']
         del model_input['text_len']
         self.frontend.spk2info[zero_shot_spk_id] = model_input
+        if hasattr(self.model, 'spk_cond_cache'):
+            self.model.spk_cond_cache.pop(zero_shot_spk_id)
         return True
 
+    def add_zero_shot_spks(self, prompts, batch_size=16, save=True):
+        """Register many zero shot speakers at once.
+
+        prompts is a directory read by read_prompt_dir, or a list of (prompt_speech_16k or wav path,
+        prompt_text, zero_shot_spk_id). Prompts are sorted by length and the speech tokenizer and
+        campplus run on batch_size prompts at a time. spk2info is saved once at the end if save.
+        Returns the registered speaker ids, prompts longer than 30s are skipped.
+        """
+        if isinstance(prompts, str):
+            prompts = read_prompt_dir(prompts)
+        speechs, prompt_texts, spk_ids = [], [], []
+        for prompt_speech_16k, prompt_text, zero_shot_spk_id in prompts:
+            assert zero_shot_spk_id != '', 'do not use empty zero_shot_spk_id'
+            if isinstance(prompt_speech_16k, str):
+                prompt_speech_16k = load_wav(prompt_speech_16k, 16000)
+            if prompt_speech_16k.shape[1] / 16000 > 30:
+                logging.warning('skip speaker {}, prompt speech longer than 30s'.format(zero_shot_spk_id))
+                continue
+            speechs.append(prompt_speech_16k)
+            prompt_texts.append(prompt_text)
+            spk_ids.append(zero_shot_spk_id)
+        # NOTE similar lengths in one batch, less padding for the speech tokenizer and more equal length fbanks for campplus
+        order = sorted(range(len(speechs)), key=lambda i: speechs[i].shape[1])
+        model_inputs = [None] * len(speechs)
+        for i in tqdm(range(0, len(order), batch_size)):
+            index = order[i: i + batch_size]
+            for j, model_input in zip(index, self.frontend.frontend_zero_shot_batch([prompt_texts[j] for j in index], [speechs[j] for j in index], self.sample_rate)):
+                model_inputs[j] = model_input
+        spk2info = dict(zip(spk_ids, model_inputs))
+        self.frontend.spk2info.update(spk2info)
+        if hasattr(self.model, 'spk_cond_cache'):
+            for spk_id in spk2info.keys():
+                self.model.spk_cond_cache.pop(spk_id)
+        if save is True:
+            self.save_spkinfo()
+        logging.info('add {} zero shot speakers'.format(len(spk2info)))
+        return list(spk2info.keys())
+
     def save_spkinfo(self):
         torch.save(self.frontend.spk2info, '{}/spk2info.pt'.format(self.model_dir))
 
-    def inference_sft(self, tts_text, spk_id, stream=False, speed=1.0, text_frontend=True):
+    def inference_sft(self, tts_text, spk_id, stream=False, speed=1.0, text_frontend=True, flow_sampling=None):
         for i in tqdm(self.frontend.text_normalize(tts_text, split=True, text_frontend=text_frontend)):
             model_input = self.frontend.frontend_sft(i, spk_id)
             start_time = time.time()
             logging.info('synthesis text {}'.format(i))
-            for model_output in self.model.tts(**model_input, stream=stream, speed=speed):
+            for model_output in self.model.tts(**model_input, stream=stream, speed=speed, flow_sampling=flow_sampling, spk_id=spk_id):
                 speech_len = model_output['tts_speech'].shape[1] / self.sample_rate
                 logging.info('yield speech len {}, rtf {}'.format(speech_len, (time.time() - start_time) / speech_len))
                 yield model_output
                 start_time = time.time()
 
-    def inference_zero_shot(self, tts_text, prompt_text, prompt_speech_16k, zero_shot_spk_id='', stream=False, speed=1.0, text_frontend=True):
+    def inference_zero_shot(self, tts_text, prompt_text, prompt_speech_16k, zero_shot_spk_id='', stream=False, speed=1.0, text_frontend=True, flow_sampling=None):
         prompt_text = self.frontend.text_normalize(prompt_text, split=False, text_frontend=text_frontend)
         for i in tqdm(self.frontend.text_normalize(tts_text, split=True, text_frontend=text_frontend)):
             if (not isinstance(i, Generator)) and len(i) < 0.5 * len(prompt_text):
@@ -97,24 +197,24 @@ class CosyVoice:
             model_input = self.frontend.frontend_zero_shot(i, prompt_text, prompt_speech_16k, self.sample_rate, zero_shot_spk_id)
             start_time = time.time()
             logging.info('synthesis text {}'.format(i))
-            for model_output in self.model.tts(**model_input, stream=stream, speed=speed):
+            for model_output in self.model.tts(**model_input, stream=stream, speed=speed, flow_sampling=flow_sampling, spk_id=zero_shot_spk_id):
                 speech_len = model_output['tts_speech'].shape[1] / self.sample_rate
                 logging.info('yield speech len {}, rtf {}'.format(speech_len, (time.time() - start_time) / speech_len))
                 yield model_output
                 start_time = time.time()
 
-    def inference_cross_lingual(self, tts_text, prompt_speech_16k, zero_shot_spk_id='', stream=False, speed=1.0, text_frontend=True):
+    def inference_cross_lingual(self, tts_text, prompt_speech_16k, zero_shot_spk_id='', stream=False, speed=1.0, text_frontend=True, flow_sampling=None):
         for i in tqdm(self.frontend.text_normalize(tts_text, split=True, text_frontend=text_frontend)):
             model_input = self.frontend.frontend_cross_lingual(i, prompt_speech_16k, self.sample_rate, zero_shot_spk_id)
             start_time = time.time()
             logging.info('synthesis text {}'.format(i))
-            for model_output in self.model.tts(**model_input, stream=stream, speed=speed):
+            for model_output in self.model.tts(**model_input, stream=stream, speed=speed, flow_sampling=flow_sampling, spk_id=zero_shot_spk_id):
                 speech_len = model_output['tts_speech'].shape[1] / self.sample_rate
                 logging.info('yield speech len {}, rtf {}'.format(speech_len, (time.time() - start_time) / speech_len))
                 yield model_output
                 start_time = time.time()
 
-    def inference_instruct(self, tts_text, spk_id, instruct_text, stream=False, speed=1.0, text_frontend=True):
+    def inference_instruct(self, tts_text, spk_id, instruct_text, stream=False, speed=1.0, text_frontend=True, flow_sampling=None):
         assert isinstance(self.model, CosyVoiceModel), 'inference_instruct is only implemented for CosyVoice!'
         if self.instruct is False:
             raise ValueError('{} do not support instruct inference'.format(self.model_dir))
@@ -123,16 +223,81 @@ class CosyVoice:
             model_input = self.frontend.frontend_instruct(i, spk_id, instruct_text)
             start_time = time.time()
             logging.info('synthesis text {}'.format(i))
-            for model_output in self.model.tts(**model_input, stream=stream, speed=speed):
+            for model_output in self.model.tts(**model_input, stream=stream, speed=speed, flow_sampling=flow_sampling, spk_id=spk_id):
                 speech_len = model_output['tts_speech'].shape[1] / self.sample_rate
                 logging.info('yield speech len {}, rtf {}'.format(speech_len, (time.time() - start_time) / speech_len))
                 yield model_output
                 start_time = time.time()
 
-    def inference_vc(self, source_speech_16k, prompt_speech_16k, stream=False, speed=1.0):
+    async def _ainference(self, inference_fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        # NOTE one producer thread per stream owns the sync generator, so a slow consumer only blocks its own
+        # producer and close never races with a running next. slots bounds the chunks waiting in output_queue,
+        # the producer only advances flow/hift, and llm through the bounded mel queue, when the consumer takes one
+        output_queue = asyncio.Queue()
+        slots = threading.Semaphore(self.async_queue_size)
+        stop = threading.Event()
+        done = loop.create_future()
+        end = object()
+
+        def call_soon(fn, *fn_args):
+            try:
+                loop.call_soon_threadsafe(fn, *fn_args)
+            except RuntimeError:
+                # event loop is closed, nobody waits for this stream any more
+                stop.set()
+
+        def produce():
+            model_outputs = inference_fn(*args, **kwargs)
+            try:
+                while True:
+                    slots.acquire()
+                    if stop.is_set():
+                        break
+                    model_output = next(model_outputs, end)
+                    call_soon(output_queue.put_nowait, model_output)
+                    if model_output is end:
+                        break
+            except Exception as e:
+                call_soon(output_queue.put_nowait, e)
+            finally:
+                model_outputs.close()
+                call_soon(done.set_result, None)
+
+        threading.Thread(target=produce, daemon=True).start()
+        try:
+            while True:
+                model_output = await output_queue.get()
+                if model_output is end:
+                    break
+                if isinstance(model_output, Exception):
+                    raise model_output
+                slots.release()
+                yield model_output
+        finally:
+            # wake up the producer if it waits for a slot, it closes the generator after the running next returns
+            stop.set()
+            slots.release()
+            await done
+
+    async def ainference_sft(self, tts_text, spk_id, stream=False, speed=1.0, text_frontend=True, flow_sampling=None):
+        async for model_output in self._ainference(self.inference_sft, tts_text, spk_id, stream=stream, speed=speed, text_frontend=text_frontend, flow_sampling=flow_sampling):
+            yield model_output
+
+    async def ainference_zero_shot(self, tts_text, prompt_text, prompt_speech_16k, zero_shot_spk_id='', stream=False, speed=1.0, text_frontend=True, flow_sampling=None):
+        async for model_output in self._ainference(self.inference_zero_shot, tts_text, prompt_text, prompt_speech_16k, zero_shot_spk_id=zero_shot_spk_id,
+                                                   stream=stream, speed=speed, text_frontend=text_frontend, flow_sampling=flow_sampling):
+            yield model_output
+
+    async def ainference_cross_lingual(self, tts_text, prompt_speech_16k, zero_shot_spk_id='', stream=False, speed=1.0, text_frontend=True, flow_sampling=None):
+        async for model_output in self._ainference(self.inference_cross_lingual, tts_text, prompt_speech_16k, zero_shot_spk_id=zero_shot_spk_id,
+                                                   stream=stream, speed=speed, text_frontend=text_frontend, flow_sampling=flow_sampling):
+            yield model_output
+
+    def inference_vc(self, source_speech_16k, prompt_speech_16k, stream=False, speed=1.0, flow_sampling=None):
         model_input = self.frontend.frontend_vc(source_speech_16k, prompt_speech_16k, self.sample_rate)
         start_time = time.time()
-        for model_output in self.model.tts(**model_input, stream=stream, speed=speed):
+        for model_output in self.model.tts(**model_input, stream=stream, speed=speed, flow_sampling=flow_sampling):
             speech_len = model_output['tts_speech'].shape[1] / self.sample_rate
             logging.info('yield speech len {}, rtf {}'.format(speech_len, (time.time() - start_time) / speech_len))
             yield model_output
@@ -141,7 +306,10 @@ class CosyVoice:
 
 class CosyVoice2(CosyVoice):
 
-    def __init__(self, model_dir, load_jit=False, load_trt=False, load_vllm=False, fp16=False, trt_concurrent=1):
+    def __init__(self, model_dir, load_jit=False, load_trt=False, load_vllm=False, fp16=False, trt_concurrent=1, prepare_for_inference=False,
+                 serving_conf=None):
+        serving_conf = get_serving_conf(serving_conf)
+        batching, decode, caches, onnx, frontend = [serving_conf[k] for k in ['batching', 'decode', 'caches', 'onnx', 'frontend']]
         self.instruct = True if '-Instruct' in model_dir else False
         self.model_dir = model_dir
         self.fp16 = fp16
@@ -158,17 +326,46 @@ class CosyVoice2(CosyVoice):
                                           '{}/campplus.onnx'.format(model_dir),
                                           '{}/speech_tokenizer_v2.onnx'.format(model_dir),
                                           '{}/spk2info.pt'.format(model_dir),
-                                          configs['allowed_special'])
+                                          configs['allowed_special'],
+                                          frontend['campplus_conf'],
+                                          frontend['speech_tokenizer_conf'],
+                                          configs['flow'].input_frame_rate)
+        if caches['prompt_cache_size'] > 0 or caches['prompt_cache_dir'] != '':
+            # NOTE prompt_cache_size 0 with prompt_cache_dir keeps nothing in memory, only on disk
+            self.frontend.load_prompt_cache(max_entries=caches['prompt_cache_size'], cache_dir=caches['prompt_cache_dir'])
         self.sample_rate = configs['sample_rate']
         if torch.cuda.is_available() is False and (load_jit is True or load_trt is True or fp16 is True):
             load_jit, load_trt, fp16 = False, False, False
             logging.warning('no cuda device, set load_jit/load_trt/fp16 to False')
+        load_onnx = onnx['load_onnx']
+        if torch.cuda.is_available() is True and load_onnx is True:
+            load_onnx = False
+            logging.warning('onnx estimator only runs on cpu, set load_onnx to False, use load_trt on gpu')
+        # NOTE one llm decode backend, they all replace the batch 1 decode loop
+        llm_backends = {'load_vllm': load_vllm, 'batching.llm_batch_size': batching['llm_batch_size'] > 0,
+                        'decode.num_draft': decode['num_draft'] > 0, 'decode.static_kv_cache': decode['static_kv_cache']}
+        assert sum(llm_backends.values()) <= 1, 'only one of {} can be set, got {}'.format(
+            list(llm_backends.keys()), [k for k, v in llm_backends.items() if v])
+        if batching['flow_batch_size'] > 0 and (load_trt or load_onnx):
+            logging.warning('flow decoder batch is not supported with load_trt/load_onnx, ignore flow_batch_size')
+        if caches['encoder_chunk_cache'] and load_jit:
+            logging.warning('encoder chunk cache is not supported with load_jit, ignore encoder_chunk_cache')
+        if caches['decoder_chunk_cache_len'] > 0 and (load_trt or load_onnx):
+            logging.warning('decoder chunk cache is not supported with load_trt/load_onnx, ignore decoder_chunk_cache_len')
         self.model = CosyVoice2Model(configs['llm'], configs['flow'], configs['hift'], fp16)
         self.model.load('{}/llm.pt'.format(model_dir),
                         '{}/flow.pt'.format(model_dir),
                         '{}/hift.pt'.format(model_dir))
+        if prepare_for_inference:
+            self.model.prepare_for_inference()
         if load_vllm:
             self.model.load_vllm('{}/vllm'.format(model_dir))
+        elif batching['llm_batch_size'] > 0:
+            self.model.load_batch_decode(batching['llm_batch_size'])
+        elif decode['num_draft'] > 0:
+            self.model.load_speculative(num_draft=decode['num_draft'])
+        elif decode['static_kv_cache']:
+            self.model.load_static_kv_cache()
         if load_jit:
             self.model.load_jit('{}/flow.encoder.{}.zip'.format(model_dir, 'fp16' if self.fp16 is True else 'fp32'))
         if load_trt:
@@ -176,19 +373,50 @@ class CosyVoice2(CosyVoice):
                                 '{}/flow.decoder.estimator.fp32.onnx'.format(model_dir),
                                 trt_concurrent,
                                 self.fp16)
+        elif load_onnx:
+            self.model.load_onnx('{}/flow.decoder.estimator.fp32.onnx'.format(model_dir),
+                                 **{k: v for k, v in onnx.items() if k != 'load_onnx'})
+        elif batching['flow_batch_size'] > 0:
+            self.model.load_batch_flow(batching['flow_batch_size'])
+        if caches['encoder_chunk_cache'] and not load_jit:
+            self.model.load_encoder_chunk_cache()
+        if caches['decoder_chunk_cache_len'] > 0 and not load_trt and not load_onnx:
+            self.model.load_decoder_chunk_cache(max_len=caches['decoder_chunk_cache_len'])
+        if batching['hift_batch_size'] > 0:
+            self.model.load_batch_hift(batching['hift_batch_size'])
+        if caches['stateful_hift']:
+            # NOTE streaming chunks bypass hift batch, non-stream inference still uses it
+            self.model.load_stateful_hift()
+        if load_vllm is False and (batching['llm_batch_size'] > 0 or decode['sampler_seed'] is not None):
+            self.model.load_batch_sampler(seed=decode['sampler_seed'])
+        if load_vllm is False and caches['prefix_cache_mb'] > 0:
+            self.model.load_prefix_cache(max_mb=caches['prefix_cache_mb'])
+        if caches['spk_cond_cache_size'] > 0:
+            self.model.load_spk_cond_cache(max_entries=caches['spk_cond_cache_size'])
+            # NOTE warm up the first registered speakers, with prompt encoder state if encoder chunk cache is used
+            spk_ids = list(self.frontend.spk2info.keys())[:min(caches['spk_cond_cache_warmup'], caches['spk_cond_cache_size'])]
+            self.model.warmup_spk_cond_cache(self.frontend.spk2info, spk_ids, stream=self.model.flow.encoder_chunk_cache)
+        if serving_conf['admission'] is not None:
+            # NOTE after load_batch_decode, the controller pauses preempted sessions inside the decode batch
+            AdmissionController(self, **serving_conf['admission'])
         del configs
 
     def inference_instruct(self, *args, **kwargs):
         raise NotImplementedError('inference_instruct is not implemented for CosyVoice2!')
 
-    def inference_instruct2(self, tts_text, instruct_text, prompt_speech_16k, zero_shot_spk_id='', stream=False, speed=1.0, text_frontend=True):
+    def inference_instruct2(self, tts_text, instruct_text, prompt_speech_16k, zero_shot_spk_id='', stream=False, speed=1.0, text_frontend=True, flow_sampling=None):
         assert isinstance(self.model, CosyVoice2Model), 'inference_instruct2 is only implemented for CosyVoice2!'
         for i in tqdm(self.frontend.text_normalize(tts_text, split=True, text_frontend=text_frontend)):
             model_input = self.frontend.frontend_instruct2(i, instruct_text, prompt_speech_16k, self.sample_rate, zero_shot_spk_id)
             start_time = time.time()
             logging.info('synthesis text {}'.format(i))
-            for model_output in self.model.tts(**model_input, stream=stream, speed=speed):
+            for model_output in self.model.tts(**model_input, stream=stream, speed=speed, flow_sampling=flow_sampling, spk_id=zero_shot_spk_id):
                 speech_len = model_output['tts_speech'].shape[1] / self.sample_rate
                 logging.info('yield speech len {}, rtf {}'.format(speech_len, (time.time() - start_time) / speech_len))
                 yield model_output
                 start_time = time.time()
+
+    async def ainference_instruct2(self, tts_text, instruct_text, prompt_speech_16k, zero_shot_spk_id='', stream=False, speed=1.0, text_frontend=True, flow_sampling=None):
+        async for model_output in self._ainference(self.inference_instruct2, tts_text, instruct_text, prompt_speech_16k, zero_shot_spk_id=zero_shot_spk_id,
+                                                   stream=stream, speed=speed, text_frontend=text_frontend, flow_sampling=flow_sampling):
+            yield model_output
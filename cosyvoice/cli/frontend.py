@@ -14,7 +14,6 @@
 from functools import partial
 from typing import Generator
 import json
-import onnxruntime
 import torch
 import numpy as np
 import whisper
@@ -32,7 +31,9 @@ except ImportError:
     from wetext import Normalizer as ZhNormalizer
     from wetext import Normalizer as EnNormalizer
     use_ttsfrd = False
+from cosyvoice.utils.common import pad_list, OrtSessionWrapper
 from cosyvoice.utils.file_utils import logging
+from cosyvoice.cli.prompt_cache import PromptFeatCache, file_hash
 from cosyvoice.utils.frontend_utils import contains_chinese, replace_blank, replace_corner_mark, remove_bracket, spell_out_number, split_paragraph, is_only_punctuation
 
 
@@ -44,22 +45,31 @@ class CosyVoiceFrontEnd:
                  campplus_model: str,
                  speech_tokenizer_model: str,
                  spk2info: str = '',
-                 allowed_special: str = 'all'):
+                 allowed_special: str = 'all',
+                 campplus_conf: dict = None,
+                 speech_tokenizer_conf: dict = None,
+                 speech_token_frame_rate: int = 50):
         self.tokenizer = get_tokenizer()
         self.feat_extractor = feat_extractor
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-        option = onnxruntime.SessionOptions()
-        option.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
-        option.intra_op_num_threads = 1
-        self.campplus_session = onnxruntime.InferenceSession(campplus_model, sess_options=option, providers=["CPUExecutionProvider"])
-        self.speech_tokenizer_session = onnxruntime.InferenceSession(speech_tokenizer_model, sess_options=option,
-                                                                     providers=["CUDAExecutionProvider" if torch.cuda.is_available() else
-                                                                                "CPUExecutionProvider"])
+        # session pools, concurrent requests check out a session each, conf is the kwargs of OrtSessionWrapper
+        campplus_conf = dict({'ort_concurrent': 1, 'intra_op_num_threads': 1, 'providers': ['CPUExecutionProvider']}, **(campplus_conf or {}))
+        speech_tokenizer_conf = dict({'ort_concurrent': 1, 'intra_op_num_threads': 1,
+                                      'providers': ['CUDAExecutionProvider' if torch.cuda.is_available() else 'CPUExecutionProvider']},
+                                     **(speech_tokenizer_conf or {}))
+        self.campplus_session = OrtSessionWrapper(campplus_model, **campplus_conf)
+        self.speech_tokenizer_session = OrtSessionWrapper(speech_tokenizer_model, **speech_tokenizer_conf)
+        logging.info('campplus session pool {}, speech tokenizer session pool {}'.format(campplus_conf, speech_tokenizer_conf))
         if os.path.exists(spk2info):
             self.spk2info = torch.load(spk2info, map_location=self.device)
         else:
             self.spk2info = {}
         self.allowed_special = allowed_special
+        # whisper log mel frames per speech token, 2 for the 50hz v1 tokenizer and 4 for the 25hz v2 tokenizer
+        self.speech_token_mel_ratio = whisper.audio.SAMPLE_RATE // whisper.audio.HOP_LENGTH // speech_token_frame_rate
+        # model files the prompt feat cache is keyed by, see load_prompt_cache
+        self.model_files = [campplus_model, speech_tokenizer_model]
+        self.prompt_cache = None
         self.use_ttsfrd = use_ttsfrd
         if self.use_ttsfrd:
             self.frd = ttsfrd.TtsFrontendEngine()
@@ -72,6 +82,10 @@ class CosyVoiceFrontEnd:
             self.en_tn_model = EnNormalizer()
             self.inflect_parser = inflect.engine()
 
+    def load_prompt_cache(self, max_entries=64, max_mb=256, cache_dir=''):
+        model_id = '-'.join([file_hash(i) for i in self.model_files])
+        self.prompt_cache = PromptFeatCache(model_id, max_bytes=int(max_mb * 1024 * 1024), max_entries=max_entries, cache_dir=cache_dir, device=self.device)
+
     def _extract_text_token(self, text):
         if isinstance(text, Generator):
             logging.info('get tts_text generator, will return _extract_text_token_generator!')
@@ -92,32 +106,105 @@ class CosyVoiceFrontEnd:
     def _extract_speech_token(self, speech):
         assert speech.shape[1] / 16000 <= 30, 'do not support extract speech token for audio longer than 30s'
         feat = whisper.log_mel_spectrogram(speech, n_mels=128)
-        speech_token = self.speech_tokenizer_session.run(None,
-                                                         {self.speech_tokenizer_session.get_inputs()[0].name:
-                                                          feat.detach().cpu().numpy(),
-                                                          self.speech_tokenizer_session.get_inputs()[1].name:
-                                                          np.array([feat.shape[2]], dtype=np.int32)})[0].flatten().tolist()
+        with self.speech_tokenizer_session.session() as session:
+            speech_token = session.run(None,
+                                       {self.speech_tokenizer_session.input_names[0]: feat.detach().cpu().numpy(),
+                                        self.speech_tokenizer_session.input_names[1]: np.array([feat.shape[2]], dtype=np.int32)})[0].flatten().tolist()
         speech_token = torch.tensor([speech_token], dtype=torch.int32).to(self.device)
         speech_token_len = torch.tensor([speech_token.shape[1]], dtype=torch.int32).to(self.device)
         return speech_token, speech_token_len
 
+    def _extract_speech_token_batch(self, speechs):
+        for speech in speechs:
+            assert speech.shape[1] / 16000 <= 30, 'do not support extract speech token for audio longer than 30s'
+        # NOTE mel per prompt, whisper log mel is normalized by its max, padded frames are masked by feats_length
+        feats = [whisper.log_mel_spectrogram(speech, n_mels=128).squeeze(dim=0).transpose(0, 1) for speech in speechs]
+        feat_len = np.array([i.shape[0] for i in feats], dtype=np.int32)
+        feat = pad_list(feats, 0).transpose(1, 2)
+        with self.speech_tokenizer_session.session() as session:
+            speech_token = session.run(None,
+                                       {self.speech_tokenizer_session.input_names[0]: feat.detach().cpu().numpy(),
+                                        self.speech_tokenizer_session.input_names[1]: feat_len})[0]
+        ratio = self.speech_token_mel_ratio
+        assert -(-feat_len.max() // ratio) == speech_token.shape[1], \
+            'unexpected speech token length {} of mel length {}, check speech_token_frame_rate'.format(speech_token.shape[1], feat_len.max())
+        speech_tokens = []
+        for i in range(len(speechs)):
+            this_speech_token = torch.tensor(speech_token[i: i + 1, :-(-feat_len[i] // ratio)], dtype=torch.int32).to(self.device)
+            speech_tokens.append((this_speech_token, torch.tensor([this_speech_token.shape[1]], dtype=torch.int32).to(self.device)))
+        return speech_tokens
+
     def _extract_spk_embedding(self, speech):
         feat = kaldi.fbank(speech,
                            num_mel_bins=80,
                            dither=0,
                            sample_frequency=16000)
         feat = feat - feat.mean(dim=0, keepdim=True)
-        embedding = self.campplus_session.run(None,
-                                              {self.campplus_session.get_inputs()[0].name: feat.unsqueeze(dim=0).cpu().numpy()})[0].flatten().tolist()
+        with self.campplus_session.session() as session:
+            embedding = session.run(None, {self.campplus_session.input_names[0]: feat.unsqueeze(dim=0).cpu().numpy()})[0].flatten().tolist()
         embedding = torch.tensor([embedding]).to(self.device)
         return embedding
 
+    def _extract_spk_embedding_batch(self, speechs):
+        feats = []
+        for speech in speechs:
+            feat = kaldi.fbank(speech,
+                               num_mel_bins=80,
+                               dither=0,
+                               sample_frequency=16000)
+            feats.append(feat - feat.mean(dim=0, keepdim=True))
+        # NOTE campplus has no length input and pools over all frames, so only fbanks of the same length share a batch
+        buckets = {}
+        for i, feat in enumerate(feats):
+            buckets.setdefault(feat.shape[0], []).append(i)
+        embeddings = [None] * len(feats)
+        for index in buckets.values():
+            with self.campplus_session.session() as session:
+                embedding = session.run(None, {self.campplus_session.input_names[0]: torch.stack([feats[i] for i in index]).cpu().numpy()})[0]
+            for j, i in enumerate(index):
+                embeddings[i] = torch.tensor(embedding[j: j + 1].reshape(1, -1)).to(self.device)
+        return embeddings
+
     def _extract_speech_feat(self, speech):
         speech_feat = self.feat_extractor(speech).squeeze(dim=0).transpose(0, 1).to(self.device)
         speech_feat = speech_feat.unsqueeze(dim=0)
         speech_feat_len = torch.tensor([speech_feat.shape[1]], dtype=torch.int32).to(self.device)
         return speech_feat, speech_feat_len
 
+    def _extract_prompt_speech(self, prompt_speech_16k, resample_rate):
+        if self.prompt_cache is not None:
+            key = self.prompt_cache.key(prompt_speech_16k, resample_rate)
+            prompt = self.prompt_cache.get(key)
+            if prompt is not None:
+                return prompt
+        prompt_speech_resample = torchaudio.transforms.Resample(orig_freq=16000, new_freq=resample_rate)(prompt_speech_16k)
+        speech_feat, speech_feat_len = self._extract_speech_feat(prompt_speech_resample)
+        speech_token, speech_token_len = self._extract_speech_token(prompt_speech_16k)
+        embedding = self._extract_spk_embedding(prompt_speech_16k)
+        prompt = {'speech_token': speech_token, 'speech_token_len': speech_token_len,
+                  'speech_feat': speech_feat, 'speech_feat_len': speech_feat_len, 'embedding': embedding}
+        if self.prompt_cache is not None:
+            self.prompt_cache.put(key, prompt)
+        return prompt
+
+    def _prompt_model_input(self, prompt_text, prompt, resample_rate):
+        prompt_text_token, prompt_text_token_len = self._extract_text_token(prompt_text)
+        speech_feat, speech_feat_len = prompt['speech_feat'], prompt['speech_feat_len']
+        speech_token, speech_token_len = prompt['speech_token'], prompt['speech_token_len']
+        if resample_rate == 24000:
+            # cosyvoice2, force speech_feat % speech_token = 2
+            # NOTE new len tensors instead of in place update, prompt may be shared with the prompt feat cache
+            token_len = min(int(speech_feat.shape[1] / 2), speech_token.shape[1])
+            speech_feat, speech_feat_len = speech_feat[:, :2 * token_len], torch.full_like(speech_feat_len, 2 * token_len)
+            speech_token, speech_token_len = speech_token[:, :token_len], torch.full_like(speech_token_len, token_len)
+        embedding = prompt['embedding']
+        model_input = {'prompt_text': prompt_text_token, 'prompt_text_len': prompt_text_token_len,
+                       'llm_prompt_speech_token': speech_token, 'llm_prompt_speech_token_len': speech_token_len,
+                       'flow_prompt_speech_token': speech_token, 'flow_prompt_speech_token_len': speech_token_len,
+                       'prompt_speech_feat': speech_feat, 'prompt_speech_feat_len': speech_feat_len,
+                       'llm_embedding': embedding, 'flow_embedding': embedding}
+        return model_input
+
     def text_normalize(self, text, split=True, text_frontend=True):
         if isinstance(text, Generator):
             logging.info('get tts_text generator, will skip text_normalize!')
@@ -157,27 +244,27 @@ class CosyVoiceFrontEnd:
     def frontend_zero_shot(self, tts_text, prompt_text, prompt_speech_16k, resample_rate, zero_shot_spk_id):
         tts_text_token, tts_text_token_len = self._extract_text_token(tts_text)
         if zero_shot_spk_id == '':
-            prompt_text_token, prompt_text_token_len = self._extract_text_token(prompt_text)
-            prompt_speech_resample = torchaudio.transforms.Resample(orig_freq=16000, new_freq=resample_rate)(prompt_speech_16k)
-            speech_feat, speech_feat_len = self._extract_speech_feat(prompt_speech_resample)
-            speech_token, speech_token_len = self._extract_speech_token(prompt_speech_16k)
-            if resample_rate == 24000:
-                # cosyvoice2, force speech_feat % speech_token = 2
-                token_len = min(int(speech_feat.shape[1] / 2), speech_token.shape[1])
-                speech_feat, speech_feat_len[:] = speech_feat[:, :2 * token_len], 2 * token_len
-                speech_token, speech_token_len[:] = speech_token[:, :token_len], token_len
-            embedding = self._extract_spk_embedding(prompt_speech_16k)
-            model_input = {'prompt_text': prompt_text_token, 'prompt_text_len': prompt_text_token_len,
-                           'llm_prompt_speech_token': speech_token, 'llm_prompt_speech_token_len': speech_token_len,
-                           'flow_prompt_speech_token': speech_token, 'flow_prompt_speech_token_len': speech_token_len,
-                           'prompt_speech_feat': speech_feat, 'prompt_speech_feat_len': speech_feat_len,
-                           'llm_embedding': embedding, 'flow_embedding': embedding}
+            prompt = self._extract_prompt_speech(prompt_speech_16k, resample_rate)
+            model_input = self._prompt_model_input(prompt_text, prompt, resample_rate)
         else:
             model_input = self.spk2info[zero_shot_spk_id]
         model_input['text'] = tts_text_token
         model_input['text_len'] = tts_text_token_len
         return model_input
 
+    def frontend_zero_shot_batch(self, prompt_texts, prompt_speechs_16k, resample_rate):
+        # speech token and speaker embedding of all prompts are extracted by batched onnx runs, see add_zero_shot_spks
+        speech_tokens = self._extract_speech_token_batch(prompt_speechs_16k)
+        embeddings = self._extract_spk_embedding_batch(prompt_speechs_16k)
+        resample = torchaudio.transforms.Resample(orig_freq=16000, new_freq=resample_rate)
+        model_inputs = []
+        for prompt_text, prompt_speech_16k, (speech_token, speech_token_len), embedding in zip(prompt_texts, prompt_speechs_16k, speech_tokens, embeddings):
+            speech_feat, speech_feat_len = self._extract_speech_feat(resample(prompt_speech_16k))
+            prompt = {'speech_token': speech_token, 'speech_token_len': speech_token_len,
+                      'speech_feat': speech_feat, 'speech_feat_len': speech_feat_len, 'embedding': embedding}
+            model_inputs.append(self._prompt_model_input(prompt_text, prompt, resample_rate))
+        return model_inputs
+
     def frontend_cross_lingual(self, tts_text, prompt_speech_16k, resample_rate, zero_shot_spk_id):
         model_input = self.frontend_zero_shot(tts_text, '', prompt_speech_16k, resample_rate, zero_shot_spk_id)
         # in cross lingual mode, we remove prompt in llm
@@ -203,10 +290,10 @@ class CosyVoiceFrontEnd:
         return model_input
 
     def frontend_vc(self, source_speech_16k, prompt_speech_16k, resample_rate):
-        prompt_speech_token, prompt_speech_token_len = self._extract_speech_token(prompt_speech_16k)
-        prompt_speech_resample = torchaudio.transforms.Resample(orig_freq=16000, new_freq=resample_rate)(prompt_speech_16k)
-        prompt_speech_feat, prompt_speech_feat_len = self._extract_speech_feat(prompt_speech_resample)
-        embedding = self._extract_spk_embedding(prompt_speech_16k)
+        prompt = self._extract_prompt_speech(prompt_speech_16k, resample_rate)
+        prompt_speech_token, prompt_speech_token_len = prompt['speech_token'], prompt['speech_token_len']
+        prompt_speech_feat, prompt_speech_feat_len = prompt['speech_feat'], prompt['speech_feat_len']
+        embedding = prompt['embedding']
         source_speech_token, source_speech_token_len = self._extract_speech_token(source_speech_16k)
         model_input = {'source_speech_token': source_speech_token, 'source_speech_token_len': source_speech_token_len,
                        'flow_prompt_speech_token': prompt_speech_token, 'flow_prompt_speech_token_len': prompt_speech_token_len,
@@ -17,13 +17,18 @@ from typing import Generator
 import torch
 import numpy as np
 import threading
-import time
+import queue
 from torch.nn import functional as F
 from contextlib import nullcontext
 import uuid
 from cosyvoice.utils.common import fade_in_out
-from cosyvoice.utils.file_utils import convert_onnx_to_trt, export_cosyvoice2_vllm
-from cosyvoice.utils.common import TrtContextWrapper
+from cosyvoice.utils.file_utils import convert_onnx_to_trt, export_cosyvoice2_vllm, logging
+from cosyvoice.utils.common import TrtContextWrapper, OrtSessionWrapper, BatchCollector, prepare_for_inference
+from cosyvoice.llm.scheduler import ContinuousBatchScheduler
+from cosyvoice.llm.sampler import BatchSampler
+from cosyvoice.llm.prefix_cache import PrefixKVCache
+from cosyvoice.llm.speculative import SpeculativeDecoder
+from cosyvoice.flow.speaker_cache import SpeakerCondCache
 
 
 class CosyVoiceModel:
@@ -46,20 +51,26 @@ class CosyVoiceModel:
         self.token_overlap_len = 20
         # mel fade in out
         self.mel_overlap_len = int(self.token_overlap_len / self.flow.input_frame_rate * 22050 / 256)
-        self.mel_window = np.hamming(2 * self.mel_overlap_len)
+        self.mel_window = torch.from_numpy(np.hamming(2 * self.mel_overlap_len)).float().to(self.device)
         # hift cache
         self.mel_cache_len = 20
         self.source_cache_len = int(self.mel_cache_len * 256)
         # speech fade in out
-        self.speech_window = np.hamming(2 * self.source_cache_len)
+        self.speech_window = torch.from_numpy(np.hamming(2 * self.source_cache_len)).float().to(self.device)
+        # carry hift state between chunks instead of hift cache, see load_stateful_hift
+        self.stateful_hift = False
         # rtf and decoding related
         self.stream_scale_factor = 1
+        # max mel chunks buffered between flow and hift stage
+        self.mel_queue_size = 2
         assert self.stream_scale_factor >= 1, 'stream_scale_factor should be greater than 1, change it according to your actual rtf'
         self.llm_context = torch.cuda.stream(torch.cuda.Stream(self.device)) if torch.cuda.is_available() else nullcontext()
         self.lock = threading.Lock()
         # dict used to store session related variable
         self.tts_speech_token_dict = {}
         self.llm_end_dict = {}
+        self.token_cond_dict = {}
+        self.cancel_dict = {}
         self.mel_overlap_dict = {}
         self.flow_cache_dict = {}
         self.hift_cache_dict = {}
@@ -74,6 +85,13 @@ class CosyVoiceModel:
         self.hift.load_state_dict(hift_state_dict, strict=True)
         self.hift.to(self.device).eval()
 
+    def prepare_for_inference(self):
+        # NOTE must be called after load, parameter names of folded weight norm differ from the checkpoint
+        for name in ['llm', 'flow', 'hift']:
+            stats = prepare_for_inference(getattr(self, name))
+            logging.info('prepare {} for inference, folded {} weight norm and {} conv batch norm, {} frozen parameters'.format(
+                name, stats['weight_norm'], stats['conv_bn'], stats['params']))
+
     def load_jit(self, llm_text_encoder_model, llm_llm_model, flow_encoder_model):
         llm_text_encoder = torch.jit.load(llm_text_encoder_model, map_location=self.device)
         self.llm.text_encoder = llm_text_encoder
@@ -93,6 +111,12 @@ class CosyVoiceModel:
         assert estimator_engine is not None, 'failed to load trt {}'.format(flow_decoder_estimator_model)
         self.flow.decoder.estimator = TrtContextWrapper(estimator_engine, trt_concurrent=trt_concurrent, device=self.device)
 
+    def load_onnx(self, flow_decoder_onnx_model, onnx_concurrent=1, intra_op_num_threads=0, inter_op_num_threads=0):
+        assert self.device.type == 'cpu' and self.fp16 is False, 'onnx estimator only supports fp32 cpu, use load_trt on gpu!'
+        del self.flow.decoder.estimator
+        self.flow.decoder.estimator = OrtSessionWrapper(flow_decoder_onnx_model, ort_concurrent=onnx_concurrent,
+                                                        intra_op_num_threads=intra_op_num_threads, inter_op_num_threads=inter_op_num_threads)
+
     def get_trt_kwargs(self):
         min_shape = [(2, 80, 4), (2, 1, 4), (2, 80, 4), (2, 80, 4)]
         opt_shape = [(2, 80, 500), (2, 1, 500), (2, 80, 500), (2, 80, 500)]
@@ -100,34 +124,121 @@ class CosyVoiceModel:
         input_names = ["x", "mask", "mu", "cond"]
         return {'min_shape': min_shape, 'opt_shape': opt_shape, 'max_shape': max_shape, 'input_names': input_names}
 
+    def load_batch_sampler(self, seed=None):
+        self.llm.batch_sampler = BatchSampler.from_sampling(self.llm.sampling, self.llm.speech_token_size, seed=seed)
+
+    def load_batch_hift(self, max_batch_size, max_wait=0.01):
+        # NOTE opt-in, batched vocoding only matches hift.inference up to float rounding, see HiFTGenerator.inference_batch
+        self.hift_batcher = BatchCollector(self.hift_batch, max_batch_size=max_batch_size, max_wait=max_wait)
+
+    def load_stateful_hift(self):
+        assert hasattr(self.hift, 'inference_stream') and hasattr(self.hift.f0_predictor, 'forward_chunk'), 'stateful hift needs HiFTGenerator.inference_stream!'
+        self.stateful_hift = True
+
+    def hift_batch(self, items):
+        return self.hift.inference_batch(speech_feat=[i['speech_feat'] for i in items], cache_source=[i['cache_source'] for i in items])
+
+    def hift_inference(self, speech_feat, cache_source):
+        if hasattr(self, 'hift_batcher'):
+            # vocode together with other concurrent sessions, see load_batch_hift
+            return self.hift_batcher.submit({'speech_feat': speech_feat, 'cache_source': cache_source.to(speech_feat.device)})
+        return self.hift.inference(speech_feat=speech_feat, cache_source=cache_source)
+
     def llm_job(self, text, prompt_text, llm_prompt_speech_token, llm_embedding, uuid):
-        with self.llm_context, torch.cuda.amp.autocast(self.fp16 is True and hasattr(self.llm, 'vllm') is False):
-            if isinstance(text, Generator):
-                assert isinstance(self, CosyVoice2Model) and not hasattr(self.llm, 'vllm'), 'streaming input text is only implemented for CosyVoice2 and do not support vllm!'
-                for i in self.llm.inference_bistream(text=text,
-                                                     prompt_text=prompt_text.to(self.device),
-                                                     prompt_text_len=torch.tensor([prompt_text.shape[1]], dtype=torch.int32).to(self.device),
-                                                     prompt_speech_token=llm_prompt_speech_token.to(self.device),
-                                                     prompt_speech_token_len=torch.tensor([llm_prompt_speech_token.shape[1]], dtype=torch.int32).to(self.device),
-                                                     embedding=llm_embedding.to(self.device)):
-                    self.tts_speech_token_dict[uuid].append(i)
-            else:
-                for i in self.llm.inference(text=text.to(self.device),
-                                            text_len=torch.tensor([text.shape[1]], dtype=torch.int32).to(self.device),
-                                            prompt_text=prompt_text.to(self.device),
-                                            prompt_text_len=torch.tensor([prompt_text.shape[1]], dtype=torch.int32).to(self.device),
-                                            prompt_speech_token=llm_prompt_speech_token.to(self.device),
-                                            prompt_speech_token_len=torch.tensor([llm_prompt_speech_token.shape[1]], dtype=torch.int32).to(self.device),
-                                            embedding=llm_embedding.to(self.device),
-                                            uuid=uuid):
-                    self.tts_speech_token_dict[uuid].append(i)
-        self.llm_end_dict[uuid] = True
+        try:
+            with self.llm_context, torch.cuda.amp.autocast(self.fp16 is True and hasattr(self.llm, 'vllm') is False):
+                if isinstance(text, Generator):
+                    assert isinstance(self, CosyVoice2Model) and not hasattr(self.llm, 'vllm'), 'streaming input text is only implemented for CosyVoice2 and do not support vllm!'
+                    token_generator = self.llm.inference_bistream(text=text,
+                                                                  prompt_text=prompt_text.to(self.device),
+                                                                  prompt_text_len=torch.tensor([prompt_text.shape[1]], dtype=torch.int32).to(self.device),
+                                                                  prompt_speech_token=llm_prompt_speech_token.to(self.device),
+                                                                  prompt_speech_token_len=torch.tensor([llm_prompt_speech_token.shape[1]], dtype=torch.int32).to(self.device),
+                                                                  embedding=llm_embedding.to(self.device))
+                else:
+                    token_generator = self.llm.inference(text=text.to(self.device),
+                                                         text_len=torch.tensor([text.shape[1]], dtype=torch.int32).to(self.device),
+                                                         prompt_text=prompt_text.to(self.device),
+                                                         prompt_text_len=torch.tensor([prompt_text.shape[1]], dtype=torch.int32).to(self.device),
+                                                         prompt_speech_token=llm_prompt_speech_token.to(self.device),
+                                                         prompt_speech_token_len=torch.tensor([llm_prompt_speech_token.shape[1]], dtype=torch.int32).to(self.device),
+                                                         embedding=llm_embedding.to(self.device),
+                                                         uuid=uuid)
+                try:
+                    for i in token_generator:
+                        self.append_speech_token(uuid, i)
+                        if hasattr(self, 'admission') and not hasattr(self.llm, 'batch_scheduler'):
+                            # batch 1 decode runs in this thread, a preempted session pauses here,
+                            # ContinuousBatchScheduler pauses it inside the decode batch instead
+                            self.admission.wait_resumed(uuid)
+                        if self.cancel_dict[uuid] is True:
+                            break
+                finally:
+                    # NOTE close explicitly, releases the session of ContinuousBatchScheduler right away
+                    token_generator.close()
+        finally:
+            # always wake up flow stage, otherwise it waits forever when llm fails
+            with self.token_cond_dict[uuid]:
+                self.llm_end_dict[uuid] = True
+                self.token_cond_dict[uuid].notify_all()
 
     def vc_job(self, source_speech_token, uuid):
-        self.tts_speech_token_dict[uuid] = source_speech_token.flatten().tolist()
-        self.llm_end_dict[uuid] = True
+        with self.token_cond_dict[uuid]:
+            self.tts_speech_token_dict[uuid] = source_speech_token.flatten().tolist()
+            self.llm_end_dict[uuid] = True
+            self.token_cond_dict[uuid].notify_all()
 
-    def token2wav(self, token, prompt_token, prompt_feat, embedding, uuid, finalize=False, speed=1.0):
+    def append_speech_token(self, uuid, token):
+        with self.token_cond_dict[uuid]:
+            self.tts_speech_token_dict[uuid].append(token)
+            self.token_cond_dict[uuid].notify_all()
+        if hasattr(self, 'admission'):
+            # between two decode steps, give way to interactive requests, see AdmissionController, never blocks
+            self.admission.checkpoint(uuid)
+
+    def wait_speech_token(self, uuid, token_len):
+        """Block until token_len speech tokens are available, llm ends or the session is cancelled, return current token number."""
+        with self.token_cond_dict[uuid]:
+            self.token_cond_dict[uuid].wait_for(lambda: len(self.tts_speech_token_dict[uuid]) >= token_len or self.llm_end_dict[uuid] is True or
+                                                self.cancel_dict[uuid] is True)
+            return len(self.tts_speech_token_dict[uuid])
+
+    def cancel_session(self, uuid):
+        """Stop llm and flow stage of a session whose consumer is gone, see tts."""
+        with self.token_cond_dict[uuid]:
+            self.cancel_dict[uuid] = True
+            self.token_cond_dict[uuid].notify_all()
+        if hasattr(self.llm, 'batch_scheduler'):
+            # wake up llm_job if it waits for the next token of a batched decode
+            self.llm.batch_scheduler.cancel_uuid(uuid)
+
+    def put_mel(self, uuid, mel_queue, item):
+        """Hand a mel chunk to hift stage, return False once the session is cancelled and flow stage should stop.
+
+        tts drains mel_queue after cancel_session, so a put blocked on the full queue returns and the
+        next check stops flow stage.
+        """
+        if self.cancel_dict[uuid] is True:
+            return False
+        mel_queue.put(item)
+        return self.cancel_dict[uuid] is False
+
+    def release_session(self, uuid, llm_thread, flow_thread, mel_queue):
+        """Cancel a session and wait for its llm and flow stage, safe to call after a normal finish."""
+        self.cancel_session(uuid)
+        if mel_queue is not None:
+            # NOTE unblock a put of flow stage on the full queue, it returns at the next cancel check
+            while True:
+                try:
+                    mel_queue.get_nowait()
+                except queue.Empty:
+                    break
+        if flow_thread is not None:
+            flow_thread.join()
+        if llm_thread is not None:
+            llm_thread.join()
+
+    def token2mel(self, token, prompt_token, prompt_feat, embedding, uuid, finalize=False):
         with torch.cuda.amp.autocast(self.fp16):
             tts_mel, self.flow_cache_dict[uuid] = self.flow.inference(token=token.to(self.device),
                                                                       token_len=torch.tensor([token.shape[1]], dtype=torch.int32).to(self.device),
@@ -141,17 +252,27 @@ class CosyVoiceModel:
         # mel overlap fade in out
         if self.mel_overlap_dict[uuid].shape[2] != 0:
             tts_mel = fade_in_out(tts_mel, self.mel_overlap_dict[uuid], self.mel_window)
+        # keep overlap mel
+        if finalize is False:
+            self.mel_overlap_dict[uuid] = tts_mel[:, :, -self.mel_overlap_len:]
+            tts_mel = tts_mel[:, :, :-self.mel_overlap_len]
+        return tts_mel
+
+    def mel2wav(self, tts_mel, uuid, finalize=False, speed=1.0):
+        if self.stateful_hift is True and (finalize is False or self.hift_cache_dict[uuid] is not None):
+            # every mel frame is vocoded once, no mel_cache_len overlap and no speech fade in out
+            assert speed == 1.0, 'speed change only support non-stream inference mode'
+            tts_speech, self.hift_cache_dict[uuid] = self.hift.inference_stream(speech_feat=tts_mel, cache=self.hift_cache_dict[uuid], finalize=finalize)
+            return tts_speech
         # append hift cache
         if self.hift_cache_dict[uuid] is not None:
             hift_cache_mel, hift_cache_source = self.hift_cache_dict[uuid]['mel'], self.hift_cache_dict[uuid]['source']
             tts_mel = torch.concat([hift_cache_mel, tts_mel], dim=2)
         else:
             hift_cache_source = torch.zeros(1, 1, 0)
-        # keep overlap mel and hift cache
+        # keep hift cache
         if finalize is False:
-            self.mel_overlap_dict[uuid] = tts_mel[:, :, -self.mel_overlap_len:]
-            tts_mel = tts_mel[:, :, :-self.mel_overlap_len]
-            tts_speech, tts_source = self.hift.inference(speech_feat=tts_mel, cache_source=hift_cache_source)
+            tts_speech, tts_source = self.hift_inference(speech_feat=tts_mel, cache_source=hift_cache_source)
             if self.hift_cache_dict[uuid] is not None:
                 tts_speech = fade_in_out(tts_speech, self.hift_cache_dict[uuid]['speech'], self.speech_window)
             self.hift_cache_dict[uuid] = {'mel': tts_mel[:, :, -self.mel_cache_len:],
@@ -162,11 +283,61 @@ class CosyVoiceModel:
             if speed != 1.0:
                 assert self.hift_cache_dict[uuid] is None, 'speed change only support non-stream inference mode'
                 tts_mel = F.interpolate(tts_mel, size=int(tts_mel.shape[2] / speed), mode='linear')
-            tts_speech, tts_source = self.hift.inference(speech_feat=tts_mel, cache_source=hift_cache_source)
+            tts_speech, tts_source = self.hift_inference(speech_feat=tts_mel, cache_source=hift_cache_source)
             if self.hift_cache_dict[uuid] is not None:
                 tts_speech = fade_in_out(tts_speech, self.hift_cache_dict[uuid]['speech'], self.speech_window)
         return tts_speech
 
+    def token2wav(self, token, prompt_token, prompt_feat, embedding, uuid, finalize=False, speed=1.0):
+        tts_mel = self.token2mel(token, prompt_token, prompt_feat, embedding, uuid, finalize=finalize)
+        return self.mel2wav(tts_mel, uuid, finalize=finalize, speed=speed)
+
+    def flow_job(self, flow_prompt_speech_token, prompt_speech_feat, flow_embedding, uuid, mel_queue):
+        try:
+            token_hop_len = self.token_min_hop_len
+            while True:
+                if self.wait_speech_token(uuid, token_hop_len + self.token_overlap_len) < token_hop_len + self.token_overlap_len:
+                    break
+                with self.token_cond_dict[uuid]:
+                    this_tts_speech_token = torch.tensor(self.tts_speech_token_dict[uuid][:token_hop_len + self.token_overlap_len]).unsqueeze(dim=0)
+                this_tts_mel = self.token2mel(token=this_tts_speech_token,
+                                              prompt_token=flow_prompt_speech_token,
+                                              prompt_feat=prompt_speech_feat,
+                                              embedding=flow_embedding,
+                                              uuid=uuid,
+                                              finalize=False)
+                if self.put_mel(uuid, mel_queue, (this_tts_mel, False)) is False:
+                    return
+                with self.token_cond_dict[uuid]:
+                    self.tts_speech_token_dict[uuid] = self.tts_speech_token_dict[uuid][token_hop_len:]
+                # increase token_hop_len for better speech quality
+                token_hop_len = min(self.token_max_hop_len, int(token_hop_len * self.stream_scale_factor))
+            if self.cancel_dict[uuid] is True:
+                return
+            # deal with remain tokens, make sure inference remain token len equals token_hop_len when cache_speech is not None
+            this_tts_speech_token = torch.tensor(self.tts_speech_token_dict[uuid]).unsqueeze(dim=0)
+            this_tts_mel = self.token2mel(token=this_tts_speech_token,
+                                          prompt_token=flow_prompt_speech_token,
+                                          prompt_feat=prompt_speech_feat,
+                                          embedding=flow_embedding,
+                                          uuid=uuid,
+                                          finalize=True)
+            self.put_mel(uuid, mel_queue, (this_tts_mel, True))
+        except Exception as e:
+            self.put_mel(uuid, mel_queue, e)
+
+    def hift_stream(self, mel_queue, uuid):
+        # vocode chunk k while flow stage computes chunk k + 1
+        while True:
+            item = mel_queue.get()
+            if isinstance(item, Exception):
+                raise item
+            this_tts_mel, finalize = item
+            this_tts_speech = self.mel2wav(this_tts_mel, uuid, finalize=finalize)
+            yield {'tts_speech': this_tts_speech.cpu()}
+            if finalize is True:
+                break
+
     def tts(self, text=torch.zeros(1, 0, dtype=torch.int32), flow_embedding=torch.zeros(0, 192), llm_embedding=torch.zeros(0, 192),
             prompt_text=torch.zeros(1, 0, dtype=torch.int32),
             llm_prompt_speech_token=torch.zeros(1, 0, dtype=torch.int32),
@@ -176,65 +347,56 @@ class CosyVoiceModel:
         this_uuid = str(uuid.uuid1())
         with self.lock:
             self.tts_speech_token_dict[this_uuid], self.llm_end_dict[this_uuid] = [], False
+            self.token_cond_dict[this_uuid] = threading.Condition()
+            self.cancel_dict[this_uuid] = False
             self.hift_cache_dict[this_uuid] = None
             self.mel_overlap_dict[this_uuid] = torch.zeros(1, 80, 0)
             self.flow_cache_dict[this_uuid] = torch.zeros(1, 80, 0, 2)
-        if source_speech_token.shape[1] == 0:
-            p = threading.Thread(target=self.llm_job, args=(text, prompt_text, llm_prompt_speech_token, llm_embedding, this_uuid))
-        else:
-            p = threading.Thread(target=self.vc_job, args=(source_speech_token, this_uuid))
-        p.start()
-        if stream is True:
-            token_hop_len = self.token_min_hop_len
-            while True:
-                time.sleep(0.1)
-                if len(self.tts_speech_token_dict[this_uuid]) >= token_hop_len + self.token_overlap_len:
-                    this_tts_speech_token = torch.tensor(self.tts_speech_token_dict[this_uuid][:token_hop_len + self.token_overlap_len]) \
-                        .unsqueeze(dim=0)
-                    this_tts_speech = self.token2wav(token=this_tts_speech_token,
-                                                     prompt_token=flow_prompt_speech_token,
-                                                     prompt_feat=prompt_speech_feat,
-                                                     embedding=flow_embedding,
-                                                     uuid=this_uuid,
-                                                     finalize=False)
-                    yield {'tts_speech': this_tts_speech.cpu()}
-                    with self.lock:
-                        self.tts_speech_token_dict[this_uuid] = self.tts_speech_token_dict[this_uuid][token_hop_len:]
-                    # increase token_hop_len for better speech quality
-                    token_hop_len = min(self.token_max_hop_len, int(token_hop_len * self.stream_scale_factor))
-                if self.llm_end_dict[this_uuid] is True and len(self.tts_speech_token_dict[this_uuid]) < token_hop_len + self.token_overlap_len:
-                    break
-            p.join()
-            # deal with remain tokens, make sure inference remain token len equals token_hop_len when cache_speech is not None
-            this_tts_speech_token = torch.tensor(self.tts_speech_token_dict[this_uuid]).unsqueeze(dim=0)
-            this_tts_speech = self.token2wav(token=this_tts_speech_token,
-                                             prompt_token=flow_prompt_speech_token,
-                                             prompt_feat=prompt_speech_feat,
-                                             embedding=flow_embedding,
-                                             uuid=this_uuid,
-                                             finalize=True)
-            yield {'tts_speech': this_tts_speech.cpu()}
-        else:
-            # deal with all tokens
-            p.join()
-            this_tts_speech_token = torch.tensor(self.tts_speech_token_dict[this_uuid]).unsqueeze(dim=0)
-            this_tts_speech = self.token2wav(token=this_tts_speech_token,
-                                             prompt_token=flow_prompt_speech_token,
-                                             prompt_feat=prompt_speech_feat,
-                                             embedding=flow_embedding,
-                                             uuid=this_uuid,
-                                             finalize=True,
-                                             speed=speed)
-            yield {'tts_speech': this_tts_speech.cpu()}
-        with self.lock:
-            self.tts_speech_token_dict.pop(this_uuid)
-            self.llm_end_dict.pop(this_uuid)
-            self.mel_overlap_dict.pop(this_uuid)
-            self.hift_cache_dict.pop(this_uuid)
-            self.flow_cache_dict.pop(this_uuid)
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
-            torch.cuda.current_stream().synchronize()
+        if hasattr(self, 'admission'):
+            self.admission.bind(this_uuid)
+        p, f, mel_queue = None, None, None
+        try:
+            if source_speech_token.shape[1] == 0:
+                p = threading.Thread(target=self.llm_job, args=(text, prompt_text, llm_prompt_speech_token, llm_embedding, this_uuid))
+            else:
+                p = threading.Thread(target=self.vc_job, args=(source_speech_token, this_uuid))
+            p.start()
+            if stream is True:
+                # llm -> flow -> hift stages, flow stage is woken up by llm_job as soon as enough tokens are ready
+                mel_queue = queue.Queue(maxsize=self.mel_queue_size)
+                f = threading.Thread(target=self.flow_job, args=(flow_prompt_speech_token, prompt_speech_feat, flow_embedding, this_uuid, mel_queue))
+                f.start()
+                for model_output in self.hift_stream(mel_queue, this_uuid):
+                    yield model_output
+            else:
+                # deal with all tokens
+                p.join()
+                this_tts_speech_token = torch.tensor(self.tts_speech_token_dict[this_uuid]).unsqueeze(dim=0)
+                this_tts_speech = self.token2wav(token=this_tts_speech_token,
+                                                 prompt_token=flow_prompt_speech_token,
+                                                 prompt_feat=prompt_speech_feat,
+                                                 embedding=flow_embedding,
+                                                 uuid=this_uuid,
+                                                 finalize=True,
+                                                 speed=speed)
+                yield {'tts_speech': this_tts_speech.cpu()}
+        finally:
+            # NOTE also runs when the consumer stops early, e.g. break, generator close or client disconnect
+            if hasattr(self, 'admission'):
+                # unbind first, a preempted llm_job waits in admission.wait_resumed
+                self.admission.unbind(this_uuid)
+            self.release_session(this_uuid, p, f, mel_queue)
+            with self.lock:
+                self.tts_speech_token_dict.pop(this_uuid)
+                self.llm_end_dict.pop(this_uuid)
+                self.token_cond_dict.pop(this_uuid)
+                self.cancel_dict.pop(this_uuid)
+                self.mel_overlap_dict.pop(this_uuid)
+                self.hift_cache_dict.pop(this_uuid)
+                self.flow_cache_dict.pop(this_uuid)
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+                torch.cuda.current_stream().synchronize()
 
 
 class CosyVoice2Model(CosyVoiceModel):
@@ -258,14 +420,20 @@ class CosyVoice2Model(CosyVoiceModel):
         self.mel_cache_len = 8
         self.source_cache_len = int(self.mel_cache_len * 480)
         # speech fade in out
-        self.speech_window = np.hamming(2 * self.source_cache_len)
+        self.speech_window = torch.from_numpy(np.hamming(2 * self.source_cache_len)).float().to(self.device)
+        # carry hift state between chunks instead of hift cache, see load_stateful_hift
+        self.stateful_hift = False
         # rtf and decoding related
+        self.mel_queue_size = 2
         self.llm_context = torch.cuda.stream(torch.cuda.Stream(self.device)) if torch.cuda.is_available() else nullcontext()
         self.lock = threading.Lock()
         # dict used to store session related variable
         self.tts_speech_token_dict = {}
         self.llm_end_dict = {}
+        self.token_cond_dict = {}
+        self.cancel_dict = {}
         self.hift_cache_dict = {}
+        self.flow_cache_dict = {}
 
     def load_jit(self, flow_encoder_model):
         flow_encoder = torch.jit.load(flow_encoder_model, map_location=self.device)
@@ -282,105 +450,195 @@ class CosyVoice2Model(CosyVoiceModel):
         self.llm.lock = threading.Lock()
         del self.llm.llm.model.model.layers
 
-    def token2wav(self, token, prompt_token, prompt_feat, embedding, token_offset, uuid, stream=False, finalize=False, speed=1.0):
+    def load_batch_decode(self, max_batch_size):
+        assert not hasattr(self.llm, 'vllm'), 'batch decode and vllm can not be used together!'
+        self.llm.batch_scheduler = ContinuousBatchScheduler(self.llm, max_batch_size=max_batch_size, fp16=self.fp16)
+
+    def load_static_kv_cache(self):
+        assert not hasattr(self.llm, 'vllm'), 'static kv cache and vllm can not be used together!'
+        self.llm.static_kv_cache = True
+
+    def load_prefix_cache(self, max_mb=512, max_entries=256):
+        assert not hasattr(self.llm, 'vllm'), 'prefix cache and vllm can not be used together!'
+        self.llm.prefix_cache = PrefixKVCache(self.llm, max_bytes=int(max_mb * 1024 * 1024), max_entries=max_entries)
+
+    def load_speculative(self, num_draft=4, ngram_max=3, min_accept_rate=0.2):
+        assert not hasattr(self.llm, 'vllm') and not hasattr(self.llm, 'batch_scheduler'), 'speculative decode can not be used with vllm or batch decode!'
+        self.llm.speculative = SpeculativeDecoder(self.llm, num_draft=num_draft, ngram_max=ngram_max, min_accept_rate=min_accept_rate)
+
+    def load_encoder_chunk_cache(self):
+        assert hasattr(self.flow.encoder, 'forward_chunk'), 'encoder chunk cache does not support jit flow encoder!'
+        assert self.flow.encoder.static_chunk_size > 0, 'encoder chunk cache needs static_chunk_size > 0!'
+        self.flow.encoder_chunk_cache = True
+
+    def load_decoder_chunk_cache(self, max_len=1500):
+        assert isinstance(self.flow.decoder.estimator, torch.nn.Module), 'decoder chunk cache only supports torch estimator!'
+        assert hasattr(self.flow.decoder.estimator, 'forward_chunk') and len(self.flow.decoder.estimator.down_blocks) == 1, \
+            'decoder chunk cache needs a causal estimator without Downsample1D!'
+        # NOTE every mel frame keeps key/value of all transformer blocks for every ode step, limit max_len by memory
+        self.flow.decoder_chunk_cache_len = max_len
+
+    def load_spk_cond_cache(self, max_entries=64, max_mb=256):
+        self.spk_cond_cache = SpeakerCondCache(max_bytes=int(max_mb * 1024 * 1024), max_entries=max_entries)
+
+    def warmup_spk_cond_cache(self, spk2info, spk_ids, stream=False):
+        # NOTE same autocast as token2mel, so cached conditioning has the same dtype as a cache miss
+        for spk_id in spk_ids:
+            info = spk2info[spk_id]
+            self.get_spk_cond(spk_id,
+                              info.get('flow_prompt_speech_token', torch.zeros(1, 0, dtype=torch.int32)),
+                              info.get('prompt_speech_feat', torch.zeros(1, 0, 80)),
+                              info['flow_embedding' if 'flow_embedding' in info else 'embedding'],
+                              stream=stream)
+        logging.info('warmup flow conditioning of {} speakers, {}'.format(len(spk_ids), self.spk_cond_cache.get_stats()))
+
+    def get_spk_cond(self, spk_id, prompt_token, prompt_feat, embedding, stream=False):
+        spk_cond = self.spk_cond_cache.get(spk_id)
         with torch.cuda.amp.autocast(self.fp16):
-            tts_mel, _ = self.flow.inference(token=token.to(self.device),
-                                             token_len=torch.tensor([token.shape[1]], dtype=torch.int32).to(self.device),
-                                             prompt_token=prompt_token.to(self.device),
-                                             prompt_token_len=torch.tensor([prompt_token.shape[1]], dtype=torch.int32).to(self.device),
-                                             prompt_feat=prompt_feat.to(self.device),
-                                             prompt_feat_len=torch.tensor([prompt_feat.shape[1]], dtype=torch.int32).to(self.device),
-                                             embedding=embedding.to(self.device),
-                                             streaming=stream,
-                                             finalize=finalize)
+            new_spk_cond = self.flow.prepare_spk_cond(prompt_token.to(self.device), prompt_feat.to(self.device), embedding.to(self.device),
+                                                      streaming=stream, spk_cond=spk_cond)
+        if new_spk_cond is not spk_cond:
+            self.spk_cond_cache.put(spk_id, new_spk_cond)
+        return new_spk_cond
+
+    def load_batch_flow(self, max_batch_size, max_wait=0.01):
+        assert isinstance(self.flow.decoder.estimator, torch.nn.Module), 'batch flow only supports torch estimator!'
+        self.flow.decoder_batcher = BatchCollector(self.flow_decoder_batch, max_batch_size=max_batch_size, max_wait=max_wait,
+                                                   key_fn=lambda item: (tuple(sorted(item['sampling'].items())), item['streaming']))
+
+    def flow_decoder_batch(self, items):
+        with torch.inference_mode(), torch.cuda.amp.autocast(self.fp16):
+            return self.flow.decoder.forward_batch(mu=[i['mu'] for i in items],
+                                                   mask=[i['mask'] for i in items],
+                                                   spks=[i['spks'] for i in items],
+                                                   cond=[i['cond'] for i in items],
+                                                   streaming=items[0]['streaming'],
+                                                   **items[0]['sampling'])
+
+    def token2mel(self, token, prompt_token, prompt_feat, embedding, token_offset, uuid, stream=False, finalize=False, flow_sampling=None, spk_id=''):
+        # speaker conditioning of a registered speaker comes from spk_cond_cache, see load_spk_cond_cache
+        spk_cond = None
+        if spk_id != '' and hasattr(self, 'spk_cond_cache'):
+            spk_cond = self.get_spk_cond(spk_id, prompt_token, prompt_feat, embedding, stream=stream)
+        with torch.cuda.amp.autocast(self.fp16):
+            tts_mel, self.flow_cache_dict[uuid] = self.flow.inference(token=token.to(self.device),
+                                                                      token_len=torch.tensor([token.shape[1]], dtype=torch.int32).to(self.device),
+                                                                      prompt_token=prompt_token.to(self.device),
+                                                                      prompt_token_len=torch.tensor([prompt_token.shape[1]], dtype=torch.int32).to(self.device),
+                                                                      prompt_feat=prompt_feat.to(self.device),
+                                                                      prompt_feat_len=torch.tensor([prompt_feat.shape[1]], dtype=torch.int32).to(self.device),
+                                                                      embedding=embedding.to(self.device),
+                                                                      streaming=stream,
+                                                                      finalize=finalize,
+                                                                      flow_cache=self.flow_cache_dict[uuid],
+                                                                      sampling=flow_sampling,
+                                                                      spk_cond=spk_cond)
         tts_mel = tts_mel[:, :, token_offset * self.flow.token_mel_ratio:]
-        # append hift cache
-        if self.hift_cache_dict[uuid] is not None:
-            hift_cache_mel, hift_cache_source = self.hift_cache_dict[uuid]['mel'], self.hift_cache_dict[uuid]['source']
-            tts_mel = torch.concat([hift_cache_mel, tts_mel], dim=2)
-        else:
-            hift_cache_source = torch.zeros(1, 1, 0)
-        # keep overlap mel and hift cache
-        if finalize is False:
-            tts_speech, tts_source = self.hift.inference(speech_feat=tts_mel, cache_source=hift_cache_source)
-            if self.hift_cache_dict[uuid] is not None:
-                tts_speech = fade_in_out(tts_speech, self.hift_cache_dict[uuid]['speech'], self.speech_window)
-            self.hift_cache_dict[uuid] = {'mel': tts_mel[:, :, -self.mel_cache_len:],
-                                          'source': tts_source[:, :, -self.source_cache_len:],
-                                          'speech': tts_speech[:, -self.source_cache_len:]}
-            tts_speech = tts_speech[:, :-self.source_cache_len]
-        else:
-            if speed != 1.0:
-                assert self.hift_cache_dict[uuid] is None, 'speed change only support non-stream inference mode'
-                tts_mel = F.interpolate(tts_mel, size=int(tts_mel.shape[2] / speed), mode='linear')
-            tts_speech, tts_source = self.hift.inference(speech_feat=tts_mel, cache_source=hift_cache_source)
-            if self.hift_cache_dict[uuid] is not None:
-                tts_speech = fade_in_out(tts_speech, self.hift_cache_dict[uuid]['speech'], self.speech_window)
-        return tts_speech
+        return tts_mel
+
+    def token2wav(self, token, prompt_token, prompt_feat, embedding, token_offset, uuid, stream=False, finalize=False, speed=1.0, flow_sampling=None, spk_id=''):
+        tts_mel = self.token2mel(token, prompt_token, prompt_feat, embedding, token_offset, uuid, stream=stream, finalize=finalize, flow_sampling=flow_sampling, spk_id=spk_id)
+        return self.mel2wav(tts_mel, uuid, finalize=finalize, speed=speed)
+
+    def flow_job(self, flow_prompt_speech_token, prompt_speech_feat, flow_embedding, uuid, mel_queue, flow_sampling=None, spk_id=''):
+        try:
+            token_offset = 0
+            prompt_token_pad = int(np.ceil(flow_prompt_speech_token.shape[1] / self.token_hop_len) * self.token_hop_len - flow_prompt_speech_token.shape[1])
+            while True:
+                this_token_hop_len = self.token_hop_len + prompt_token_pad if token_offset == 0 else self.token_hop_len
+                this_token_len = token_offset + this_token_hop_len + self.flow.pre_lookahead_len
+                # wake up as soon as token_hop_len + pre_lookahead_len new tokens are ready
+                if self.wait_speech_token(uuid, this_token_len) < this_token_len:
+                    break
+                with self.token_cond_dict[uuid]:
+                    this_tts_speech_token = torch.tensor(self.tts_speech_token_dict[uuid][:this_token_len]).unsqueeze(dim=0)
+                this_tts_mel = self.token2mel(token=this_tts_speech_token,
+                                              prompt_token=flow_prompt_speech_token,
+                                              prompt_feat=prompt_speech_feat,
+                                              embedding=flow_embedding,
+                                              token_offset=token_offset,
+                                              uuid=uuid,
+                                              stream=True,
+                                              finalize=False,
+                                              flow_sampling=flow_sampling,
+                                              spk_id=spk_id)
+                token_offset += this_token_hop_len
+                if self.put_mel(uuid, mel_queue, (this_tts_mel, False)) is False:
+                    return
+            if self.cancel_dict[uuid] is True:
+                return
+            # deal with remain tokens, make sure inference remain token len equals token_hop_len when cache_speech is not None
+            this_tts_speech_token = torch.tensor(self.tts_speech_token_dict[uuid]).unsqueeze(dim=0)
+            this_tts_mel = self.token2mel(token=this_tts_speech_token,
+                                          prompt_token=flow_prompt_speech_token,
+                                          prompt_feat=prompt_speech_feat,
+                                          embedding=flow_embedding,
+                                          token_offset=token_offset,
+                                          uuid=uuid,
+                                          finalize=True,
+                                          flow_sampling=flow_sampling,
+                                          spk_id=spk_id)
+            self.put_mel(uuid, mel_queue, (this_tts_mel, True))
+        except Exception as e:
+            self.put_mel(uuid, mel_queue, e)
 
     def tts(self, text=torch.zeros(1, 0, dtype=torch.int32), flow_embedding=torch.zeros(0, 192), llm_embedding=torch.zeros(0, 192),
             prompt_text=torch.zeros(1, 0, dtype=torch.int32),
             llm_prompt_speech_token=torch.zeros(1, 0, dtype=torch.int32),
             flow_prompt_speech_token=torch.zeros(1, 0, dtype=torch.int32),
-            prompt_speech_feat=torch.zeros(1, 0, 80), source_speech_token=torch.zeros(1, 0, dtype=torch.int32), stream=False, speed=1.0, **kwargs):
+            prompt_speech_feat=torch.zeros(1, 0, 80), source_speech_token=torch.zeros(1, 0, dtype=torch.int32), stream=False, speed=1.0, flow_sampling=None, spk_id='', **kwargs):
         # this_uuid is used to track variables related to this inference thread
         this_uuid = str(uuid.uuid1())
         with self.lock:
             self.tts_speech_token_dict[this_uuid], self.llm_end_dict[this_uuid] = [], False
+            self.token_cond_dict[this_uuid] = threading.Condition()
+            self.cancel_dict[this_uuid] = False
             self.hift_cache_dict[this_uuid] = None
-        if source_speech_token.shape[1] == 0:
-            p = threading.Thread(target=self.llm_job, args=(text, prompt_text, llm_prompt_speech_token, llm_embedding, this_uuid))
-        else:
-            p = threading.Thread(target=self.vc_job, args=(source_speech_token, this_uuid))
-        p.start()
-        if stream is True:
-            token_offset = 0
-            prompt_token_pad = int(np.ceil(flow_prompt_speech_token.shape[1] / self.token_hop_len) * self.token_hop_len - flow_prompt_speech_token.shape[1])
-            while True:
-                time.sleep(0.1)
-                this_token_hop_len = self.token_hop_len + prompt_token_pad if token_offset == 0 else self.token_hop_len
-                if len(self.tts_speech_token_dict[this_uuid]) - token_offset >= this_token_hop_len + self.flow.pre_lookahead_len:
-                    this_tts_speech_token = torch.tensor(self.tts_speech_token_dict[this_uuid][:token_offset + this_token_hop_len + self.flow.pre_lookahead_len]).unsqueeze(dim=0)
-                    this_tts_speech = self.token2wav(token=this_tts_speech_token,
-                                                     prompt_token=flow_prompt_speech_token,
-                                                     prompt_feat=prompt_speech_feat,
-                                                     embedding=flow_embedding,
-                                                     token_offset=token_offset,
-                                                     uuid=this_uuid,
-                                                     stream=stream,
-                                                     finalize=False)
-                    token_offset += this_token_hop_len
-                    yield {'tts_speech': this_tts_speech.cpu()}
-                if self.llm_end_dict[this_uuid] is True and len(self.tts_speech_token_dict[this_uuid]) - token_offset < this_token_hop_len + self.flow.pre_lookahead_len:
-                    break
-            p.join()
-            # deal with remain tokens, make sure inference remain token len equals token_hop_len when cache_speech is not None
-            this_tts_speech_token = torch.tensor(self.tts_speech_token_dict[this_uuid]).unsqueeze(dim=0)
-            this_tts_speech = self.token2wav(token=this_tts_speech_token,
-                                             prompt_token=flow_prompt_speech_token,
-                                             prompt_feat=prompt_speech_feat,
-                                             embedding=flow_embedding,
-                                             token_offset=token_offset,
-                                             uuid=this_uuid,
-                                             finalize=True)
-            yield {'tts_speech': this_tts_speech.cpu()}
-        else:
-            # deal with all tokens
-            p.join()
-            this_tts_speech_token = torch.tensor(self.tts_speech_token_dict[this_uuid]).unsqueeze(dim=0)
-            this_tts_speech = self.token2wav(token=this_tts_speech_token,
-                                             prompt_token=flow_prompt_speech_token,
-                                             prompt_feat=prompt_speech_feat,
-                                             embedding=flow_embedding,
-                                             token_offset=0,
-                                             uuid=this_uuid,
-                                             finalize=True,
-                                             speed=speed)
-            yield {'tts_speech': this_tts_speech.cpu()}
-        with self.lock:
-            self.tts_speech_token_dict.pop(this_uuid)
-            self.llm_end_dict.pop(this_uuid)
-            self.hift_cache_dict.pop(this_uuid)
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
-            torch.cuda.current_stream().synchronize()
+            self.flow_cache_dict[this_uuid] = None
+        if hasattr(self, 'admission'):
+            self.admission.bind(this_uuid)
+        p, f, mel_queue = None, None, None
+        try:
+            if source_speech_token.shape[1] == 0:
+                p = threading.Thread(target=self.llm_job, args=(text, prompt_text, llm_prompt_speech_token, llm_embedding, this_uuid))
+            else:
+                p = threading.Thread(target=self.vc_job, args=(source_speech_token, this_uuid))
+            p.start()
+            if stream is True:
+                # llm -> flow -> hift stages, flow stage is woken up by llm_job as soon as enough tokens are ready
+                mel_queue = queue.Queue(maxsize=self.mel_queue_size)
+                f = threading.Thread(target=self.flow_job, args=(flow_prompt_speech_token, prompt_speech_feat, flow_embedding, this_uuid, mel_queue, flow_sampling, spk_id))
+                f.start()
+                for model_output in self.hift_stream(mel_queue, this_uuid):
+                    yield model_output
+            else:
+                # deal with all tokens
+                p.join()
+                this_tts_speech_token = torch.tensor(self.tts_speech_token_dict[this_uuid]).unsqueeze(dim=0)
+                this_tts_speech = self.token2wav(token=this_tts_speech_token,
+                                                 prompt_token=flow_prompt_speech_token,
+                                                 prompt_feat=prompt_speech_feat,
+                                                 embedding=flow_embedding,
+                                                 token_offset=0,
+                                                 uuid=this_uuid,
+                                                 finalize=True,
+                                                 speed=speed,
+                                                 flow_sampling=flow_sampling,
+                                                 spk_id=spk_id)
+                yield {'tts_speech': this_tts_speech.cpu()}
+        finally:
+            # NOTE also runs when the consumer stops early, e.g. break, generator close or client disconnect
+            if hasattr(self, 'admission'):
+                # unbind first, a preempted llm_job waits in admission.wait_resumed
+                self.admission.unbind(this_uuid)
+            self.release_session(this_uuid, p, f, mel_queue)
+            with self.lock:
+                self.tts_speech_token_dict.pop(this_uuid)
+                self.llm_end_dict.pop(this_uuid)
+                self.token_cond_dict.pop(this_uuid)
+                self.cancel_dict.pop(this_uuid)
+                self.hift_cache_dict.pop(this_uuid)
+                self.flow_cache_dict.pop(this_uuid)
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+                torch.cuda.current_stream().synchronize()
@@ -0,0 +1,82 @@
+# Copyright (c) 2025 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import hashlib
+import os
+import threading
+import torch
+from cosyvoice.utils.common import LRUCache
+from cosyvoice.utils.file_utils import logging
+
+
+def file_hash(path: str) -> str:
+    """Cheap fingerprint of a model file, its size and first megabyte."""
+    h = hashlib.sha1()
+    h.update('{}'.format(os.path.getsize(path)).encode('utf-8'))
+    with open(path, 'rb') as f:
+        h.update(f.read(1024 * 1024))
+    return h.hexdigest()[:16]
+
+
+class PromptFeatCache(LRUCache):
+    """Content addressed cache of prompt speech features, see CosyVoiceFrontEnd._extract_prompt_speech.
+
+    Entries are the speech token, speech feat and speaker embedding of a prompt, keyed by
+    the hash of the 16k prompt waveform and the model id, so the same prompt audio passed
+    again skips the speech tokenizer, feat extractor and campplus. The in memory tier is
+    evicted by LRU once max_entries or max_bytes is exceeded. If cache_dir is set, every
+    entry is also saved there and a memory miss is looked up on disk before extracting.
+    """
+
+    def __init__(self, model_id: str, max_bytes: int = 256 * 1024 * 1024, max_entries: int = 64, cache_dir: str = '', device: str = 'cpu'):
+        super().__init__(max_bytes=max_bytes, max_entries=max_entries)
+        self.model_id = model_id
+        self.cache_dir = cache_dir
+        self.device = device
+        if self.cache_dir != '':
+            os.makedirs(self.cache_dir, exist_ok=True)
+        self.disk_hits = 0
+
+    def key(self, speech: torch.Tensor, resample_rate: int) -> str:
+        h = hashlib.sha1()
+        h.update('{}{}{}{}'.format(self.model_id, resample_rate, tuple(speech.shape), speech.dtype).encode('utf-8'))
+        h.update(speech.detach().cpu().contiguous().numpy().tobytes())
+        return h.hexdigest()
+
+    def load(self, key):
+        path = os.path.join(self.cache_dir, '{}.pt'.format(key)) if self.cache_dir != '' else ''
+        if path == '' or not os.path.exists(path):
+            return None
+        try:
+            entry = torch.load(path, map_location=self.device)
+        except Exception as e:
+            logging.warning('failed to load prompt feat cache {}, {}'.format(path, e))
+            return None
+        with self.lock:
+            self.disk_hits += 1
+        return entry
+
+    def put(self, key, entry):
+        super().put(key, entry)
+        if self.cache_dir != '':
+            # NOTE write then rename, so a concurrent get never loads a partial file
+            path = os.path.join(self.cache_dir, '{}.pt'.format(key))
+            tmp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+            torch.save({k: v.cpu() for k, v in entry.items()}, tmp_path)
+            os.replace(tmp_path, path)
+
+    def get_stats(self):
+        stats = super().get_stats()
+        with self.lock:
+            stats['disk_hits'] = self.disk_hits
+        return stats
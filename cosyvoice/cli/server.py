@@ -0,0 +1,324 @@
+# Copyright (c) 2025 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Local streaming tts server.
+
+HTTP, audio is returned as raw PCM16 mono with chunked transfer encoding:
+    GET  /speakers
+    GET  /inference_sft?tts_text=...&spk_id=...
+    GET  /inference_zero_shot?tts_text=...&zero_shot_spk_id=...
+    POST /inference_zero_shot?tts_text=...&prompt_text=...   body is the prompt wav file
+
+WebSocket, GET /ws, every request is a text message like
+    {"mode": "sft", "tts_text": "...", "spk_id": "..."}
+    {"mode": "zero_shot", "tts_text": "...", "zero_shot_spk_id": "..."}
+audio is sent back as binary PCM16 messages, followed by one text message with timing.
+
+The model is taken from get_model on every request, it is never loaded by the server itself.
+"""
+import argparse
+import base64
+import hashlib
+import io
+import json
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import torch
+import torchaudio
+from cosyvoice.utils.file_utils import logging
+
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC11B65'
+
+
+def speech_to_pcm16(speech: torch.Tensor) -> bytes:
+    return (speech.clamp(-1, 1) * 32767).to(torch.int16).flatten().cpu().numpy().tobytes()
+
+
+class TTSRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        logging.debug('{} {}'.format(self.address_string(), format % args))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        if url.path == '/speakers':
+            self.send_json(200, {'speakers': self.server.get_model().list_available_spks()})
+        elif url.path == '/ws':
+            self.handle_websocket()
+        elif url.path in ['/inference_sft', '/inference_zero_shot']:
+            self.handle_inference(url.path[len('/inference_'):], params)
+        else:
+            self.send_json(404, {'error': 'unknown path {}'.format(url.path)})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        if url.path != '/inference_zero_shot':
+            self.send_json(404, {'error': 'unknown path {}'.format(url.path)})
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if len(body) != 0:
+            speech, sample_rate = torchaudio.load(io.BytesIO(body), backend='soundfile')
+            speech = speech.mean(dim=0, keepdim=True)
+            if sample_rate != 16000:
+                speech = torchaudio.transforms.Resample(orig_freq=sample_rate, new_freq=16000)(speech)
+            params['prompt_speech_16k'] = speech
+        self.handle_inference('zero_shot', params)
+
+    def send_json(self, code, obj):
+        body = json.dumps(obj, ensure_ascii=False).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def write_chunk(self, data: bytes):
+        self.wfile.write('{:x}\r\n'.format(len(data)).encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+    def handle_inference(self, mode, params):
+        start_time = time.time()
+        if not self.server.acquire():
+            self.send_json(503, {'error': 'too many requests, max concurrency {}'.format(self.server.max_concurrency)})
+            return
+        model_outputs = None
+        try:
+            queue_time = time.time() - start_time
+            cosyvoice = self.server.get_model()
+            try:
+                model_outputs = self.server.inference(cosyvoice, mode, params)
+                # NOTE wait for the first chunk before sending headers, so that first chunk latency can be reported
+                first_output = next(model_outputs, None)
+            except (KeyError, ValueError, AssertionError) as e:
+                self.send_json(400, {'error': str(e)})
+                return
+            first_chunk_time = time.time() - start_time
+            self.send_response(200)
+            self.send_header('Content-Type', 'audio/L16; rate={}; channels=1'.format(cosyvoice.sample_rate))
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.send_header('Trailer', 'X-Total-Time, X-Speech-Len, X-RTF')
+            self.send_header('X-Sample-Rate', str(cosyvoice.sample_rate))
+            self.send_header('X-Queue-Time', '{:.4f}'.format(queue_time))
+            self.send_header('X-First-Chunk-Time', '{:.4f}'.format(first_chunk_time))
+            self.end_headers()
+            speech_len = 0
+            if first_output is not None:
+                for model_output in _chain(first_output, model_outputs):
+                    speech_len += model_output['tts_speech'].shape[1]
+                    self.write_chunk(speech_to_pcm16(model_output['tts_speech']))
+            total_time = time.time() - start_time
+            speech_len = speech_len / cosyvoice.sample_rate
+            self.wfile.write(b'0\r\n')
+            self.wfile.write('X-Total-Time: {:.4f}\r\nX-Speech-Len: {:.4f}\r\nX-RTF: {:.4f}\r\n\r\n'.format(
+                total_time, speech_len, total_time / max(speech_len, 1e-6)).encode('ascii'))
+            self.wfile.flush()
+            logging.info('{} request done, queue {:.3f}s first chunk {:.3f}s total {:.3f}s speech {:.3f}s'.format(
+                mode, queue_time, first_chunk_time, total_time, speech_len))
+        finally:
+            # NOTE write_chunk raises when the client disconnects, close stops the llm and flow stage of the dropped request
+            if model_outputs is not None:
+                model_outputs.close()
+            self.server.release()
+
+    def handle_websocket(self):
+        key = self.headers.get('Sec-WebSocket-Key')
+        if self.headers.get('Upgrade', '').lower() != 'websocket' or key is None:
+            self.send_json(400, {'error': 'websocket upgrade required'})
+            return
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode('ascii')).digest()).decode('ascii')
+        self.send_response(101)
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', accept)
+        self.end_headers()
+        self.close_connection = True
+        while True:
+            opcode, payload = self.ws_recv()
+            if opcode is None or opcode == 0x8:
+                self.ws_send(b'', 0x8)
+                break
+            if opcode != 0x1:
+                continue
+            try:
+                params = json.loads(payload.decode('utf-8'))
+            except ValueError:
+                self.ws_send(json.dumps({'error': 'invalid json'}).encode('utf-8'), 0x1)
+                continue
+            self.handle_websocket_inference(params)
+
+    def handle_websocket_inference(self, params):
+        start_time = time.time()
+        if not self.server.acquire():
+            self.ws_send(json.dumps({'error': 'too many requests, max concurrency {}'.format(self.server.max_concurrency)}).encode('utf-8'), 0x1)
+            return
+        model_outputs = None
+        try:
+            queue_time = time.time() - start_time
+            cosyvoice = self.server.get_model()
+            first_chunk_time, speech_len = None, 0
+            try:
+                model_outputs = self.server.inference(cosyvoice, params.get('mode', 'sft'), params)
+                for model_output in model_outputs:
+                    if first_chunk_time is None:
+                        first_chunk_time = time.time() - start_time
+                    speech_len += model_output['tts_speech'].shape[1]
+                    self.ws_send(speech_to_pcm16(model_output['tts_speech']), 0x2)
+            except (KeyError, ValueError, AssertionError) as e:
+                self.ws_send(json.dumps({'error': str(e)}).encode('utf-8'), 0x1)
+                return
+            total_time = time.time() - start_time
+            speech_len = speech_len / cosyvoice.sample_rate
+            self.ws_send(json.dumps({'done': True, 'sample_rate': cosyvoice.sample_rate, 'queue_time': queue_time,
+                                     'first_chunk_time': first_chunk_time, 'total_time': total_time, 'speech_len': speech_len,
+                                     'rtf': total_time / max(speech_len, 1e-6)}).encode('utf-8'), 0x1)
+        finally:
+            # NOTE ws_send raises when the client disconnects, close stops the llm and flow stage of the dropped request
+            if model_outputs is not None:
+                model_outputs.close()
+            self.server.release()
+
+    def ws_recv(self):
+        """Return opcode and payload of the next text, binary or close message, (None, b'') on disconnect.
+
+        Fragmented messages are reassembled from their continuation frames, pings are answered here,
+        they may come between the fragments of a message.
+        """
+        opcode, payload = None, []
+        while True:
+            frame = self.ws_recv_frame()
+            if frame is None:
+                return None, b''
+            fin, frame_opcode, data = frame
+            if frame_opcode == 0x9:
+                self.ws_send(data, 0xA)
+                continue
+            if frame_opcode == 0xA:
+                continue
+            if frame_opcode == 0x8:
+                return frame_opcode, data
+            if frame_opcode != 0x0:
+                opcode, payload = frame_opcode, []
+            elif opcode is None:
+                # continuation without a first fragment, drop it
+                continue
+            payload.append(data)
+            if fin:
+                return opcode, b''.join(payload)
+
+    def ws_recv_frame(self):
+        header = self.rfile.read(2)
+        if len(header) < 2:
+            return None
+        fin, opcode, length = header[0] & 0x80 != 0, header[0] & 0x0F, header[1] & 0x7F
+        if length == 126:
+            length = struct.unpack('>H', self.rfile.read(2))[0]
+        elif length == 127:
+            length = struct.unpack('>Q', self.rfile.read(8))[0]
+        mask = self.rfile.read(4) if header[1] & 0x80 else None
+        data = self.rfile.read(length)
+        if len(data) < length:
+            return None
+        if mask is not None and length > 0:
+            # NOTE xor the whole payload as one integer instead of byte by byte in python
+            mask = (mask * (length // 4 + 1))[:length]
+            data = (int.from_bytes(data, 'big') ^ int.from_bytes(mask, 'big')).to_bytes(length, 'big')
+        return fin, opcode, data
+
+    def ws_send(self, payload: bytes, opcode: int):
+        header = bytes([0x80 | opcode])
+        if len(payload) < 126:
+            header += bytes([len(payload)])
+        elif len(payload) < (1 << 16):
+            header += bytes([126]) + struct.pack('>H', len(payload))
+        else:
+            header += bytes([127]) + struct.pack('>Q', len(payload))
+        self.wfile.write(header + payload)
+        self.wfile.flush()
+
+
+class TTSServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, get_model, host='127.0.0.1', port=50000, max_concurrency=4, stream=True):
+        super().__init__((host, port), TTSRequestHandler)
+        self.get_model = get_model
+        self.max_concurrency = max_concurrency
+        self.stream = stream
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+
+    def acquire(self):
+        return self.semaphore.acquire(blocking=False)
+
+    def release(self):
+        self.semaphore.release()
+
+    def inference(self, cosyvoice, mode, params):
+        stream = str(params.get('stream', self.stream)).lower() in ['1', 'true']
+        speed = float(params.get('speed', 1.0))
+        if mode == 'sft':
+            spk_id = params['spk_id']
+            if spk_id not in cosyvoice.list_available_spks():
+                raise KeyError('unknown spk_id {}'.format(spk_id))
+            return cosyvoice.inference_sft(params['tts_text'], spk_id, stream=stream, speed=speed)
+        elif mode == 'zero_shot':
+            zero_shot_spk_id = params.get('zero_shot_spk_id', '')
+            if zero_shot_spk_id != '':
+                if zero_shot_spk_id not in cosyvoice.list_available_spks():
+                    raise KeyError('unknown zero_shot_spk_id {}'.format(zero_shot_spk_id))
+                # NOTE the prompt of a registered speaker is taken from spk2info, no prompt speech is extracted
+                prompt_speech_16k = None
+            elif 'prompt_speech_16k' in params:
+                prompt_speech_16k = params['prompt_speech_16k']
+            else:
+                raise ValueError('zero_shot needs zero_shot_spk_id or prompt wav in request body')
+            return cosyvoice.inference_zero_shot(params['tts_text'], params.get('prompt_text', ''), prompt_speech_16k,
+                                                 zero_shot_spk_id=zero_shot_spk_id, stream=stream, speed=speed)
+        raise ValueError('unknown mode {}'.format(mode))
+
+
+def start_server(get_model, host='127.0.0.1', port=50000, max_concurrency=4, stream=True):
+    """Start TTSServer in a daemon thread and return it, call server.shutdown() to stop."""
+    server = TTSServer(get_model, host=host, port=port, max_concurrency=max_concurrency, stream=stream)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info('tts server listening on {}:{}'.format(host, server.server_address[1]))
+    return server
+
+
+def _chain(first, rest):
+    yield first
+    for i in rest:
+        yield i
+
+
+def main():
+    parser = argparse.ArgumentParser(description='local streaming tts server')
+    parser.add_argument('--model_dir', type=str, default='pretrained_models/CosyVoice2-0.5B', help='local path')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=50000)
+    parser.add_argument('--max_concurrency', type=int, default=4)
+    args = parser.parse_args()
+    from cosyvoice.cli.cosyvoice import CosyVoice2
+    cosyvoice = CosyVoice2(args.model_dir)
+    server = TTSServer(lambda: cosyvoice, host=args.host, port=args.port, max_concurrency=args.max_concurrency)
+    logging.info('tts server listening on {}:{}'.format(args.host, args.port))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+# Copyright (c) 2025 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import itertools
+import os
+import queue
+import threading
+import uuid
+from typing import List
+import torch
+import torch.multiprocessing as mp
+from cosyvoice.utils.file_utils import logging
+
+
+class CosyVoiceWorkerPool:
+    """Multi process cpu inference for CosyVoice/CosyVoice2.
+
+    llm/flow/hift weights of the given model are moved to shared memory once, then
+    num_workers processes are forked from it, so every worker reads the same weight
+    pages instead of holding its own copy. Each worker is pinned to its own core set
+    and runs with its own intra op thread count, requests are dispatched to workers
+    round robin or by least in flight requests.
+
+    The pool must be created before the model runs any inference, forking a process
+    with busy torch/onnxruntime threads is not safe. Batch loops loaded on the model,
+    see load_batch_decode/load_batch_flow/load_batch_hift, are restarted in every worker.
+    """
+
+    def __init__(self, cosyvoice, num_workers: int = 2, core_sets: List[List[int]] = None,
+                 num_threads: int = 0, dispatch: str = 'least_load'):
+        assert dispatch in ['round_robin', 'least_load'], 'unknown dispatch {}'.format(dispatch)
+        assert cosyvoice.model.device.type == 'cpu', 'worker pool only supports cpu model'
+        if core_sets is None:
+            cores = sorted(os.sched_getaffinity(0))
+            assert len(cores) >= num_workers, 'only {} cores for {} workers'.format(len(cores), num_workers)
+            core_sets = [cores[i::num_workers] for i in range(num_workers)]
+        assert len(core_sets) == num_workers
+        self.dispatch = dispatch
+        for module in [cosyvoice.model.llm, cosyvoice.model.flow, cosyvoice.model.hift]:
+            module.share_memory()
+        ctx = mp.get_context('fork')
+        self.result_queue = ctx.Queue()
+        self.request_queues = [ctx.Queue() for _ in range(num_workers)]
+        # uuid of requests whose consumer gave up, checked by the worker between two chunks
+        self.cancel_queues = [ctx.Queue() for _ in range(num_workers)]
+        self.workers = []
+        for i in range(num_workers):
+            p = ctx.Process(target=_worker_loop,
+                            args=(cosyvoice, i, core_sets[i], num_threads if num_threads > 0 else len(core_sets[i]),
+                                  self.request_queues[i], self.cancel_queues[i], self.result_queue),
+                            daemon=True)
+            p.start()
+            self.workers.append(p)
+        self.lock = threading.Lock()
+        self.output_queue_dict = {}
+        self.in_flight = [0] * num_workers
+        self.num_requests = [0] * num_workers
+        self.round_robin = itertools.cycle(range(num_workers))
+        self.sample_rate = cosyvoice.sample_rate
+        self.result_thread = threading.Thread(target=self._result_loop, daemon=True)
+        self.result_thread.start()
+        logging.info('started {} cpu workers, core sets {}'.format(num_workers, core_sets))
+
+    def _result_loop(self):
+        while True:
+            item = self.result_queue.get()
+            if item is None:
+                break
+            this_uuid, kind, payload = item
+            with self.lock:
+                if kind in ['end', 'error']:
+                    worker_id, output_queue = self.output_queue_dict.pop(this_uuid, (None, None))
+                    if worker_id is not None:
+                        self.in_flight[worker_id] -= 1
+                else:
+                    _, output_queue = self.output_queue_dict.get(this_uuid, (None, None))
+            # NOTE outputs of requests whose consumer already gave up are dropped here, output_queue is None
+            if output_queue is not None:
+                output_queue.put((kind, payload))
+
+    def _select_worker(self):
+        if self.dispatch == 'round_robin':
+            return next(self.round_robin)
+        return min(range(len(self.workers)), key=lambda i: self.in_flight[i])
+
+    def inference(self, method: str, *args, **kwargs):
+        this_uuid = str(uuid.uuid1())
+        output_queue = queue.Queue()
+        with self.lock:
+            worker_id = self._select_worker()
+            self.in_flight[worker_id] += 1
+            self.num_requests[worker_id] += 1
+            self.output_queue_dict[this_uuid] = (worker_id, output_queue)
+        self.request_queues[worker_id].put((this_uuid, method, args, kwargs))
+        finished = False
+        try:
+            while True:
+                kind, payload = output_queue.get()
+                if kind in ['end', 'error']:
+                    finished = True
+                if kind == 'end':
+                    break
+                if kind == 'error':
+                    raise RuntimeError('worker {} failed: {}'.format(worker_id, payload))
+                yield {'tts_speech': torch.from_numpy(payload)}
+        finally:
+            if finished is False:
+                # keep the entry until the worker ends the request, so in_flight stays right, but drop its outputs
+                with self.lock:
+                    in_flight = this_uuid in self.output_queue_dict
+                    if in_flight is True:
+                        self.output_queue_dict[this_uuid] = (worker_id, None)
+                if in_flight is True:
+                    self.cancel_queues[worker_id].put(this_uuid)
+
+    def inference_sft(self, *args, **kwargs):
+        return self.inference('inference_sft', *args, **kwargs)
+
+    def inference_zero_shot(self, *args, **kwargs):
+        return self.inference('inference_zero_shot', *args, **kwargs)
+
+    def inference_cross_lingual(self, *args, **kwargs):
+        return self.inference('inference_cross_lingual', *args, **kwargs)
+
+    def inference_instruct2(self, *args, **kwargs):
+        return self.inference('inference_instruct2', *args, **kwargs)
+
+    def get_stats(self):
+        with self.lock:
+            stats = {'in_flight': list(self.in_flight), 'num_requests': list(self.num_requests)}
+        stats['alive'] = [p.is_alive() for p in self.workers]
+        # pss splits shared pages between processes, so it shows what each worker really adds
+        stats['pss_mb'] = [_pss_mb(p.pid) for p in [mp.current_process()] + self.workers]
+        return stats
+
+    def shutdown(self):
+        for request_queue in self.request_queues:
+            request_queue.put(None)
+        for p in self.workers:
+            p.join()
+        self.result_queue.put(None)
+        self.result_thread.join()
+
+
+def _pss_mb(pid):
+    try:
+        with open('/proc/{}/smaps_rollup'.format(pid)) as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return -1
+
+
+def _batchers(model):
+    """Batch loops loaded on the model, each one runs in its own thread."""
+    batchers = [getattr(model.llm, 'batch_scheduler', None), getattr(model.flow, 'decoder_batcher', None), getattr(model, 'hift_batcher', None)]
+    return [i for i in batchers if i is not None]
+
+
+def _poll_cancel(cancel_queue, cancelled):
+    while True:
+        try:
+            cancelled.add(cancel_queue.get_nowait())
+        except queue.Empty:
+            return cancelled
+
+
+def _worker_loop(cosyvoice, worker_id, cores, num_threads, request_queue, cancel_queue, result_queue):
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(num_threads)
+    # NOTE fork only copies the calling thread, submit to a batcher of the parent would wait forever
+    for batcher in _batchers(cosyvoice.model):
+        batcher.after_fork()
+    logging.info('worker {} pid {} cores {} threads {}'.format(worker_id, os.getpid(), cores, num_threads))
+    cancelled = set()
+    while True:
+        item = request_queue.get()
+        if item is None:
+            break
+        this_uuid, method, args, kwargs = item
+        try:
+            if this_uuid not in _poll_cancel(cancel_queue, cancelled):
+                model_outputs = getattr(cosyvoice, method)(*args, **kwargs)
+                for model_output in model_outputs:
+                    # NOTE send numpy instead of tensor, small tensors would each take a shared memory file descriptor
+                    result_queue.put((this_uuid, 'speech', model_output['tts_speech'].numpy()))
+                    if this_uuid in _poll_cancel(cancel_queue, cancelled):
+                        # stops llm and flow of the request, see CosyVoiceModel.tts
+                        model_outputs.close()
+                        break
+            cancelled.discard(this_uuid)
+            result_queue.put((this_uuid, 'end', None))
+        except Exception as e:
+            logging.error('worker {} request {} failed: {}'.format(worker_id, this_uuid, e))
+            result_queue.put((this_uuid, 'error', str(e)))
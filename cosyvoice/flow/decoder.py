@@ -11,7 +11,7 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-from typing import Tuple
+from typing import List, Tuple
 import os
 import sys
 import math
@@ -21,7 +21,7 @@ import torch.nn as nn
 import torch.nn.functional as F
 from einops import pack, rearrange, repeat
 from cosyvoice.utils.common import mask_to_bias
-from cosyvoice.utils.mask import add_optional_chunk_mask
+from cosyvoice.utils.mask import add_optional_chunk_mask, subsequent_chunk_mask
 
 # 添加必要的路径
 nor_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
@@ -44,6 +44,63 @@ class Transpose(torch.nn.Module):
         return x
 
 
+class EstimatorChunkCache:
+    """Streaming state of CausalConditionalDecoder for one ode step of one session.
+
+    Frames before offset are final, because a static chunk only attends to itself and to
+    left chunks, and all convs are causal. For them attention key/value of every
+    transformer block are kept in buffers written in place, and the last inputs of every
+    causal conv are kept as left context of the next chunk.
+    """
+
+    def __init__(self, capacity: int = 0):
+        self.capacity = capacity
+        self.offset = 0
+        self.key_cache = {}
+        self.value_cache = {}
+        self.conv_cache = {}
+
+    def update(self, attn: torch.nn.Module, key: torch.Tensor, value: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        # key/value (batch, head, time, head_dim) of frames after offset, returns key/value of all frames
+        end = self.offset + key.size(2)
+        if attn not in self.key_cache:
+            self.key_cache[attn] = key.new_zeros(key.size(0), key.size(1), max(self.capacity, end), key.size(3))
+            self.value_cache[attn] = value.new_zeros(value.size(0), value.size(1), max(self.capacity, end), value.size(3))
+        if end > self.key_cache[attn].size(2):
+            # NOTE grow by doubling, only frames before offset are valid
+            for buffers in [self.key_cache, self.value_cache]:
+                old = buffers[attn]
+                buffers[attn] = old.new_zeros(old.size(0), old.size(1), max(end, old.size(2) * 2), old.size(3))
+                buffers[attn][:, :, :self.offset] = old[:, :, :self.offset]
+        self.key_cache[attn][:, :, self.offset: end] = key
+        self.value_cache[attn][:, :, self.offset: end] = value
+        return self.key_cache[attn][:, :, :end], self.value_cache[attn][:, :, :end]
+
+    def num_bytes(self) -> int:
+        return sum(i.numel() * i.element_size() for i in list(self.key_cache.values()) + list(self.value_cache.values()))
+
+
+class PreparedCondition:
+    """Step invariant inputs of CausalConditionalDecoder for one ode solve.
+
+    mu, spks and cond are packed once into static channels, masks and attention biases
+    of every resolution are built once. Biases are already repeated for every head, so
+    Attention.prepare_attention_mask does not copy them again on every call, see
+    CausalConditionalDecoder.prepare.
+    """
+
+    def __init__(self, static: torch.Tensor, masks: List[torch.Tensor], attn_biases: List[torch.Tensor], heads: int):
+        self.static = static
+        self.masks = masks
+        self.attn_biases = attn_biases
+        self.heads = heads
+
+    def narrow(self, batch_size: int) -> "PreparedCondition":
+        # first batch_size rows, e.g. the conditional half once cfg is dropped, biases are grouped by batch
+        return PreparedCondition(self.static[:batch_size], [i[:batch_size] for i in self.masks],
+                                 [i[:batch_size * self.heads] for i in self.attn_biases], self.heads)
+
+
 class CausalConv1d(torch.nn.Conv1d):
     def __init__(
         self,
@@ -72,6 +129,14 @@ class CausalConv1d(torch.nn.Conv1d):
         x = super(CausalConv1d, self).forward(x)
         return x
 
+    def forward_chunk(self, x: torch.Tensor, cache: EstimatorChunkCache, num_final: int) -> torch.Tensor:
+        # left context comes from last chunk instead of zero padding
+        if self not in cache.conv_cache:
+            cache.conv_cache[self] = x.new_zeros(x.size(0), x.size(1), self.causal_padding)
+        x = torch.concat([cache.conv_cache[self], x], dim=2)
+        cache.conv_cache[self] = x[:, :, num_final: num_final + self.causal_padding]
+        return super(CausalConv1d, self).forward(x)
+
 
 class CausalBlock1D(Block1D):
     def __init__(self, dim: int, dim_out: int):
@@ -88,6 +153,9 @@ class CausalBlock1D(Block1D):
         output = self.block(x * mask)
         return output * mask
 
+    def forward_chunk(self, x: torch.Tensor, cache: EstimatorChunkCache, num_final: int) -> torch.Tensor:
+        return self.block[1:](self.block[0].forward_chunk(x, cache, num_final))
+
 
 class CausalResnetBlock1D(ResnetBlock1D):
     def __init__(self, dim: int, dim_out: int, time_emb_dim: int, groups: int = 8):
@@ -95,6 +163,26 @@ class CausalResnetBlock1D(ResnetBlock1D):
         self.block1 = CausalBlock1D(dim, dim_out)
         self.block2 = CausalBlock1D(dim_out, dim_out)
 
+    def forward_chunk(self, x: torch.Tensor, time_emb: torch.Tensor, cache: EstimatorChunkCache, num_final: int) -> torch.Tensor:
+        h = self.block1.forward_chunk(x, cache, num_final)
+        h += self.mlp(time_emb).unsqueeze(-1)
+        h = self.block2.forward_chunk(h, cache, num_final)
+        return h + self.res_conv(x)
+
+
+def transformer_block_chunk(block: BasicTransformerBlock, x: torch.Tensor, attn_mask: torch.Tensor, cache: EstimatorChunkCache) -> torch.Tensor:
+    """Same as BasicTransformerBlock.forward with layer_norm and self attention only, key/value of earlier frames come from cache."""
+    attn = block.attn1
+    norm_hidden_states = block.norm1(x)
+    query = attn.to_q(norm_hidden_states).view(x.size(0), -1, attn.heads, attn.inner_dim // attn.heads).transpose(1, 2)
+    key = attn.to_k(norm_hidden_states).view(x.size(0), -1, attn.heads, attn.inner_dim // attn.heads).transpose(1, 2)
+    value = attn.to_v(norm_hidden_states).view(x.size(0), -1, attn.heads, attn.inner_dim // attn.heads).transpose(1, 2)
+    key, value = cache.update(attn, key, value)
+    attn_output = F.scaled_dot_product_attention(query, key, value, attn_mask=attn_mask, dropout_p=0.0, is_causal=False)
+    attn_output = attn_output.transpose(1, 2).reshape(x.size(0), -1, attn.inner_dim).to(query.dtype)
+    x = attn.to_out[1](attn.to_out[0](attn_output)) + x
+    return block.ff(block.norm3(x)) + x
+
 
 class ConditionalDecoder(nn.Module):
     def __init__(
@@ -413,7 +501,35 @@ class CausalConditionalDecoder(ConditionalDecoder):
         self.final_proj = nn.Conv1d(channels[-1], self.out_channels, 1)
         self.initialize_weights()
 
-    def forward(self, x, mask, mu, t, spks=None, cond=None, streaming=False):
+    def prepare(self, mask, mu, spks=None, cond=None, streaming=False):
+        """Build the step invariant inputs of forward, mask/mu/spks/cond are the same as forward.
+
+        Returns:
+            PreparedCondition: can be passed to forward of every step of one ode solve
+        """
+        static = [mu]
+        if spks is not None:
+            static.append(repeat(spks, "b c -> b c t", t=mu.shape[-1]))
+        if cond is not None:
+            static.append(cond)
+        static = pack(static, "b * t")[0]
+
+        heads = self.down_blocks[0][1][0].attn1.heads
+        masks = [mask]
+        for _ in range(len(self.down_blocks) - 1):
+            masks.append(masks[-1][:, :, ::2])
+        attn_biases = []
+        for mask_level in masks:
+            # NOTE only time dim and device of xs are used, so pass the mask itself
+            if streaming is True:
+                attn_mask = add_optional_chunk_mask(mask_level.transpose(1, 2), mask_level.bool(), False, False, 0, self.static_chunk_size, -1)
+            else:
+                # (batch, 1, time), broadcast over queries instead of repeating to (batch, time, time)
+                attn_mask = add_optional_chunk_mask(mask_level.transpose(1, 2), mask_level.bool(), False, False, 0, 0, -1)
+            attn_biases.append(mask_to_bias(attn_mask, mu.dtype).repeat_interleave(heads, dim=0))
+        return PreparedCondition(static, masks, attn_biases, heads)
+
+    def forward(self, x, mask, mu, t, spks=None, cond=None, streaming=False, prepared=None):
         """Forward pass of the UNet1DConditional model.
 
         Args:
@@ -422,6 +538,8 @@ class CausalConditionalDecoder(ConditionalDecoder):
             t (_type_): shape (batch_size)
             spks (_type_, optional): shape: (batch_size, condition_channels). Defaults to None.
             cond (_type_, optional): placeholder for future use. Defaults to None.
+            prepared (PreparedCondition, optional): output of prepare, mask/mu/spks/cond are
+                ignored if it is given. Defaults to None.
 
         Raises:
             ValueError: _description_
@@ -430,28 +548,17 @@ class CausalConditionalDecoder(ConditionalDecoder):
         Returns:
             _type_: _description_
         """
+        if prepared is None:
+            prepared = self.prepare(mask, mu, spks, cond, streaming)
         t = self.time_embeddings(t).to(t.dtype)
         t = self.time_mlp(t)
 
-        x = pack([x, mu], "b * t")[0]
-
-        if spks is not None:
-            spks = repeat(spks, "b c -> b c t", t=x.shape[-1])
-            x = pack([x, spks], "b * t")[0]
-        if cond is not None:
-            x = pack([x, cond], "b * t")[0]
+        x = pack([x, prepared.static], "b * t")[0]
 
         hiddens = []
-        masks = [mask]
-        for resnet, transformer_blocks, downsample in self.down_blocks:
-            mask_down = masks[-1]
+        for (resnet, transformer_blocks, downsample), mask_down, attn_mask in zip(self.down_blocks, prepared.masks, prepared.attn_biases):
             x = resnet(x, mask_down, t)
             x = rearrange(x, "b c t -> b t c").contiguous()
-            if streaming is True:
-                attn_mask = add_optional_chunk_mask(x, mask_down.bool(), False, False, 0, self.static_chunk_size, -1)
-            else:
-                attn_mask = add_optional_chunk_mask(x, mask_down.bool(), False, False, 0, 0, -1).repeat(1, x.size(1), 1)
-            attn_mask = mask_to_bias(attn_mask, x.dtype)
             for transformer_block in transformer_blocks:
                 x = transformer_block(
                     hidden_states=x,
@@ -461,18 +568,11 @@ class CausalConditionalDecoder(ConditionalDecoder):
             x = rearrange(x, "b t c -> b c t").contiguous()
             hiddens.append(x)  # Save hidden states for skip connections
             x = downsample(x * mask_down)
-            masks.append(mask_down[:, :, ::2])
-        masks = masks[:-1]
-        mask_mid = masks[-1]
+        mask_mid, attn_mask = prepared.masks[-1], prepared.attn_biases[-1]
 
         for resnet, transformer_blocks in self.mid_blocks:
             x = resnet(x, mask_mid, t)
             x = rearrange(x, "b c t -> b t c").contiguous()
-            if streaming is True:
-                attn_mask = add_optional_chunk_mask(x, mask_mid.bool(), False, False, 0, self.static_chunk_size, -1)
-            else:
-                attn_mask = add_optional_chunk_mask(x, mask_mid.bool(), False, False, 0, 0, -1).repeat(1, x.size(1), 1)
-            attn_mask = mask_to_bias(attn_mask, x.dtype)
             for transformer_block in transformer_blocks:
                 x = transformer_block(
                     hidden_states=x,
@@ -481,17 +581,11 @@ class CausalConditionalDecoder(ConditionalDecoder):
                 )
             x = rearrange(x, "b t c -> b c t").contiguous()
 
-        for resnet, transformer_blocks, upsample in self.up_blocks:
-            mask_up = masks.pop()
+        for (resnet, transformer_blocks, upsample), mask_up, attn_mask in zip(self.up_blocks, prepared.masks[::-1], prepared.attn_biases[::-1]):
             skip = hiddens.pop()
             x = pack([x[:, :, :skip.shape[-1]], skip], "b * t")[0]
             x = resnet(x, mask_up, t)
             x = rearrange(x, "b c t -> b t c").contiguous()
-            if streaming is True:
-                attn_mask = add_optional_chunk_mask(x, mask_up.bool(), False, False, 0, self.static_chunk_size, -1)
-            else:
-                attn_mask = add_optional_chunk_mask(x, mask_up.bool(), False, False, 0, 0, -1).repeat(1, x.size(1), 1)
-            attn_mask = mask_to_bias(attn_mask, x.dtype)
             for transformer_block in transformer_blocks:
                 x = transformer_block(
                     hidden_states=x,
@@ -502,4 +596,58 @@ class CausalConditionalDecoder(ConditionalDecoder):
             x = upsample(x * mask_up)
         x = self.final_block(x, mask_up)
         output = self.final_proj(x * mask_up)
-        return output * mask
+        return output * mask_up
+
+    def forward_chunk(self, x, mu, t, spks, cond, cache: EstimatorChunkCache):
+        """Incremental streaming forward, same result as forward(streaming=True) on all frames so far.
+
+        Args:
+            x (torch.Tensor): frames after cache.offset, shape (batch_size, in_channels, time)
+            mu, cond (torch.Tensor): frames after cache.offset, same shape as x
+            t (torch.Tensor): shape (batch_size)
+            spks (torch.Tensor): shape (batch_size, condition_channels)
+            cache (EstimatorChunkCache): state of this ode step, updated in place
+
+        Returns:
+            output of frames after cache.offset, complete chunks are final and kept in cache
+        """
+        assert len(self.down_blocks) == 1, 'forward_chunk does not support Downsample1D, it is not causal'
+        t = self.time_embeddings(t).to(t.dtype)
+        t = self.time_mlp(t)
+
+        x = pack([x, mu], "b * t")[0]
+        spks = repeat(spks, "b c -> b c t", t=x.shape[-1])
+        x = pack([x, spks, cond], "b * t")[0]
+
+        # queries are frames after offset, keys are all frames so far
+        total_len = cache.offset + x.size(2)
+        num_final = total_len // self.static_chunk_size * self.static_chunk_size - cache.offset
+        attn_mask = subsequent_chunk_mask(total_len, self.static_chunk_size, device=x.device)[cache.offset:]
+        attn_mask = mask_to_bias(attn_mask, x.dtype).unsqueeze(0).unsqueeze(0)
+
+        resnet, transformer_blocks, downsample = self.down_blocks[0]
+        x = resnet.forward_chunk(x, t, cache, num_final)
+        x = rearrange(x, "b c t -> b t c").contiguous()
+        for transformer_block in transformer_blocks:
+            x = transformer_block_chunk(transformer_block, x, attn_mask, cache)
+        skip = rearrange(x, "b t c -> b c t").contiguous()
+        x = downsample.forward_chunk(skip, cache, num_final)
+
+        for resnet, transformer_blocks in self.mid_blocks:
+            x = resnet.forward_chunk(x, t, cache, num_final)
+            x = rearrange(x, "b c t -> b t c").contiguous()
+            for transformer_block in transformer_blocks:
+                x = transformer_block_chunk(transformer_block, x, attn_mask, cache)
+            x = rearrange(x, "b t c -> b c t").contiguous()
+
+        resnet, transformer_blocks, upsample = self.up_blocks[0]
+        x = pack([x, skip], "b * t")[0]
+        x = resnet.forward_chunk(x, t, cache, num_final)
+        x = rearrange(x, "b c t -> b t c").contiguous()
+        for transformer_block in transformer_blocks:
+            x = transformer_block_chunk(transformer_block, x, attn_mask, cache)
+        x = rearrange(x, "b t c -> b c t").contiguous()
+        x = upsample.forward_chunk(x, cache, num_final)
+        x = self.final_block.forward_chunk(x, cache, num_final)
+        cache.offset += num_final
+        return self.final_proj(x)
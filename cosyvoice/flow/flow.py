@@ -185,6 +185,11 @@ class CausalMaskedDiffWithXvec(torch.nn.Module):
         self.only_mask_loss = only_mask_loss
         self.token_mel_ratio = token_mel_ratio
         self.pre_lookahead_len = pre_lookahead_len
+        # encode streaming chunks incrementally, see CosyVoice2Model.load_encoder_chunk_cache
+        self.encoder_chunk_cache = False
+        # max mel length of streaming sessions whose decoder state is cached, 0 to disable,
+        # see CosyVoice2Model.load_decoder_chunk_cache
+        self.decoder_chunk_cache_len = 0
 
     def forward(
             self,
@@ -232,6 +237,30 @@ class CausalMaskedDiffWithXvec(torch.nn.Module):
         )
         return {'loss': loss}
 
+    @torch.inference_mode()
+    def prepare_spk_cond(self, prompt_token, prompt_feat, embedding, streaming=False, spk_cond=None):
+        """Speaker dependent inputs of inference, the same for every sentence of a registered speaker.
+
+        Holds the projected embedding, the prompt token embedding and the prompt feat as cond.
+        With encoder_chunk_cache and streaming, the encoder chunk cache of the prompt is added,
+        it is the state after a first streaming chunk made of the prompt only. A given spk_cond
+        is returned as is if it already holds everything, see SpeakerCondCache.
+        """
+        if spk_cond is None:
+            embedding = F.normalize(embedding, dim=1)
+            spk_cond = {'embedding': self.spk_embed_affine_layer(embedding),
+                        'prompt_token': self.input_embedding(torch.clamp(prompt_token, min=0)),
+                        'cond': prompt_feat.transpose(1, 2).contiguous()}
+        if self.encoder_chunk_cache is True and streaming is True and 'encoder' not in spk_cond:
+            spk_cond = dict(spk_cond)
+            spk_cond['encoder'] = None
+            # NOTE lookahead of the last prompt tokens is the text, they are encoded with the first chunk
+            if prompt_token.shape[1] > self.pre_lookahead_len:
+                xs = spk_cond['prompt_token'][:, :-self.pre_lookahead_len]
+                context = spk_cond['prompt_token'][:, -self.pre_lookahead_len:]
+                _, spk_cond['encoder'] = self.encoder.forward_chunk(xs, self.encoder.init_chunk_cache(xs), context=context)
+        return spk_cond
+
     @torch.inference_mode()
     def inference(self,
                   token,
@@ -242,40 +271,76 @@ class CausalMaskedDiffWithXvec(torch.nn.Module):
                   prompt_feat_len,
                   embedding,
                   streaming,
-                  finalize):
+                  finalize,
+                  flow_cache=None,
+                  sampling=None,
+                  spk_cond=None):
         assert token.shape[0] == 1
-        # xvec projection
-        embedding = F.normalize(embedding, dim=1)
-        embedding = self.spk_embed_affine_layer(embedding)
+        # ode solver options of this request, e.g. n_timesteps, solver, t_scheduler, cfg_interval
+        sampling = dict({'n_timesteps': 10}, **(sampling if sampling is not None else {}))
+        # xvec projection and prompt token embedding, cached for registered speakers, see prepare_spk_cond
+        if spk_cond is None:
+            spk_cond = self.prepare_spk_cond(prompt_token, prompt_feat, embedding)
+        embedding = spk_cond['embedding']
 
         # concat text and prompt_text
         token, token_len = torch.concat([prompt_token, token], dim=1), prompt_token_len + token_len
-        mask = (~make_pad_mask(token_len)).unsqueeze(-1).to(embedding)
-        token = self.input_embedding(torch.clamp(token, min=0)) * mask
-
-        # text encode
-        if finalize is True:
-            h, h_lengths = self.encoder(token, token_len, streaming=streaming)
+        if self.encoder_chunk_cache is True and streaming is True:
+            # only embed and encode tokens after the ones already in encoder_cache
+            encoder_cache = flow_cache['encoder'] if flow_cache is not None else spk_cond.get('encoder')
+            num_encoded = 0 if encoder_cache is None else encoder_cache['offset'] + encoder_cache['xs'].size(1)
+            token = self.input_embedding(torch.clamp(token[:, num_encoded:], min=0))
+            if finalize is True:
+                context = torch.zeros(1, 0, token.size(2)).to(token)
+            else:
+                token, context = token[:, :-self.pre_lookahead_len], token[:, -self.pre_lookahead_len:]
+            if encoder_cache is None:
+                encoder_cache = self.encoder.init_chunk_cache(token)
+            h, encoder_cache = self.encoder.forward_chunk(token, encoder_cache, context=context)
         else:
-            token, context = token[:, :-self.pre_lookahead_len], token[:, -self.pre_lookahead_len:]
-            h, h_lengths = self.encoder(token, token_len, context=context, streaming=streaming)
+            encoder_cache = None
+            mask = (~make_pad_mask(token_len)).unsqueeze(-1).to(embedding)
+            token = torch.concat([spk_cond['prompt_token'], self.input_embedding(torch.clamp(token[:, prompt_token.shape[1]:], min=0))], dim=1) * mask
+
+            # text encode
+            if finalize is True:
+                h, h_lengths = self.encoder(token, token_len, streaming=streaming)
+            else:
+                token, context = token[:, :-self.pre_lookahead_len], token[:, -self.pre_lookahead_len:]
+                h, h_lengths = self.encoder(token, token_len, context=context, streaming=streaming)
         mel_len1, mel_len2 = prompt_feat.shape[1], h.shape[1] - prompt_feat.shape[1]
         h = self.encoder_proj(h)
 
         # get conditions
-        conds = torch.zeros([1, mel_len1 + mel_len2, self.output_size], device=token.device).to(h.dtype)
-        conds[:, :mel_len1] = prompt_feat
-        conds = conds.transpose(1, 2)
+        conds = F.pad(spk_cond['cond'], (0, mel_len2)).to(h.dtype)
 
         mask = (~make_pad_mask(torch.tensor([mel_len1 + mel_len2]))).to(h)
-        feat, _ = self.decoder(
-            mu=h.transpose(1, 2).contiguous(),
-            mask=mask.unsqueeze(1),
-            spks=embedding,
-            cond=conds,
-            n_timesteps=10,
-            streaming=streaming
-        )
+        decoder_cache = None
+        if streaming is True and mel_len1 + mel_len2 <= self.decoder_chunk_cache_len:
+            # only solve frames after the final ones in decoder_cache, cache is dropped once the session is too long
+            feat, decoder_cache = self.decoder.forward_chunk(mu=h.transpose(1, 2).contiguous(),
+                                                             mask=mask.unsqueeze(1),
+                                                             spks=embedding,
+                                                             cond=conds,
+                                                             cache=flow_cache['decoder'] if flow_cache is not None else None,
+                                                             **sampling)
+        elif hasattr(self, 'decoder_batcher'):
+            # solve together with other concurrent requests, see CosyVoice2Model.load_batch_flow
+            feat = self.decoder_batcher.submit({'mu': h.transpose(1, 2).contiguous(),
+                                                'mask': mask.unsqueeze(1),
+                                                'spks': embedding,
+                                                'cond': conds,
+                                                'sampling': sampling,
+                                                'streaming': streaming})
+        else:
+            feat, _ = self.decoder(
+                mu=h.transpose(1, 2).contiguous(),
+                mask=mask.unsqueeze(1),
+                spks=embedding,
+                cond=conds,
+                streaming=streaming,
+                **sampling
+            )
         feat = feat[:, :, mel_len1:]
         assert feat.shape[2] == mel_len2
-        return feat.float(), None
+        return feat.float(), {'encoder': encoder_cache, 'decoder': decoder_cache}
@@ -14,8 +14,11 @@
 # limitations under the License.
 import os
 import sys
+import numpy as np
 import torch
 import torch.nn.functional as F
+from cosyvoice.flow.decoder import EstimatorChunkCache
+from cosyvoice.flow.ode_solver import ODE_SOLVERS, get_t_span
 
 # 添加必要的路径
 nor_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
@@ -24,7 +27,7 @@ sys.path.append(nor_dir)
 sys.path.append(Matcha_path)
 
 from matcha.models.components.flow_matching import BASECFM
-from cosyvoice.utils.common import set_all_random_seed
+from cosyvoice.utils.common import set_all_random_seed, OrtSessionWrapper
 
 
 class ConditionalCFM(BASECFM):
@@ -77,7 +80,7 @@ class ConditionalCFM(BASECFM):
             t_span = 1 - torch.cos(t_span * 0.5 * torch.pi)
         return self.solve_euler(z, t_span=t_span, mu=mu, mask=mask, spks=spks, cond=cond), cache
 
-    def solve_euler(self, x, t_span, mu, mask, spks, cond, streaming=False):
+    def solve_euler(self, x, t_span, mu, mask, spks, cond, streaming=False, cache=None):
         """
         Fixed euler solver for ODEs.
         Args:
@@ -91,60 +94,108 @@ class ConditionalCFM(BASECFM):
             spks (torch.Tensor, optional): speaker ids. Defaults to None.
                 shape: (batch_size, spk_emb_dim)
             cond: Not used but kept for future purposes
+            cache (List[EstimatorChunkCache], optional): streaming state of every step, only
+                frames after cache offset are passed in, see CausalConditionalCFM.forward_chunk
         """
-        t, _, dt = t_span[0], t_span[-1], t_span[1] - t_span[0]
-        t = t.unsqueeze(dim=0)
-
-        # I am storing this because I can later plot it by putting a debugger here and saving it to a file
-        # Or in future might add like a return_all_steps flag
-        sol = []
+        return self.solve(x, t_span, mu, mask, spks, cond, streaming=streaming, solver='euler', cache=cache)
 
+    def solve(self, x, t_span, mu, mask, spks, cond, streaming=False, solver='euler', cfg_interval=1.0, cache=None):
+        """
+        ODE solver, see ODE_SOLVERS in cosyvoice/flow/ode_solver.py.
+        Args:
+            x, t_span, mu, mask, spks, cond, streaming: same as solve_euler
+            solver (str): name in ODE_SOLVERS
+            cfg_interval (float): classifier free guidance is only used for t < cfg_interval,
+                later estimator calls drop the unconditional half of the batch
+            cache (List[EstimatorChunkCache], optional): streaming state of every estimator call,
+                grows on demand, see CausalConditionalCFM.forward_chunk
+        """
+        assert solver in ODE_SOLVERS, 'unknown solver {}, choose from {}'.format(solver, list(ODE_SOLVERS.keys()))
         # Do not use concat, it may cause memory format changed and trt infer with wrong results!
-        x_in = torch.zeros([2, 80, x.size(2)], device=x.device, dtype=x.dtype)
-        mask_in = torch.zeros([2, 1, x.size(2)], device=x.device, dtype=x.dtype)
-        mu_in = torch.zeros([2, 80, x.size(2)], device=x.device, dtype=x.dtype)
-        t_in = torch.zeros([2], device=x.device, dtype=x.dtype)
-        spks_in = torch.zeros([2, 80], device=x.device, dtype=x.dtype)
-        cond_in = torch.zeros([2, 80, x.size(2)], device=x.device, dtype=x.dtype)
-        for step in range(1, len(t_span)):
+        # NOTE first half of the batch is conditional, second half is unconditional
+        b = x.size(0)
+        x_in = torch.zeros([2 * b, 80, x.size(2)], device=x.device, dtype=x.dtype)
+        mask_in = torch.zeros([2 * b, 1, x.size(2)], device=x.device, dtype=x.dtype)
+        mu_in = torch.zeros([2 * b, 80, x.size(2)], device=x.device, dtype=x.dtype)
+        t_in = torch.zeros([2 * b], device=x.device, dtype=x.dtype)
+        spks_in = torch.zeros([2 * b, 80], device=x.device, dtype=x.dtype)
+        cond_in = torch.zeros([2 * b, 80, x.size(2)], device=x.device, dtype=x.dtype)
+        # NOTE mask, mu, spks and cond are the same for every step, only x and t are written in the loop
+        mask_in[:b], mask_in[b:] = mask, mask
+        mu_in[:b] = mu
+        spks_in[:b] = spks
+        cond_in[:b] = cond
+        # packed static channels and attention biases of the estimator, built once per solve
+        prepared = {}
+        if cache is None and hasattr(self.estimator, 'prepare'):
+            prepared[2 * b] = self.estimator.prepare(mask_in, mu_in, spks_in, cond_in, streaming)
+        num_calls = 0
+
+        def velocity(x, t):
+            nonlocal num_calls
             # Classifier-Free Guidance inference introduced in VoiceBox
-            x_in[:] = x
-            mask_in[:] = mask
-            mu_in[0] = mu
+            # NOTE trt engine and onnx estimator have a fixed batch of 2 * b, they always run the unconditional half
+            use_cfg = cfg_interval >= 1.0 or float(t) < cfg_interval or not isinstance(self.estimator, torch.nn.Module)
+            n = 2 * b if use_cfg else b
+            x_in[:b], x_in[b:] = x, x
             t_in[:] = t.unsqueeze(0)
-            spks_in[0] = spks
-            cond_in[0] = cond
-            dphi_dt = self.forward_estimator(
-                x_in, mask_in,
-                mu_in, t_in,
-                spks_in,
-                cond_in,
-                streaming
-            )
-            dphi_dt, cfg_dphi_dt = torch.split(dphi_dt, [x.size(0), x.size(0)], dim=0)
-            dphi_dt = ((1.0 + self.inference_cfg_rate) * dphi_dt - self.inference_cfg_rate * cfg_dphi_dt)
-            x = x + dt * dphi_dt
-            t = t + dt
-            sol.append(x)
-            if step < len(t_span) - 1:
-                dt = t_span[step + 1] - t
-
-        return sol[-1].float()
-
-    def forward_estimator(self, x, mask, mu, t, spks, cond, streaming=False):
+            if len(prepared) != 0 and n not in prepared:
+                prepared[n] = prepared[2 * b].narrow(n)
+            if cache is not None:
+                if len(cache) == num_calls:
+                    cache.append(EstimatorChunkCache())
+                dphi_dt = self.estimator.forward_chunk(x_in[:n], mu_in[:n], t_in[:n], spks_in[:n], cond_in[:n], cache[num_calls])
+            else:
+                dphi_dt = self.forward_estimator(
+                    x_in[:n], mask_in[:n],
+                    mu_in[:n], t_in[:n],
+                    spks_in[:n],
+                    cond_in[:n],
+                    streaming,
+                    prepared.get(n)
+                )
+            num_calls += 1
+            if use_cfg is False:
+                return dphi_dt
+            dphi_dt, cfg_dphi_dt = torch.split(dphi_dt, [b, b], dim=0)
+            return ((1.0 + self.inference_cfg_rate) * dphi_dt - self.inference_cfg_rate * cfg_dphi_dt)
+
+        return ODE_SOLVERS[solver](velocity, x, t_span).float()
+
+    def forward_estimator(self, x, mask, mu, t, spks, cond, streaming=False, prepared=None):
         if isinstance(self.estimator, torch.nn.Module):
+            if prepared is not None:
+                return self.estimator(x, mask, mu, t, spks, cond, streaming=streaming, prepared=prepared)
             return self.estimator(x, mask, mu, t, spks, cond, streaming=streaming)
+        elif isinstance(self.estimator, OrtSessionWrapper):
+            [session, io_binding, buffer] = self.estimator.acquire_estimator()
+            try:
+                # NOTE keep contiguous inputs alive until run finishes, their memory is bound without copy
+                inputs = [i.contiguous() for i in [x, mask, mu, t, spks, cond]]
+                for name, i in zip(self.estimator.input_names, inputs):
+                    assert i.dtype == torch.float32 and i.device.type == 'cpu', 'onnx estimator only supports fp32 cpu input!'
+                    io_binding.bind_input(name, 'cpu', 0, np.float32, list(i.shape), i.data_ptr())
+                if buffer.numel() < x.numel():
+                    buffer = torch.empty(x.numel(), dtype=torch.float32)
+                output = buffer[:x.numel()].view(x.shape)
+                io_binding.bind_output(self.estimator.output_name, 'cpu', 0, np.float32, list(x.shape), output.data_ptr())
+                session.run_with_iobinding(io_binding)
+                # same as trt, output is written to x, the buffer is reused by the next caller of this session
+                x.copy_(output)
+            finally:
+                self.estimator.release_estimator(session, io_binding, buffer)
+            return x
         else:
             [estimator, stream], trt_engine = self.estimator.acquire_estimator()
             # NOTE need to synchronize when switching stream
             torch.cuda.current_stream().synchronize()
             with stream:
-                estimator.set_input_shape('x', (2, 80, x.size(2)))
-                estimator.set_input_shape('mask', (2, 1, x.size(2)))
-                estimator.set_input_shape('mu', (2, 80, x.size(2)))
-                estimator.set_input_shape('t', (2,))
-                estimator.set_input_shape('spks', (2, 80))
-                estimator.set_input_shape('cond', (2, 80, x.size(2)))
+                estimator.set_input_shape('x', (x.size(0), 80, x.size(2)))
+                estimator.set_input_shape('mask', (x.size(0), 1, x.size(2)))
+                estimator.set_input_shape('mu', (x.size(0), 80, x.size(2)))
+                estimator.set_input_shape('t', (x.size(0),))
+                estimator.set_input_shape('spks', (x.size(0), 80))
+                estimator.set_input_shape('cond', (x.size(0), 80, x.size(2)))
                 data_ptrs = [x.contiguous().data_ptr(),
                              mask.contiguous().data_ptr(),
                              mu.contiguous().data_ptr(),
@@ -209,7 +260,7 @@ class CausalConditionalCFM(ConditionalCFM):
         self.rand_noise = torch.randn([1, 80, 50 * 300])
 
     @torch.inference_mode()
-    def forward(self, mu, mask, n_timesteps, temperature=1.0, spks=None, cond=None, streaming=False):
+    def forward(self, mu, mask, n_timesteps, temperature=1.0, spks=None, cond=None, streaming=False, solver='euler', t_scheduler=None, cfg_interval=1.0):
         """Forward diffusion
 
         Args:
@@ -222,6 +273,9 @@ class CausalConditionalCFM(ConditionalCFM):
             spks (torch.Tensor, optional): speaker ids. Defaults to None.
                 shape: (batch_size, spk_emb_dim)
             cond: Not used but kept for future purposes
+            solver (str): name in ODE_SOLVERS
+            t_scheduler (str, optional): name in T_SCHEDULERS, defaults to cfm_params.t_scheduler
+            cfg_interval (float): classifier free guidance is only used for t < cfg_interval
 
         Returns:
             sample: generated mel-spectrogram
@@ -230,7 +284,64 @@ class CausalConditionalCFM(ConditionalCFM):
 
         z = self.rand_noise[:, :, :mu.size(2)].to(mu.device).to(mu.dtype) * temperature
         # fix prompt and overlap part mu and z
-        t_span = torch.linspace(0, 1, n_timesteps + 1, device=mu.device, dtype=mu.dtype)
-        if self.t_scheduler == 'cosine':
-            t_span = 1 - torch.cos(t_span * 0.5 * torch.pi)
-        return self.solve_euler(z, t_span=t_span, mu=mu, mask=mask, spks=spks, cond=cond, streaming=streaming), None
+        t_span = get_t_span(n_timesteps, t_scheduler or self.t_scheduler, mu.device, mu.dtype)
+        return self.solve(z, t_span=t_span, mu=mu, mask=mask, spks=spks, cond=cond, streaming=streaming, solver=solver, cfg_interval=cfg_interval), None
+
+    @torch.inference_mode()
+    def forward_batch(self, mu, mask, n_timesteps, temperature=1.0, spks=None, cond=None, streaming=False, solver='euler', t_scheduler=None, cfg_interval=1.0):
+        """Forward diffusion of several requests in one padded batch
+
+        Args:
+            mu (List[torch.Tensor]): output of encoder of each request
+                shape: (1, n_feats, mel_timesteps_i)
+            mask (List[torch.Tensor]): output_mask of each request
+                shape: (1, 1, mel_timesteps_i)
+            n_timesteps (int): number of diffusion steps
+            temperature (float, optional): temperature for scaling noise. Defaults to 1.0.
+            spks (List[torch.Tensor]): speaker embedding of each request
+                shape: (1, spk_emb_dim)
+            cond (List[torch.Tensor]): prompt condition of each request
+                shape: (1, n_feats, mel_timesteps_i)
+            solver, t_scheduler, cfg_interval: same as forward
+
+        Returns:
+            sample: generated mel-spectrogram of each request
+                shape: (1, n_feats, mel_timesteps_i)
+        """
+        lens = [i.size(2) for i in mu]
+        max_len = max(lens)
+        mu = torch.concat([F.pad(i, (0, max_len - i.size(2))) for i in mu], dim=0)
+        mask = torch.concat([F.pad(i, (0, max_len - i.size(2))) for i in mask], dim=0)
+        cond = torch.concat([F.pad(i, (0, max_len - i.size(2))) for i in cond], dim=0)
+        spks = torch.concat(spks, dim=0)
+        # NOTE every request uses the same noise prefix as batch 1 inference
+        z = self.rand_noise[:, :, :max_len].to(mu.device).to(mu.dtype).repeat(len(lens), 1, 1) * temperature
+        t_span = get_t_span(n_timesteps, t_scheduler or self.t_scheduler, mu.device, mu.dtype)
+        feat = self.solve(z, t_span=t_span, mu=mu, mask=mask, spks=spks, cond=cond, streaming=streaming, solver=solver, cfg_interval=cfg_interval)
+        return [feat[i: i + 1, :, :lens[i]] for i in range(len(lens))]
+
+    @torch.inference_mode()
+    def forward_chunk(self, mu, mask, n_timesteps, temperature=1.0, spks=None, cond=None, solver='euler', t_scheduler=None, cfg_interval=1.0, cache=None):
+        """Streaming forward diffusion, only frames after the final ones in cache are solved
+
+        Args:
+            mu, mask, n_timesteps, temperature, spks, cond: same as forward of all frames so far
+            solver, t_scheduler, cfg_interval: same as forward, must not change within a session
+            cache (dict, optional): returned by last chunk of the same session, None for the first chunk
+
+        Returns:
+            sample: generated mel-spectrogram of all frames so far
+                shape: (1, n_feats, mel_timesteps)
+            cache: final frames of sample and EstimatorChunkCache of every estimator call
+        """
+        assert mu.size(0) == 1 and isinstance(self.estimator, torch.nn.Module)
+        if cache is None:
+            cache = {'feat': torch.zeros(1, mu.size(1), 0, device=mu.device), 'calls': []}
+        offset = cache['feat'].size(2)
+        z = self.rand_noise[:, :, offset:mu.size(2)].to(mu.device).to(mu.dtype) * temperature
+        t_span = get_t_span(n_timesteps, t_scheduler or self.t_scheduler, mu.device, mu.dtype)
+        feat = self.solve(z, t_span=t_span, mu=mu[:, :, offset:], mask=mask[:, :, offset:], spks=spks, cond=cond[:, :, offset:],
+                          streaming=True, solver=solver, cfg_interval=cfg_interval, cache=cache['calls'])
+        feat = torch.concat([cache['feat'], feat], dim=2)
+        cache['feat'] = feat[:, :, :cache['calls'][0].offset]
+        return feat, cache
@@ -0,0 +1,93 @@
+# Copyright (c) 2025 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""ODE solvers and t schedules for flow matching inference.
+
+A solver integrates dx/dt = velocity(x, t) from t_span[0] to t_span[-1], velocity is
+the cfg guided estimator output, see ConditionalCFM.solve.
+"""
+from typing import Callable
+import torch
+
+
+def linear_schedule(t: torch.Tensor) -> torch.Tensor:
+    return t
+
+
+def cosine_schedule(t: torch.Tensor) -> torch.Tensor:
+    return 1 - torch.cos(t * 0.5 * torch.pi)
+
+
+T_SCHEDULERS = {
+    'linear': linear_schedule,
+    'cosine': cosine_schedule,
+}
+
+
+def get_t_span(n_timesteps: int, t_scheduler: str, device, dtype) -> torch.Tensor:
+    assert t_scheduler in T_SCHEDULERS, 'unknown t_scheduler {}, choose from {}'.format(t_scheduler, list(T_SCHEDULERS.keys()))
+    t_span = torch.linspace(0, 1, n_timesteps + 1, device=device, dtype=dtype)
+    return T_SCHEDULERS[t_scheduler](t_span)
+
+
+def euler(velocity: Callable, x: torch.Tensor, t_span: torch.Tensor) -> torch.Tensor:
+    # NOTE same accumulation of t as the original solve_euler, so results are unchanged
+    t, dt = t_span[0].unsqueeze(dim=0), t_span[1] - t_span[0]
+    for step in range(1, len(t_span)):
+        x = x + dt * velocity(x, t)
+        t = t + dt
+        if step < len(t_span) - 1:
+            dt = t_span[step + 1] - t
+    return x
+
+
+def heun(velocity: Callable, x: torch.Tensor, t_span: torch.Tensor) -> torch.Tensor:
+    # 2nd order, 2 estimator calls per step
+    for step in range(1, len(t_span)):
+        t, dt = t_span[step - 1].unsqueeze(dim=0), t_span[step] - t_span[step - 1]
+        v1 = velocity(x, t)
+        v2 = velocity(x + dt * v1, t + dt)
+        x = x + dt * 0.5 * (v1 + v2)
+    return x
+
+
+def midpoint(velocity: Callable, x: torch.Tensor, t_span: torch.Tensor) -> torch.Tensor:
+    # 2nd order, 2 estimator calls per step
+    for step in range(1, len(t_span)):
+        t, dt = t_span[step - 1].unsqueeze(dim=0), t_span[step] - t_span[step - 1]
+        v1 = velocity(x, t)
+        x = x + dt * velocity(x + 0.5 * dt * v1, t + 0.5 * dt)
+    return x
+
+
+def dpm_multistep(velocity: Callable, x: torch.Tensor, t_span: torch.Tensor) -> torch.Tensor:
+    # 2nd order multistep, reuses the velocity of last step, 1 estimator call per step
+    v_prev, dt_prev = None, None
+    for step in range(1, len(t_span)):
+        t, dt = t_span[step - 1].unsqueeze(dim=0), t_span[step] - t_span[step - 1]
+        v = velocity(x, t)
+        if v_prev is None:
+            x = x + dt * v
+        else:
+            r = dt / dt_prev
+            x = x + dt * ((1 + 0.5 * r) * v - 0.5 * r * v_prev)
+        v_prev, dt_prev = v, dt
+    return x
+
+
+ODE_SOLVERS = {
+    'euler': euler,
+    'heun': heun,
+    'midpoint': midpoint,
+    'dpm_multistep': dpm_multistep,
+}
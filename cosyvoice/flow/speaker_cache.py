@@ -0,0 +1,34 @@
+# Copyright (c) 2025 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from cosyvoice.utils.common import LRUCache
+from cosyvoice.utils.file_utils import logging
+
+
+class SpeakerCondCache(LRUCache):
+    """LRU cache of flow conditioning of registered speakers, next to spk2info.
+
+    Entries are the output of CausalMaskedDiffWithXvec.prepare_spk_cond, keyed by the
+    speaker id of spk2info, whose flow prompt and embedding are the same for every
+    sentence. Entries are evicted by LRU once max_entries or max_bytes is exceeded,
+    an entry must be dropped when its speaker is registered again, see
+    CosyVoice.add_zero_shot_spk.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, max_entries: int = 64):
+        super().__init__(max_bytes=max_bytes, max_entries=max_entries)
+
+    def put(self, key, spk_cond):
+        # NOTE replaces an existing entry, e.g. the same speaker with encoder state added
+        super().put(key, spk_cond)
+        logging.debug('cache flow conditioning of speaker {}, {} entries {:.1f}MB'.format(key, len(self.entries), self.num_bytes / 1024 / 1024))
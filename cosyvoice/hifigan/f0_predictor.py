@@ -11,12 +11,14 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+from typing import Optional
 import torch
 import torch.nn as nn
 try:
     from torch.nn.utils.parametrizations import weight_norm
 except ImportError:
     from torch.nn.utils import weight_norm
+from cosyvoice.hifigan.streaming import stream_conv1d
 
 
 class ConvRNNF0Predictor(nn.Module):
@@ -52,7 +54,19 @@ class ConvRNNF0Predictor(nn.Module):
         )
         self.classifier = nn.Linear(in_features=cond_channels, out_features=self.num_class)
 
-    def forward(self, x: torch.Tensor) -> torch.Tensor:
-        x = self.condnet(x)
+    def forward(self, x: torch.Tensor, mask: Optional[torch.Tensor] = None) -> torch.Tensor:
+        if mask is None:
+            x = self.condnet(x)
+        else:
+            # zero padded frames before every layer, so valid frames match unpadded inference
+            for layer in self.condnet:
+                x = layer(x * mask)
+        x = x.transpose(1, 2)
+        return torch.abs(self.classifier(x).squeeze(-1))
+
+    def forward_chunk(self, x: torch.Tensor, cache: dict, finalize: bool = False) -> torch.Tensor:
+        # streaming forward, f0 of a frame is ready once the frames in the receptive field of condnet arrived
+        for i, layer in enumerate(self.condnet):
+            x = stream_conv1d(layer, x, cache, str(i), finalize) if isinstance(layer, nn.Conv1d) else layer(x)
         x = x.transpose(1, 2)
         return torch.abs(self.classifier(x).squeeze(-1))
@@ -22,16 +22,17 @@ import torch.nn as nn
 import torch.nn.functional as F
 from torch.nn import Conv1d
 from torch.nn import ConvTranspose1d
-from torch.nn.utils import remove_weight_norm
 try:
     from torch.nn.utils.parametrizations import weight_norm
 except ImportError:
     from torch.nn.utils import weight_norm
 from torch.distributions.uniform import Uniform
 
+from cosyvoice.hifigan.streaming import stream_align, stream_conv1d, stream_conv_transpose1d
 from cosyvoice.transformer.activation import Snake
 from cosyvoice.utils.common import get_padding
 from cosyvoice.utils.common import init_weights
+from cosyvoice.utils.common import remove_weight_norms
 
 
 """hifigan based generator implementation.
@@ -91,19 +92,32 @@ class ResBlock(torch.nn.Module):
             for _ in range(len(self.convs2))
         ])
 
-    def forward(self, x: torch.Tensor) -> torch.Tensor:
+    def forward(self, x: torch.Tensor, mask: Optional[torch.Tensor] = None) -> torch.Tensor:
         for idx in range(len(self.convs1)):
             xt = self.activations1[idx](x)
+            if mask is not None:
+                xt = xt * mask
             xt = self.convs1[idx](xt)
             xt = self.activations2[idx](xt)
+            if mask is not None:
+                xt = xt * mask
             xt = self.convs2[idx](xt)
             x = xt + x
         return x
 
-    def remove_weight_norm(self):
+    def forward_chunk(self, x: torch.Tensor, cache: dict, finalize: bool = False) -> torch.Tensor:
+        # streaming forward, see HiFTGenerator.inference_stream
         for idx in range(len(self.convs1)):
-            remove_weight_norm(self.convs1[idx])
-            remove_weight_norm(self.convs2[idx])
+            xt = self.activations1[idx](x)
+            xt = stream_conv1d(self.convs1[idx], xt, cache, 'convs1.{}'.format(idx), finalize)
+            xt = self.activations2[idx](xt)
+            xt = stream_conv1d(self.convs2[idx], xt, cache, 'convs2.{}'.format(idx), finalize)
+            xt, x = stream_align([xt, x], cache, 'residual.{}'.format(idx))
+            x = xt + x
+        return x
+
+    def remove_weight_norm(self):
+        remove_weight_norms(self)
 
 
 class SineGen(torch.nn.Module):
@@ -137,10 +151,24 @@ class SineGen(torch.nn.Module):
         uv = (f0 > self.voiced_threshold).type(torch.float32)
         return uv
 
+    def _stream_phase(self, F_mat, cache):
+        # NOTE accumulate in float64 as torch.cumsum does on cpu, so a stream continues the phase of its last chunk
+        if 'phase' in cache:
+            phase_acc, phase_vec = cache['phase'], cache['phase_vec']
+        else:
+            phase_acc = torch.zeros((F_mat.size(0), self.harmonic_num + 1, 1), dtype=torch.float64, device=F_mat.device)
+            u_dist = Uniform(low=-np.pi, high=np.pi)
+            phase_vec = u_dist.sample(sample_shape=(F_mat.size(0), self.harmonic_num + 1, 1)).to(F_mat.device)
+            phase_vec[:, 0, :] = 0
+        phase_acc = torch.cumsum(torch.concat([phase_acc, F_mat.double()], dim=-1), dim=-1)
+        cache['phase'], cache['phase_vec'] = phase_acc[:, :, -1:], phase_vec
+        return 2 * np.pi * (phase_acc[:, :, 1:].float() % 1), phase_vec
+
     @torch.no_grad()
-    def forward(self, f0):
+    def forward(self, f0, cache: Optional[dict] = None, finalize: bool = True):
         """
         :param f0: [B, 1, sample_len], Hz
+        :param cache: phase of the last chunk in streaming inference, updated in place
         :return: [B, 1, sample_len]
         """
 
@@ -148,10 +176,13 @@ class SineGen(torch.nn.Module):
         for i in range(self.harmonic_num + 1):
             F_mat[:, i: i + 1, :] = f0 * (i + 1) / self.sampling_rate
 
-        theta_mat = 2 * np.pi * (torch.cumsum(F_mat, dim=-1) % 1)
-        u_dist = Uniform(low=-np.pi, high=np.pi)
-        phase_vec = u_dist.sample(sample_shape=(f0.size(0), self.harmonic_num + 1, 1)).to(F_mat.device)
-        phase_vec[:, 0, :] = 0
+        if cache is None:
+            theta_mat = 2 * np.pi * (torch.cumsum(F_mat, dim=-1) % 1)
+            u_dist = Uniform(low=-np.pi, high=np.pi)
+            phase_vec = u_dist.sample(sample_shape=(f0.size(0), self.harmonic_num + 1, 1)).to(F_mat.device)
+            phase_vec[:, 0, :] = 0
+        else:
+            theta_mat, phase_vec = self._stream_phase(F_mat, cache)
 
         # generate sine waveforms
         sine_waves = self.sine_amp * torch.sin(theta_mat + phase_vec)
@@ -204,16 +235,17 @@ class SourceModuleHnNSF(torch.nn.Module):
         self.l_linear = torch.nn.Linear(harmonic_num + 1, 1)
         self.l_tanh = torch.nn.Tanh()
 
-    def forward(self, x):
+    def forward(self, x, cache: Optional[dict] = None, finalize: bool = True):
         """
         Sine_source, noise_source = SourceModuleHnNSF(F0_sampled)
         F0_sampled (batchsize, length, 1)
         Sine_source (batchsize, length, 1)
         noise_source (batchsize, length 1)
+        cache, finalize: streaming state of l_sin_gen, see HiFTGenerator.inference_stream
         """
         # source for harmonic branch
         with torch.no_grad():
-            sine_wavs, uv, _ = self.l_sin_gen(x.transpose(1, 2))
+            sine_wavs, uv, _ = self.l_sin_gen(x.transpose(1, 2), cache, finalize)
             sine_wavs = sine_wavs.transpose(1, 2)
             uv = uv.transpose(1, 2)
         sine_merge = self.l_tanh(self.l_linear(sine_wavs))
@@ -258,9 +290,40 @@ class SineGen2(torch.nn.Module):
         uv = (f0 > self.voiced_threshold).type(torch.float32)
         return uv
 
-    def _f02sine(self, f0_values):
+    def _upsample_phase(self, rad_values, cache=None, finalize=True):
+        """ streaming version of cumsum over frames and linear upsampling with align_corners=False
+            rad_values: (batchsize, frames, dim), phase increment of every sample in a frame
+            returns the phase of every sample of the frames which are ready, (batchsize, frames * upsample_scale, dim)
+            the interpolation weights only depend on the sample position in its frame, so a stream continues
+            the phase of its last chunk, the last frame of a chunk waits for the next one unless finalize
+        """
+        # NOTE accumulate in float64 as torch.cumsum does on cpu
+        if cache is not None and 'phase' in cache:
+            phase_acc, phase_prev = cache['phase'], cache['phase_prev']
+        else:
+            phase_acc, phase_prev = torch.zeros_like(rad_values[:, :1], dtype=torch.float64), None
+        phase_acc = torch.cumsum(torch.concat([phase_acc, rad_values.double()], dim=1), dim=1)
+        phase = phase_acc[:, 1:].float() * 2 * np.pi * self.upsample_scale
+        num_frames = phase.shape[1] if finalize else phase.shape[1] - 1
+        if num_frames <= 0:
+            return phase[:, :0]
+        # the first frame interpolates with itself on the left, the last frame with itself on the right
+        prev = torch.concat([phase[:, :1] if phase_prev is None else phase_prev, phase[:, :-1]], dim=1)[:, :num_frames]
+        next = torch.concat([phase[:, 1:], phase[:, -1:]], dim=1)[:, :num_frames]
+        cur = phase[:, :num_frames]
+        weight = (torch.arange(self.upsample_scale, device=phase.device, dtype=phase.dtype) + 0.5) / self.upsample_scale - 0.5
+        left = (weight < 0).view(1, 1, -1, 1)
+        weight = torch.where(weight < 0, weight + 1, weight).view(1, 1, -1, 1)
+        lo = torch.where(left, prev.unsqueeze(2), cur.unsqueeze(2))
+        hi = torch.where(left, cur.unsqueeze(2), next.unsqueeze(2))
+        if cache is not None:
+            cache['phase'], cache['phase_prev'] = phase_acc[:, num_frames: num_frames + 1], phase[:, num_frames - 1: num_frames]
+        return (lo * (1 - weight) + hi * weight).flatten(1, 2)
+
+    def _f02sine(self, f0_values, cache=None, finalize=True):
         """ f0_values: (batchsize, length, dim)
             where dim indicates fundamental tone and overtones
+            cache, finalize: streaming state, see _upsample_phase
         """
         # convert to F0 in rad. The interger part n can be ignored
         # because 2 * np.pi * n doesn't affect phase
@@ -269,7 +332,8 @@ class SineGen2(torch.nn.Module):
         # initial phase noise (no noise for fundamental component)
         rand_ini = torch.rand(f0_values.shape[0], f0_values.shape[2], device=f0_values.device)
         rand_ini[:, 0] = 0
-        rad_values[:, 0, :] = rad_values[:, 0, :] + rand_ini
+        if cache is None or 'phase' not in cache:
+            rad_values[:, 0, :] = rad_values[:, 0, :] + rand_ini
 
         # instantanouse phase sine[t] = sin(2*pi \sum_i=1 ^{t} rad)
         if not self.flag_for_pulse:
@@ -277,11 +341,15 @@ class SineGen2(torch.nn.Module):
                                                          scale_factor=1 / self.upsample_scale,
                                                          mode="linear").transpose(1, 2)
 
-            phase = torch.cumsum(rad_values, dim=1) * 2 * np.pi
-            phase = torch.nn.functional.interpolate(phase.transpose(1, 2) * self.upsample_scale,
-                                                    scale_factor=self.upsample_scale, mode="linear").transpose(1, 2)
+            if cache is None:
+                phase = torch.cumsum(rad_values, dim=1) * 2 * np.pi
+                phase = torch.nn.functional.interpolate(phase.transpose(1, 2) * self.upsample_scale,
+                                                        scale_factor=self.upsample_scale, mode="linear").transpose(1, 2)
+            else:
+                phase = self._upsample_phase(rad_values, cache, finalize)
             sines = torch.sin(phase)
         else:
+            assert cache is None, 'streaming is not supported for pulse'
             # If necessary, make sure that the first time step of every
             # voiced segments is sin(pi) or cos(0)
             # This is used for pulse-train generation
@@ -311,18 +379,26 @@ class SineGen2(torch.nn.Module):
             sines = torch.cos(i_phase * 2 * np.pi)
         return sines
 
-    def forward(self, f0):
+    def forward(self, f0, cache: Optional[dict] = None, finalize: bool = True):
         """ sine_tensor, uv = forward(f0)
         input F0: tensor(batchsize=1, length, dim=1)
                   f0 for unvoiced steps should be 0
         output sine_tensor: tensor(batchsize=1, length, dim)
         output uv: tensor(batchsize=1, length, 1)
+        cache: streaming state updated in place, the last frame of f0 is generated with the next chunk unless finalize
         """
+        if cache is not None:
+            f0 = torch.concat([cache['f0'], f0], dim=1) if 'f0' in cache else f0
+            cache['f0'] = f0
+            if f0.shape[1] == 0:
+                return f0.repeat(1, 1, self.dim), f0, f0.repeat(1, 1, self.dim)
         # fundamental component
         fn = torch.multiply(f0, torch.FloatTensor([[range(1, self.harmonic_num + 2)]]).to(f0.device))
 
         # generate sine waveforms
-        sine_waves = self._f02sine(fn) * self.sine_amp
+        sine_waves = self._f02sine(fn, cache, finalize) * self.sine_amp
+        if cache is not None:
+            f0, cache['f0'] = f0[:, :sine_waves.shape[1]], f0[:, sine_waves.shape[1]:]
 
         # generate uv signal
         uv = self._f02uv(f0)
@@ -372,16 +448,17 @@ class SourceModuleHnNSF2(torch.nn.Module):
         self.l_linear = torch.nn.Linear(harmonic_num + 1, 1)
         self.l_tanh = torch.nn.Tanh()
 
-    def forward(self, x):
+    def forward(self, x, cache: Optional[dict] = None, finalize: bool = True):
         """
         Sine_source, noise_source = SourceModuleHnNSF(F0_sampled)
         F0_sampled (batchsize, length, 1)
         Sine_source (batchsize, length, 1)
         noise_source (batchsize, length 1)
+        cache, finalize: streaming state of l_sin_gen, see HiFTGenerator.inference_stream
         """
         # source for harmonic branch
         with torch.no_grad():
-            sine_wavs, uv, _ = self.l_sin_gen(x)
+            sine_wavs, uv, _ = self.l_sin_gen(x, cache, finalize)
         sine_merge = self.l_tanh(self.l_linear(sine_wavs))
 
         # source for noise branch, in the same shape as uv
@@ -489,17 +566,8 @@ class HiFTGenerator(nn.Module):
 
     def remove_weight_norm(self):
         print('Removing weight norm...')
-        for l in self.ups:
-            remove_weight_norm(l)
-        for l in self.resblocks:
-            l.remove_weight_norm()
-        remove_weight_norm(self.conv_pre)
-        remove_weight_norm(self.conv_post)
-        self.m_source.remove_weight_norm()
-        for l in self.source_downs:
-            remove_weight_norm(l)
-        for l in self.source_resblocks:
-            l.remove_weight_norm()
+        # NOTE also folds f0_predictor, source_downs and m_source have no weight norm
+        remove_weight_norms(self)
 
     def _stft(self, x):
         spec = torch.stft(
@@ -520,36 +588,51 @@ class HiFTGenerator(nn.Module):
     def decode(self, x: torch.Tensor, s: torch.Tensor = torch.zeros(1, 1, 0)) -> torch.Tensor:
         s_stft_real, s_stft_imag = self._stft(s.squeeze(1))
         s_stft = torch.cat([s_stft_real, s_stft_imag], dim=1)
+        magnitude, phase = self._decode_spec(x, s_stft)
+        x = self._istft(magnitude, phase)
+        x = torch.clamp(x, -self.audio_limit, self.audio_limit)
+        return x
+
+    def _decode_spec(self, x: torch.Tensor, s_stft: torch.Tensor, x_len: Optional[List[int]] = None):
+        # x_len is only used in batch inference, padded frames are set to zero before every conv
+        def get_mask(scale, extra=0):
+            if x_len is None:
+                return None
+            return (torch.arange(x.size(2), device=x.device).unsqueeze(0) <
+                    torch.tensor([i * scale + extra for i in x_len], device=x.device).unsqueeze(1)).unsqueeze(1).to(x.dtype)
+
+        def apply_mask(x, mask):
+            return x if mask is None else x * mask
 
-        x = self.conv_pre(x)
+        scale = 1
+        x = self.conv_pre(apply_mask(x, get_mask(scale)))
         for i in range(self.num_upsamples):
-            x = F.leaky_relu(x, self.lrelu_slope)
+            x = F.leaky_relu(apply_mask(x, get_mask(scale)), self.lrelu_slope)
             x = self.ups[i](x)
+            scale *= self.ups[i].stride[0]
 
             if i == self.num_upsamples - 1:
                 x = self.reflection_pad(x)
+            mask = get_mask(scale, 1 if i == self.num_upsamples - 1 else 0)
 
             # fusion
             si = self.source_downs[i](s_stft)
-            si = self.source_resblocks[i](si)
+            si = self.source_resblocks[i](apply_mask(si, mask), mask)
             x = x + si
 
             xs = None
             for j in range(self.num_kernels):
                 if xs is None:
-                    xs = self.resblocks[i * self.num_kernels + j](x)
+                    xs = self.resblocks[i * self.num_kernels + j](apply_mask(x, mask), mask)
                 else:
-                    xs += self.resblocks[i * self.num_kernels + j](x)
+                    xs += self.resblocks[i * self.num_kernels + j](apply_mask(x, mask), mask)
             x = xs / self.num_kernels
 
         x = F.leaky_relu(x)
-        x = self.conv_post(x)
+        x = self.conv_post(apply_mask(x, mask))
         magnitude = torch.exp(x[:, :self.istft_params["n_fft"] // 2 + 1, :])
         phase = torch.sin(x[:, self.istft_params["n_fft"] // 2 + 1:, :])  # actually, sin is redundancy
-
-        x = self._istft(magnitude, phase)
-        x = torch.clamp(x, -self.audio_limit, self.audio_limit)
-        return x
+        return magnitude, phase
 
     def forward(
             self,
@@ -580,3 +663,157 @@ class HiFTGenerator(nn.Module):
             s[:, :, :cache_source.shape[2]] = cache_source
         generated_speech = self.decode(x=speech_feat, s=s)
         return generated_speech, s
+
+    @torch.inference_mode()
+    def inference_stream(self, speech_feat: torch.Tensor, cache: Optional[dict] = None, finalize: bool = False):
+        """Streaming version of inference, vocode the next mel chunk and return speech and the new cache.
+
+        cache carries the receptive field tails of every conv, the source phase and the stft/istft
+        overlap between calls, so every mel frame is vocoded once and every sample is returned as soon
+        as the mel frames it depends on arrived. The speech of all chunks concatenated matches inference
+        on the whole mel, up to the random source noise which is drawn per chunk and float32 rounding of
+        the source phase (about 1e-4 on a few seconds of speech, see tests/test_hift_stream.py).
+        """
+        cache = {} if cache is None else cache
+        # mel->f0
+        f0 = self.f0_predictor.forward_chunk(speech_feat, cache.setdefault('f0_predictor', {}), finalize)
+        # f0->source, nearest upsample as f0_upsamp
+        s = f0.unsqueeze(dim=2).repeat_interleave(int(self.f0_upsamp.scale_factor), dim=1)  # bs,t,1
+        s, _, _ = self.m_source(s, cache.setdefault('m_source', {}), finalize)
+        s = s.transpose(1, 2)
+        # mel+source->speech
+        s_stft = self._stft_stream(s.squeeze(1), cache.setdefault('stft', {}), finalize)
+        magnitude, phase = self._decode_spec_stream(speech_feat, s_stft, cache.setdefault('decode', {}), finalize)
+        generated_speech = self._istft_stream(magnitude, phase, cache.setdefault('istft', {}), finalize)
+        generated_speech = torch.clamp(generated_speech, -self.audio_limit, self.audio_limit)
+        return generated_speech, cache
+
+    def _stft_stream(self, x: torch.Tensor, cache: dict, finalize: bool = False) -> torch.Tensor:
+        n_fft, hop_len = self.istft_params["n_fft"], self.istft_params["hop_len"]
+        x = torch.concat([cache['x'], x], dim=1) if 'x' in cache else x
+        # same reflect padding as torch.stft(center=True), on the first and on the last chunk
+        if cache.get('started', False) is False:
+            if x.shape[1] <= n_fft // 2 and finalize is False:
+                cache['x'] = x
+                return x.new_zeros(x.shape[0], n_fft + 2, 0)
+            x = F.pad(x.unsqueeze(dim=1), (n_fft // 2, 0), mode='reflect').squeeze(dim=1)
+            cache['started'] = True
+        if finalize:
+            x = F.pad(x.unsqueeze(dim=1), (0, n_fft // 2), mode='reflect').squeeze(dim=1)
+        num_frames = max((x.shape[1] - n_fft) // hop_len + 1, 0)
+        cache['x'] = x[:, num_frames * hop_len:]
+        if num_frames == 0:
+            return x.new_zeros(x.shape[0], n_fft + 2, 0)
+        spec = torch.stft(x[:, :(num_frames - 1) * hop_len + n_fft], n_fft, hop_len, n_fft, window=self.stft_window.to(x.device),
+                          center=False, return_complex=True)
+        spec = torch.view_as_real(spec)  # [B, F, TT, 2]
+        return torch.cat([spec[..., 0], spec[..., 1]], dim=1)
+
+    def _decode_spec_stream(self, x: torch.Tensor, s_stft: torch.Tensor, cache: dict, finalize: bool = False):
+        x = stream_conv1d(self.conv_pre, x, cache, 'conv_pre', finalize)
+        for i in range(self.num_upsamples):
+            x = F.leaky_relu(x, self.lrelu_slope)
+            x = stream_conv_transpose1d(self.ups[i], x, cache, 'ups.{}'.format(i), finalize)
+
+            if i == self.num_upsamples - 1:
+                # reflection_pad only touches the first frame of the stream
+                if cache.get('reflection_pad', True) is not None:
+                    x = torch.concat([cache['reflection_pad'], x], dim=2) if 'reflection_pad' in cache else x
+                    if x.shape[2] < 2 and finalize is False:
+                        cache['reflection_pad'] = x
+                        x = x[:, :, :0]
+                    else:
+                        cache['reflection_pad'] = None
+                        x = self.reflection_pad(x)
+
+            # fusion
+            si = stream_conv1d(self.source_downs[i], s_stft, cache, 'source_downs.{}'.format(i), finalize)
+            si = self.source_resblocks[i].forward_chunk(si, cache.setdefault('source_resblocks.{}'.format(i), {}), finalize)
+            x, si = stream_align([x, si], cache, 'fusion.{}'.format(i))
+            x = x + si
+
+            xs = [self.resblocks[i * self.num_kernels + j].forward_chunk(x, cache.setdefault('resblocks.{}'.format(i * self.num_kernels + j), {}), finalize)
+                  for j in range(self.num_kernels)]
+            xs = stream_align(xs, cache, 'resblocks_sum.{}'.format(i))
+            x = xs[0]
+            for j in range(1, self.num_kernels):
+                x = x + xs[j]
+            x = x / self.num_kernels
+
+        x = F.leaky_relu(x)
+        x = stream_conv1d(self.conv_post, x, cache, 'conv_post', finalize)
+        magnitude = torch.exp(x[:, :self.istft_params["n_fft"] // 2 + 1, :])
+        phase = torch.sin(x[:, self.istft_params["n_fft"] // 2 + 1:, :])  # actually, sin is redundancy
+        return magnitude, phase
+
+    def _istft_stream(self, magnitude: torch.Tensor, phase: torch.Tensor, cache: dict, finalize: bool = False) -> torch.Tensor:
+        # overlap add of windowed frames normalized by the window envelope, as torch.istft(center=True)
+        n_fft, hop_len = self.istft_params["n_fft"], self.istft_params["hop_len"]
+        num_overlap = n_fft // hop_len
+        window = self.stft_window.to(magnitude.device)
+        magnitude = torch.clip(magnitude, max=1e2)
+        real = magnitude * torch.cos(phase)
+        img = magnitude * torch.sin(phase)
+        if magnitude.shape[2] != 0:
+            frames = torch.fft.irfft(torch.complex(real, img), n_fft, dim=1) * window.view(1, -1, 1)
+        else:
+            frames = real.new_zeros(real.shape[0], n_fft, 0)
+        envelope = (window ** 2).view(1, -1, 1).repeat(1, 1, frames.shape[2])
+        if 'frames' in cache:
+            frames, envelope = torch.concat([cache['frames'], frames], dim=2), torch.concat([cache['envelope'], envelope], dim=2)
+        else:
+            frames, envelope = F.pad(frames, (num_overlap - 1, 0)), F.pad(envelope, (num_overlap - 1, 0))
+        if finalize:
+            frames, envelope = F.pad(frames, (0, num_overlap - 1)), F.pad(envelope, (0, num_overlap - 1))
+        # output block b sums hop_len samples of the num_overlap frames up to b
+        num_blocks = max(frames.shape[2] - num_overlap + 1, 0)
+        y, y_envelope = 0, 0
+        for i in range(num_overlap):
+            y = y + frames[:, i * hop_len: (i + 1) * hop_len, num_overlap - 1 - i: num_overlap - 1 - i + num_blocks]
+            y_envelope = y_envelope + envelope[:, i * hop_len: (i + 1) * hop_len, num_overlap - 1 - i: num_overlap - 1 - i + num_blocks]
+        cache['frames'], cache['envelope'] = frames[:, :, num_blocks:], envelope[:, :, num_blocks:]
+        y = (y / y_envelope).transpose(1, 2).reshape(frames.shape[0], -1)
+        # center=True drops n_fft // 2 samples at both ends
+        trim = cache.get('trim', n_fft // 2)
+        cache['trim'] = max(trim - y.shape[1], 0)
+        y = y[:, trim:]
+        if finalize:
+            y = y[:, :y.shape[1] - n_fft // 2]
+        return y
+
+    @torch.inference_mode()
+    def inference_batch(self, speech_feat: List[torch.Tensor], cache_source: List[torch.Tensor]) -> List[torch.Tensor]:
+        """Batch version of inference for mel chunks of different sessions.
+
+        Convolutions run on the padded batch with padded frames masked, source generation,
+        stft and istft run on each session. Outputs match the inference call of each session up
+        to float rounding of the batched convolutions, about 1e-5 absolute, e.g. 5.3e-6 max on
+        50 frame chunks with the released CosyVoice2 weights.
+        """
+        x_len = [i.shape[2] for i in speech_feat]
+        x = torch.concat([F.pad(i, (0, max(x_len) - i.shape[2])) for i in speech_feat], dim=0)
+        mask = (torch.arange(x.size(2), device=x.device).unsqueeze(0) <
+                torch.tensor(x_len, device=x.device).unsqueeze(1)).unsqueeze(1).to(x.dtype)
+        # mel->f0
+        f0 = self.f0_predictor(x, mask=mask)
+        # f0->source
+        s, s_stft = [], []
+        for i in range(len(x_len)):
+            this_s = self.f0_upsamp(f0[i: i + 1, None, :x_len[i]]).transpose(1, 2)  # bs,n,t
+            this_s, _, _ = self.m_source(this_s)
+            this_s = this_s.transpose(1, 2)
+            # use cache_source to avoid glitch
+            if cache_source[i].shape[2] != 0:
+                this_s[:, :, :cache_source[i].shape[2]] = cache_source[i]
+            s_stft_real, s_stft_imag = self._stft(this_s.squeeze(1))
+            s.append(this_s)
+            s_stft.append(torch.cat([s_stft_real, s_stft_imag], dim=1))
+        s_stft = torch.concat([F.pad(i, (0, max([j.shape[2] for j in s_stft]) - i.shape[2])) for i in s_stft], dim=0)
+        # mel+source->speech
+        magnitude, phase = self._decode_spec(x, s_stft, x_len=x_len)
+        generated_speech = []
+        for i in range(len(x_len)):
+            this_len = s[i].shape[2] // self.istft_params["hop_len"] + 1
+            this_speech = self._istft(magnitude[i: i + 1, :, :this_len], phase[i: i + 1, :, :this_len])
+            generated_speech.append((torch.clamp(this_speech, -self.audio_limit, self.audio_limit), s[i]))
+        return generated_speech
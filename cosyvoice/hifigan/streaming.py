@@ -0,0 +1,68 @@
+# Copyright (c) 2025 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Streaming primitives for HiFTGenerator.inference_stream.
+
+Every primitive keeps the input frames it still needs in a cache dict owned by the caller,
+and emits every output frame once, as soon as all input frames it depends on arrived. The
+outputs of all chunks concatenated equal the output of the offline module on the whole
+input, finalize=True marks the last chunk and flushes the right padding.
+"""
+from typing import List
+import torch
+import torch.nn.functional as F
+
+
+def stream_conv1d(conv: torch.nn.Conv1d, x: torch.Tensor, cache: dict, key: str, finalize: bool = False) -> torch.Tensor:
+    # zero padded conv, the left padding is the initial state, the right padding is added by finalize
+    kernel_size = conv.dilation[0] * (conv.kernel_size[0] - 1) + 1
+    stride, padding = conv.stride[0], conv.padding[0]
+    if key in cache:
+        x = torch.concat([cache[key], x], dim=2)
+    else:
+        x = F.pad(x, (padding, 0))
+    if finalize:
+        x = F.pad(x, (0, padding))
+    num_out = max((x.shape[2] - kernel_size) // stride + 1, 0)
+    cache[key] = x[:, :, num_out * stride:]
+    if num_out == 0:
+        return x.new_zeros(x.shape[0], conv.out_channels, 0)
+    return F.conv1d(x[:, :, :(num_out - 1) * stride + kernel_size], conv.weight, conv.bias, stride, 0, conv.dilation)
+
+
+def stream_conv_transpose1d(conv: torch.nn.ConvTranspose1d, x: torch.Tensor, cache: dict, key: str, finalize: bool = False) -> torch.Tensor:
+    # output q before cropping the padding sums inputs i with i * stride <= q < i * stride + kernel_size,
+    # q is ready once input q // stride arrived, inputs are kept until no pending q depends on them
+    kernel_size, stride, padding = conv.kernel_size[0], conv.stride[0], conv.padding[0]
+    state = cache.get(key, {'x': x[:, :, :0], 'start': 0, 'q': padding})
+    x = torch.concat([state['x'], x], dim=2)
+    num_in = state['start'] + x.shape[2]
+    q_end = (num_in - 1) * stride + kernel_size - padding if finalize else num_in * stride
+    q_end = max(q_end, state['q'])
+    if q_end > state['q']:
+        y = F.conv_transpose1d(x, conv.weight, conv.bias, stride)
+        y = y[:, :, state['q'] - state['start'] * stride: q_end - state['start'] * stride]
+    else:
+        y = x.new_zeros(x.shape[0], conv.out_channels, 0)
+    start = max(-(-(q_end - kernel_size + 1) // stride), state['start'])
+    cache[key] = {'x': x[:, :, start - state['start']:], 'start': start, 'q': q_end}
+    return y
+
+
+def stream_align(xs: List[torch.Tensor], cache: dict, key: str) -> List[torch.Tensor]:
+    # streams which start at the same frame are cut to the shortest one, the rest waits for the next chunk
+    if key in cache:
+        xs = [torch.concat([i, j], dim=2) for i, j in zip(cache[key], xs)]
+    num = min([i.shape[2] for i in xs])
+    cache[key] = [i[:, :, num:] for i in xs]
+    return [i[:, :, :num] for i in xs]
@@ -0,0 +1,103 @@
+# Copyright (c) 2025 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from typing import Any, Dict, Optional, Tuple
+import torch
+from transformers.cache_utils import Cache
+from cosyvoice.utils.file_utils import logging
+
+
+class StaticKVCache(Cache):
+    """Preallocated kv cache of one decode session.
+
+    Buffers of (1, num_kv_heads, capacity, head_dim) are allocated per layer on the
+    first update, new k/v are written in place and attention reads a view of the
+    valid prefix, so no per step concat happens. The valid length is implicit in
+    the cache, decode steps can run without attention mask, see
+    Qwen2Encoder.forward_static_step.
+    """
+
+    def __init__(self, capacity: int):
+        super().__init__()
+        self.capacity = capacity
+        self.key_cache = []
+        self.value_cache = []
+        # valid length of every layer, layers are updated one after another within a forward
+        self.layer_len = []
+
+    @property
+    def seq_len(self):
+        return self.layer_len[0] if len(self.layer_len) != 0 else 0
+
+    def update(
+        self,
+        key_states: torch.Tensor,
+        value_states: torch.Tensor,
+        layer_idx: int,
+        cache_kwargs: Optional[Dict[str, Any]] = None,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        T = key_states.size(2)
+        if len(self.key_cache) <= layer_idx:
+            shape = (key_states.size(0), key_states.size(1), self.capacity, key_states.size(3))
+            self.key_cache.append(torch.zeros(shape, dtype=key_states.dtype, device=key_states.device))
+            self.value_cache.append(torch.zeros(shape, dtype=value_states.dtype, device=value_states.device))
+            self.layer_len.append(0)
+        start = self.layer_len[layer_idx]
+        if start + T > self.capacity:
+            self._grow(start + T)
+        end = start + T
+        self.key_cache[layer_idx][:, :, start: end] = key_states
+        self.value_cache[layer_idx][:, :, start: end] = value_states
+        self.layer_len[layer_idx] = end
+        return self.key_cache[layer_idx][:, :, :end], self.value_cache[layer_idx][:, :, :end]
+
+    def _grow(self, min_capacity):
+        # NOTE only happens when capacity is underestimated, e.g. bistream with unknown text length
+        capacity = max(min_capacity, self.capacity * 2)
+        logging.debug('grow static kv cache from {} to {}'.format(self.capacity, capacity))
+        for i in range(len(self.key_cache)):
+            k, v = self.key_cache[i], self.value_cache[i]
+            self.key_cache[i] = torch.zeros((k.size(0), k.size(1), capacity, k.size(3)), dtype=k.dtype, device=k.device)
+            self.value_cache[i] = torch.zeros((v.size(0), v.size(1), capacity, v.size(3)), dtype=v.dtype, device=v.device)
+            self.key_cache[i][:, :, :self.layer_len[i]] = k[:, :, :self.layer_len[i]]
+            self.value_cache[i][:, :, :self.layer_len[i]] = v[:, :, :self.layer_len[i]]
+        self.capacity = capacity
+
+    @classmethod
+    def from_legacy_cache(cls, cache, capacity: int) -> "StaticKVCache":
+        # copy a prefix, e.g. from PrefixKVCache, into a new static cache
+        static_cache = cls(max(capacity, cache[0][0].size(2)))
+        for i, (k, v) in enumerate(cache):
+            static_cache.update(k, v, i)
+        return static_cache
+
+    def crop(self, length: int):
+        # drop everything after length, e.g. rejected speculative tokens, buffers are reused
+        self.layer_len = [min(i, length) for i in self.layer_len]
+
+    def get_seq_length(self, layer_idx: Optional[int] = 0) -> int:
+        return self.layer_len[layer_idx] if len(self.layer_len) > layer_idx else 0
+
+    def get_max_length(self) -> Optional[int]:
+        # NOTE the cache grows instead of evicting, so it has no max length for the model
+        return None
+
+    def __len__(self):
+        return len(self.key_cache)
+
+    def __getitem__(self, layer_idx: int):
+        end = self.layer_len[layer_idx]
+        return self.key_cache[layer_idx][:, :, :end], self.value_cache[layer_idx][:, :, :end]
+
+    def to_legacy_cache(self):
+        return tuple(self[i] for i in range(len(self)))
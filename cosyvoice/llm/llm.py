@@ -27,6 +27,7 @@ from cosyvoice.transformer.label_smoothing_loss import LabelSmoothingLoss
 from cosyvoice.utils.common import th_accuracy
 from cosyvoice.utils.file_utils import logging
 from cosyvoice.utils.mask import make_pad_mask
+from cosyvoice.llm.kv_cache import StaticKVCache
 
 
 class TransformerLM(torch.nn.Module):
@@ -150,7 +151,14 @@ class TransformerLM(torch.nn.Module):
             decoded_tokens: List,
             sampling: int,
             ignore_eos: bool = True,
+            generator: torch.Generator = None,
     ):
+        if hasattr(self, 'batch_sampler'):
+            # eos is masked out instead of retried, see BatchSampler
+            # generator is the session generator from batch_sampler.new_generator, None for the shared one
+            window = self.batch_sampler.window_from_list(decoded_tokens, weighted_scores.device)
+            return self.batch_sampler(weighted_scores.unsqueeze(dim=0), window, torch.tensor([ignore_eos]),
+                                      generators=[generator] if generator is not None else None)
         num_trials, max_trials = 0, 100
         while True:
             top_ids = self.sampling(weighted_scores, decoded_tokens, sampling)
@@ -233,28 +241,55 @@ class Qwen2Encoder(torch.nn.Module):
         super().__init__()
         self.model = Qwen2ForCausalLM.from_pretrained(pretrain_path)
 
+    # NOTE all forwards call the inner Qwen2Model, its last_hidden_state equals hidden_states[-1] of Qwen2ForCausalLM,
+    # so text vocab lm_head logits and hidden states of every layer are never computed
     def forward(self, xs: torch.Tensor, xs_lens: torch.Tensor):
         T = xs.size(1)
         masks = ~make_pad_mask(xs_lens, T)
-        outs = self.model(
+        outs = self.model.model(
             inputs_embeds=xs,
             attention_mask=masks,
-            output_hidden_states=True,
             return_dict=True,
+            use_cache=False,
         )
-        return outs.hidden_states[-1], masks.unsqueeze(1)
+        return outs.last_hidden_state, masks.unsqueeze(1)
 
     def forward_one_step(self, xs, masks, cache=None):
         input_masks = masks[:, -1, :]
-        outs = self.model(
+        outs = self.model.model(
             inputs_embeds=xs,
             attention_mask=input_masks,
-            output_hidden_states=True,
             return_dict=True,
             use_cache=True,
             past_key_values=cache,
         )
-        xs = outs.hidden_states[-1]
+        xs = outs.last_hidden_state
+        new_cache = outs.past_key_values
+        return xs, new_cache
+
+    def forward_static_step(self, xs, cache: StaticKVCache):
+        # no attention mask, valid kv length is kept by the cache itself
+        position_ids = torch.arange(cache.seq_len, cache.seq_len + xs.size(1), device=xs.device).unsqueeze(0)
+        outs = self.model.model(
+            inputs_embeds=xs,
+            position_ids=position_ids,
+            return_dict=True,
+            use_cache=True,
+            past_key_values=cache,
+        )
+        return outs.last_hidden_state, cache
+
+    def forward_batch_step(self, xs, masks, position_ids, cache=None):
+        # masks: (B, cache_len + T), left padded rows of different length, position_ids: (B, T)
+        outs = self.model.model(
+            inputs_embeds=xs,
+            attention_mask=masks,
+            position_ids=position_ids,
+            return_dict=True,
+            use_cache=True,
+            past_key_values=cache,
+        )
+        xs = outs.last_hidden_state
         new_cache = outs.past_key_values
         return xs, new_cache
 
@@ -301,6 +336,19 @@ class Qwen2LM(TransformerLM):
         self.stop_token_ids = [speech_token_size + i for i in range(3)]
         self.vllm_output_queue = {}
 
+        # 6. decode with preallocated kv cache, see StaticKVCache
+        self.static_kv_cache = False
+
+    def new_decode_cache(self, capacity):
+        return StaticKVCache(capacity) if self.static_kv_cache is True else None
+
+    def decode_step(self, lm_input, cache):
+        if isinstance(cache, StaticKVCache):
+            return self.llm.forward_static_step(lm_input, cache)
+        seq_len = lm_input.shape[1] if cache is None else lm_input.shape[1] + cache[0][0].size(2)
+        # NOTE forward_one_step only uses the last row of the causal mask, which is all True
+        return self.llm.forward_one_step(lm_input, masks=torch.ones((1, 1, seq_len), device=lm_input.device).to(torch.bool), cache=cache)
+
     def prepare_lm_input_target(self, text_token, text_token_emb, text_token_len, speech_token, speech_token_emb, speech_token_len):
         lm_target, lm_input = [], []
         text_token = unpad_sequence(text_token, text_token_len.cpu(), batch_first=True)
@@ -457,13 +505,30 @@ class Qwen2LM(TransformerLM):
         min_len = int((text_len - prompt_text_len) * min_token_text_ratio)
         max_len = int((text_len - prompt_text_len) * max_token_text_ratio)
 
-        # 5. step by step decode
-        for token in self.inference_wrapper(lm_input, sampling, min_len, max_len, uuid):
+        # 5. reuse kv state of [sos, prompt_text], only prefill the rest, see PrefixKVCache
+        prefix_cache = None
+        if hasattr(self, 'prefix_cache') and not hasattr(self, 'vllm') and prompt_text_len != 0:
+            prefix_len = 1 + int(prompt_text_len)
+            key = self.prefix_cache.key(prompt_text)
+            prefix_cache = self.prefix_cache.get(key)
+            if prefix_cache is None:
+                _, prefix_cache = self.llm.forward_one_step(lm_input[:, :prefix_len],
+                                                            masks=torch.ones((1, 1, prefix_len), device=device).to(torch.bool),
+                                                            cache=None)
+                if hasattr(prefix_cache, 'to_legacy_cache'):
+                    prefix_cache = prefix_cache.to_legacy_cache()
+                self.prefix_cache.put(key, prefix_cache)
+            lm_input = lm_input[:, prefix_len:]
+
+        # 6. step by step decode
+        for token in self.inference_wrapper(lm_input, sampling, min_len, max_len, uuid, prefix_cache=prefix_cache,
+                                            history=prompt_speech_token.flatten().tolist()):
             yield token
 
     @torch.inference_mode()
-    def inference_wrapper(self, lm_input, sampling, min_len, max_len, uuid):
+    def inference_wrapper(self, lm_input, sampling, min_len, max_len, uuid, prefix_cache=None, history=None):
         if hasattr(self, 'vllm'):
+            assert prefix_cache is None, 'vllm does not support prefix_cache!'
             from vllm import SamplingParams, RequestOutput
             sampling_params = SamplingParams(top_k=sampling,
                                              stop_token_ids=self.stop_token_ids,
@@ -492,15 +557,39 @@ class Qwen2LM(TransformerLM):
                 time.sleep(0.001)
             with self.lock:
                 self.vllm_output_queue.pop(uuid)
+        elif hasattr(self, 'batch_scheduler'):
+            session = self.batch_scheduler.submit(uuid, lm_input, sampling, min_len, max_len, prefix_cache=prefix_cache)
+            try:
+                while True:
+                    top_ids = session.output_queue.get()
+                    if top_ids is None:
+                        break
+                    if isinstance(top_ids, Exception):
+                        raise top_ids
+                    # in stream mode, yield token one by one
+                    yield top_ids
+            finally:
+                self.batch_scheduler.cancel(session)
+        elif hasattr(self, 'speculative'):
+            # history holds prompt speech tokens, used to draft tokens, see SpeculativeDecoder
+            for top_ids in self.speculative.decode(lm_input, sampling, min_len, max_len, history if history is not None else [], prefix_cache=prefix_cache):
+                yield top_ids
         else:
             out_tokens = []
-            cache = None
+            cache = self.new_decode_cache(lm_input.shape[1] + max_len)
+            if prefix_cache is not None:
+                cache = prefix_cache if cache is None else StaticKVCache.from_legacy_cache(prefix_cache, prefix_cache[0][0].size(2) + lm_input.shape[1] + max_len)
+            # recent tokens kept on device for repetition aware sampling, see BatchSampler
+            window = self.batch_sampler.init_window(1, lm_input.device) if hasattr(self, 'batch_sampler') else None
+            generators = [self.batch_sampler.new_generator()] if window is not None else None
             for i in range(max_len):
-                y_pred, cache = self.llm.forward_one_step(lm_input,
-                                                          masks=torch.tril(torch.ones((1, lm_input.shape[1], lm_input.shape[1]), device=lm_input.device)).to(torch.bool),
-                                                          cache=cache)
+                y_pred, cache = self.decode_step(lm_input, cache)
                 logp = self.llm_decoder(y_pred[:, -1]).log_softmax(dim=-1)
-                top_ids = self.sampling_ids(logp.squeeze(dim=0), out_tokens, sampling, ignore_eos=True if i < min_len else False).item()
+                if window is not None:
+                    top_ids_tensor = self.batch_sampler(logp, window, torch.tensor([i < min_len]), generators=generators)
+                    top_ids = top_ids_tensor.item()
+                else:
+                    top_ids = self.sampling_ids(logp.squeeze(dim=0), out_tokens, sampling, ignore_eos=True if i < min_len else False).item()
                 if top_ids == self.speech_token_size:
                     break
                 if top_ids > self.speech_token_size:
@@ -508,6 +597,8 @@ class Qwen2LM(TransformerLM):
                 # in stream mode, yield token one by one
                 yield top_ids
                 out_tokens.append(top_ids)
+                if window is not None:
+                    window = self.batch_sampler.update_window(window, top_ids_tensor)
                 lm_input = self.speech_embedding.weight[top_ids].reshape(1, 1, -1)
 
     @torch.inference_mode()
@@ -536,7 +627,9 @@ class Qwen2LM(TransformerLM):
 
         # 2. iterate text
         out_tokens = []
-        cache = None
+        # NOTE text length is unknown in bistream, the static cache grows when needed
+        cache = self.new_decode_cache(1024)
+        generator = self.batch_sampler.new_generator() if hasattr(self, 'batch_sampler') else None
         # NOTE init prompt_text as text_cache as it is basically impossible prompt_speech_token/prompt_text < 15/5
         text_cache = self.llm.model.model.embed_tokens(prompt_text)
         next_fill_index = -1
@@ -568,16 +661,13 @@ class Qwen2LM(TransformerLM):
                         logging.info('not enough text token to decode, wait for more')
                         continue
                 while True:
-                    seq_len = lm_input.shape[1] if cache is None else lm_input.shape[1] + cache[0][0].size(2)
-                    y_pred, cache = self.llm.forward_one_step(lm_input,
-                                                              masks=torch.tril(torch.ones((1, seq_len, seq_len), device=lm_input.device)).to(torch.bool),
-                                                              cache=cache)
+                    y_pred, cache = self.decode_step(lm_input, cache)
                     logp = self.llm_decoder(y_pred[:, -1]).log_softmax(dim=-1)
                     if next_fill_index != -1 and len(out_tokens) == next_fill_index:
                         top_ids = self.speech_token_size + 2
                         next_fill_index += (self.mix_ratio[1] + 1)
                     else:
-                        top_ids = self.sampling_ids(logp.squeeze(dim=0), out_tokens, sampling, ignore_eos=True).item()
+                        top_ids = self.sampling_ids(logp.squeeze(dim=0), out_tokens, sampling, ignore_eos=True, generator=generator).item()
                     if top_ids == self.speech_token_size + 2:
                         next_fill_index = len(out_tokens) + self.mix_ratio[1] + 1
                         logging.info('fill_token index {} next fill_token index {}'.format(len(out_tokens), next_fill_index))
@@ -594,12 +684,9 @@ class Qwen2LM(TransformerLM):
         lm_input = torch.concat([lm_input, text_cache, task_id_emb], dim=1)
         logging.info('no more text token, decode until met eos')
         while True:
-            seq_len = lm_input.shape[1] if cache is None else lm_input.shape[1] + cache[0][0].size(2)
-            y_pred, cache = self.llm.forward_one_step(lm_input,
-                                                      masks=torch.tril(torch.ones((1, seq_len, seq_len), device=lm_input.device)).to(torch.bool),
-                                                      cache=cache)
+            y_pred, cache = self.decode_step(lm_input, cache)
             logp = self.llm_decoder(y_pred[:, -1]).log_softmax(dim=-1)
-            top_ids = self.sampling_ids(logp.squeeze(dim=0), out_tokens, sampling, ignore_eos=False).item()
+            top_ids = self.sampling_ids(logp.squeeze(dim=0), out_tokens, sampling, ignore_eos=False, generator=generator).item()
             out_tokens.append(top_ids)
             if top_ids >= self.speech_token_size:
                 if top_ids == self.speech_token_size:
@@ -0,0 +1,52 @@
+# Copyright (c) 2025 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import hashlib
+import torch
+from cosyvoice.utils.common import LRUCache
+from cosyvoice.utils.file_utils import logging
+
+
+def model_hash(model: torch.nn.Module) -> str:
+    """Cheap fingerprint of a model, parameter names, shapes and a few values of each parameter."""
+    h = hashlib.sha1()
+    for name, p in model.state_dict().items():
+        h.update('{}{}'.format(name, tuple(p.shape)).encode('utf-8'))
+        h.update(p.detach().flatten()[:8].float().cpu().numpy().tobytes())
+    return h.hexdigest()[:16]
+
+
+class PrefixKVCache(LRUCache):
+    """LRU cache of llm kv state for the speaker invariant prefix [sos, prompt_text].
+
+    For a registered zero_shot speaker the prompt text is the same for every sentence,
+    for instruct2 it is instruct_text + <|endofprompt|>, so their kv state is computed
+    once and only the remaining input is prefilled on a hit. Entries are keyed by
+    model hash and prompt text tokens, evicted by LRU once max_entries or max_bytes
+    is exceeded.
+    """
+
+    def __init__(self, model: torch.nn.Module, max_bytes: int = 512 * 1024 * 1024, max_entries: int = 256):
+        super().__init__(max_bytes=max_bytes, max_entries=max_entries)
+        self.model_hash = model_hash(model)
+
+    def key(self, prompt_text: torch.Tensor) -> str:
+        return '{}_{}'.format(self.model_hash, hashlib.sha1(prompt_text.cpu().to(torch.int32).numpy().tobytes()).hexdigest())
+
+    def put(self, key, cache):
+        # NOTE store a legacy tuple of (k, v) per layer, callers never write into it in place
+        if hasattr(cache, 'to_legacy_cache'):
+            cache = cache.to_legacy_cache()
+        cache = tuple((k.clone(), v.clone()) for k, v in cache)
+        super().put(key, cache)
+        logging.debug('cache llm prefix {}, {} entries {:.1f}MB'.format(key, len(self.entries), self.num_bytes / 1024 / 1024))
@@ -0,0 +1,112 @@
+# Copyright (c) 2025 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from typing import List
+import torch
+
+
+class BatchSampler:
+    """Tensor only top-k/top-p/repetition aware sampler for a batch of sessions.
+
+    Same semantic as ras_sampling in cosyvoice/utils/common.py, but all sessions are
+    sampled together on the device of the logits:
+        1. nucleus set is the top_k most likely tokens whose preceding cumulative
+           probability is below top_p, computed with a cumsum mask
+        2. if the sampled token occurs at least win_size * tau_r times in the
+           window of recent tokens, resample from the full distribution
+        3. eos is masked out when ignore_eos is set, instead of retrying
+
+    The window of recent tokens is a (B, win_size) tensor padded with -1, see
+    init_window/update_window. With a seed, every session draws from its own
+    generator seeded with it, see new_generator, so the tokens of a request do not
+    depend on which sessions are decoded alongside it. Callers without a session,
+    e.g. Qwen2LM.sampling_ids, share one seeded generator and are only reproducible
+    when one session decodes at a time.
+    """
+
+    def __init__(self, eos_token: int, top_p: float = 0.8, top_k: int = 25, win_size: int = 10, tau_r: float = 0.1, seed: int = None):
+        self.eos_token = eos_token
+        self.top_p = top_p
+        self.top_k = top_k
+        self.win_size = win_size
+        self.tau_r = tau_r
+        self.seed = seed
+        self.generator = self.new_generator()
+
+    @classmethod
+    def from_sampling(cls, sampling, eos_token: int, seed: int = None):
+        """Build from the sampling partial of the model config, e.g. ras_sampling with its keywords."""
+        keywords = getattr(sampling, 'keywords', {})
+        return cls(eos_token, **{k: v for k, v in keywords.items() if k in ['top_p', 'top_k', 'win_size', 'tau_r']}, seed=seed)
+
+    def new_generator(self):
+        """Generator of one session, None without a seed. Draws are made on cpu, so it fits every device."""
+        if self.seed is None:
+            return None
+        return torch.Generator().manual_seed(self.seed)
+
+    def uniform(self, batch_size: int, generators: List[torch.Generator] = None) -> torch.Tensor:
+        """(B, 2) uniform draws, for the nucleus and the repetition fallback sample of every row."""
+        if generators is None:
+            return torch.rand(batch_size, 2, generator=self.generator)
+        return torch.stack([torch.rand(2, generator=g) for g in generators], dim=0)
+
+    def init_window(self, batch_size: int, device) -> torch.Tensor:
+        return torch.full((batch_size, self.win_size), -1, dtype=torch.long, device=device)
+
+    def window_from_list(self, decoded_tokens: List[int], device) -> torch.Tensor:
+        window = self.init_window(1, device)
+        decoded_tokens = decoded_tokens[-self.win_size:]
+        if len(decoded_tokens) != 0:
+            window[0, -len(decoded_tokens):] = torch.tensor(decoded_tokens, dtype=torch.long)
+        return window
+
+    def update_window(self, window: torch.Tensor, top_ids: torch.Tensor) -> torch.Tensor:
+        return torch.concat([window[:, 1:], top_ids.reshape(-1, 1).to(window)], dim=1)
+
+    def __call__(self, logp: torch.Tensor, window: torch.Tensor, ignore_eos: torch.Tensor, generators: List[torch.Generator] = None) -> torch.Tensor:
+        """
+        Args:
+            logp: (B, V) scores, log probabilities or logits
+            window: (B, win_size) recent tokens, -1 for empty slots
+            ignore_eos: (B,) bool
+            generators: B generators from new_generator, one per session, None for the shared one
+        Returns:
+            top_ids: (B,) long
+        """
+        u = self.uniform(logp.shape[0], generators).to(logp.device)
+        prob = logp.float().softmax(dim=-1)
+        eos_mask = torch.zeros_like(prob, dtype=torch.bool)
+        eos_mask[:, self.eos_token] = ignore_eos.to(logp.device)
+        # 1. nucleus sampling, eos is kept when building the nucleus set, same as retrying in sampling_ids
+        sorted_prob, sorted_idx = prob.sort(dim=-1, descending=True, stable=True)
+        keep = (sorted_prob.cumsum(dim=-1) - sorted_prob) < self.top_p
+        keep[:, self.top_k:] = False
+        keep &= ~eos_mask.gather(1, sorted_idx)
+        nucleus_prob = sorted_prob.masked_fill(~keep, 0)
+        # NOTE a row whose nucleus only holds eos falls back to the full distribution below
+        empty = nucleus_prob.sum(dim=-1) == 0
+        nucleus_prob[empty, 0] = 1
+        top_ids = sorted_idx.gather(1, _inverse_cdf(nucleus_prob, u[:, :1])).squeeze(dim=1)
+        # 2. repetition aware fallback to random sampling
+        rep_num = (window == top_ids.unsqueeze(1)).sum(dim=1)
+        full_prob = prob.masked_fill(eos_mask, 0)
+        random_ids = _inverse_cdf(full_prob, u[:, 1:]).squeeze(dim=1)
+        return torch.where((rep_num >= self.win_size * self.tau_r) | empty, random_ids, top_ids)
+
+
+def _inverse_cdf(prob: torch.Tensor, u: torch.Tensor) -> torch.Tensor:
+    """Sample one index per row of unnormalized prob (B, V) with uniform u (B, 1), same distribution as multinomial."""
+    cdf = prob.cumsum(dim=-1)
+    # first index whose cdf exceeds u * total, u < 1 so it always has a non zero probability
+    return (cdf <= u * cdf[:, -1:]).sum(dim=-1, keepdim=True).clamp(max=prob.shape[1] - 1)
@@ -0,0 +1,290 @@
+# Copyright (c) 2025 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import queue
+import threading
+from collections import deque
+from contextlib import nullcontext
+from typing import List
+import torch
+import torch.nn.functional as F
+from cosyvoice.utils.file_utils import logging
+
+
+class DecodeSession:
+    """Decode state of one request inside ContinuousBatchScheduler."""
+
+    def __init__(self, uuid: str, lm_input: torch.Tensor, sampling: int, min_len: int, max_len: int, prefix_cache=None):
+        self.uuid = uuid
+        self.lm_input = lm_input
+        # kv state of a cached prompt prefix, lm_input only holds the rest, see PrefixKVCache
+        self.prefix_cache = prefix_cache
+        self.sampling = sampling
+        self.min_len = min_len
+        self.max_len = max_len
+        self.out_tokens = []
+        self.num_steps = 0
+        # number of valid positions of this session in the kv cache
+        self.seq_len = 0
+        self.finished = False
+        self.cancelled = False
+        self.output_queue = queue.Queue()
+        # recent tokens on device and own generator, only used with llm.batch_sampler
+        self.window = None
+        self.generator = None
+        # own kv cache rows while paused, see ContinuousBatchScheduler.pause_fn
+        self.cache = None
+
+
+class ContinuousBatchScheduler:
+    """Continuous batching decoder for Qwen2LM.
+
+    All active sessions are decoded together, one padded batch forward per step.
+    New sessions are prefilled and admitted between steps, finished sessions are
+    retired between steps. Sampled tokens are put into the output_queue of each
+    session, None marks the end of a session.
+
+    The batched kv cache is left padded, every row keeps its own position ids so
+    rotary embeddings match the batch 1 decode in Qwen2LM.inference_wrapper.
+
+    If pause_fn is set, pause_fn(uuid) is asked between steps. A paused session leaves
+    the decode batch with its own kv cache rows and rejoins once pause_fn returns False,
+    see AdmissionController.
+    """
+
+    def __init__(self, llm: torch.nn.Module, max_batch_size: int = 16, fp16: bool = False):
+        self.llm = llm
+        self.max_batch_size = max_batch_size
+        self.fp16 = fp16
+        self.pending = deque()
+        self.active: List[DecodeSession] = []
+        self.paused: List[DecodeSession] = []
+        self.pause_fn = None
+        # uuid -> submitted session, lets the caller cancel a session it has no reference to
+        self.sessions = {}
+        # batched legacy kv cache, tuple of (k, v) per layer, k/v (B, H, cache_len, D)
+        self.cache = None
+        self.cache_len = 0
+        self.cond = threading.Condition()
+        # statistics
+        self.num_steps = 0
+        self.num_tokens = 0
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def after_fork(self):
+        """Start a new decode thread in a forked process, the thread of the parent is not forked."""
+        self.pending, self.active, self.paused, self.sessions = deque(), [], [], {}
+        self.cache, self.cache_len = None, 0
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def submit(self, uuid: str, lm_input: torch.Tensor, sampling: int, min_len: int, max_len: int, prefix_cache=None) -> DecodeSession:
+        session = DecodeSession(uuid, lm_input, sampling, min_len, max_len, prefix_cache=prefix_cache)
+        with self.cond:
+            self.pending.append(session)
+            self.sessions[uuid] = session
+            self.cond.notify()
+        return session
+
+    def cancel(self, session: DecodeSession):
+        """Drop a session, an active one is retired after the current step. Safe to call more than once."""
+        with self.cond:
+            session.cancelled = True
+            if self.sessions.get(session.uuid) is session:
+                self.sessions.pop(session.uuid)
+            if session in self.pending:
+                self.pending.remove(session)
+            # a paused session is dropped by the decode loop
+            self.cond.notify()
+        # wake up a consumer waiting for the next token
+        session.output_queue.put(None)
+
+    def wake(self):
+        """Called when pause_fn may have changed, the decode loop waits while all sessions are paused."""
+        with self.cond:
+            self.cond.notify()
+
+    def cancel_uuid(self, uuid: str):
+        with self.cond:
+            session = self.sessions.get(uuid, None)
+        if session is not None:
+            self.cancel(session)
+
+    def get_stats(self):
+        with self.cond:
+            return {'active': len(self.active), 'pending': len(self.pending), 'paused': len(self.paused),
+                    'num_steps': self.num_steps, 'num_tokens': self.num_tokens}
+
+    def _loop(self):
+        autocast = torch.cuda.amp.autocast(self.fp16) if torch.cuda.is_available() else nullcontext()
+        with torch.inference_mode(), autocast:
+            while True:
+                with self.cond:
+                    while len(self.pending) == 0 and len(self.active) == 0 and not self._resumable():
+                        self.cond.wait()
+                admitted = []
+                try:
+                    self._pause_resume()
+                    with self.cond:
+                        while len(self.pending) != 0 and len(self.active) + len(admitted) < self.max_batch_size:
+                            admitted.append(self.pending.popleft())
+                    self._admit(admitted)
+                    if len(self.active) != 0:
+                        self._step()
+                except Exception as e:
+                    logging.error('batch decode failed, abort {} sessions: {}'.format(len(self.active) + len(admitted), e))
+                    for session in set(self.active + admitted):
+                        session.output_queue.put(e)
+                    self.active, self.cache, self.cache_len = [], None, 0
+
+    def _sample(self, sessions: List[DecodeSession], logp: torch.Tensor):
+        if hasattr(self.llm, 'batch_sampler'):
+            # all sessions are sampled together on device, see BatchSampler
+            windows = torch.concat([s.window for s in sessions], dim=0)
+            top_ids = self.llm.batch_sampler(logp, windows, torch.tensor([s.num_steps < s.min_len for s in sessions]),
+                                             generators=[s.generator for s in sessions])
+            windows = self.llm.batch_sampler.update_window(windows, top_ids)
+            top_ids = top_ids.tolist()
+        else:
+            # NOTE keep the same semantic as batch 1 decode in Qwen2LM.inference_wrapper
+            top_ids = [self.llm.sampling_ids(logp[i], s.out_tokens, s.sampling,
+                                             ignore_eos=True if s.num_steps < s.min_len else False).item()
+                       for i, s in enumerate(sessions)]
+        for i, session in enumerate(sessions):
+            session.num_steps += 1
+            if top_ids[i] == self.llm.speech_token_size:
+                session.finished = True
+            elif top_ids[i] < self.llm.speech_token_size:
+                session.output_queue.put(top_ids[i])
+                session.out_tokens.append(top_ids[i])
+                session.lm_input = self.llm.speech_embedding.weight[top_ids[i]].reshape(1, 1, -1)
+                if session.window is not None:
+                    session.window = windows[i: i + 1]
+                self.num_tokens += 1
+            if session.num_steps >= session.max_len:
+                session.finished = True
+
+    def _admit(self, sessions: List[DecodeSession]):
+        new_sessions, new_caches = [], []
+        for session in sessions:
+            if session.cancelled is True:
+                session.output_queue.put(None)
+                continue
+            # prefill is done with batch 1, prompt lengths are too different to pad efficiently
+            prefix_len = 0 if session.prefix_cache is None else session.prefix_cache[0][0].size(2)
+            seq_len = prefix_len + session.lm_input.shape[1]
+            y_pred, cache = self.llm.llm.forward_one_step(session.lm_input,
+                                                          masks=torch.ones((1, 1, seq_len), device=session.lm_input.device).to(torch.bool),
+                                                          cache=session.prefix_cache)
+            session.prefix_cache = None
+            session.seq_len = seq_len
+            if hasattr(self.llm, 'batch_sampler'):
+                session.window = self.llm.batch_sampler.init_window(1, session.lm_input.device)
+                session.generator = self.llm.batch_sampler.new_generator()
+            logp = self.llm.llm_decoder(y_pred[:, -1]).log_softmax(dim=-1)
+            self._sample([session], logp)
+            if session.finished is True:
+                session.output_queue.put(None)
+                continue
+            new_sessions.append(session)
+            new_caches.append(_to_legacy_cache(cache))
+        self._merge(new_sessions, new_caches)
+
+    def _resumable(self):
+        return any(s.cancelled is True or self.pause_fn(s.uuid) is False for s in self.paused)
+
+    def _pause_resume(self):
+        if self.pause_fn is None:
+            return
+        keep = [i for i, s in enumerate(self.active) if self.pause_fn(s.uuid) is False]
+        for i, session in enumerate(self.active):
+            if i not in keep:
+                # valid positions of a row are the right most seq_len ones, clone so the batched cache can be freed
+                session.cache = tuple((k[i: i + 1, :, self.cache_len - session.seq_len:].clone(), v[i: i + 1, :, self.cache_len - session.seq_len:].clone())
+                                      for k, v in self.cache)
+                self.paused.append(session)
+        self._keep(keep)
+        resumed = []
+        for session in list(self.paused):
+            if session.cancelled is True:
+                self.paused.remove(session)
+                session.output_queue.put(None)
+            elif self.pause_fn(session.uuid) is False and len(self.active) + len(resumed) < self.max_batch_size:
+                self.paused.remove(session)
+                resumed.append(session)
+        caches = [s.cache for s in resumed]
+        for session in resumed:
+            session.cache = None
+        self._merge(resumed, caches)
+
+    def _merge(self, new_sessions: List[DecodeSession], new_caches):
+        if len(new_sessions) == 0:
+            return
+        cache_len = max([self.cache_len] + [s.seq_len for s in new_sessions])
+        caches = [] if self.cache is None else [_left_pad_cache(self.cache, cache_len - self.cache_len)]
+        caches += [_left_pad_cache(c, cache_len - s.seq_len) for s, c in zip(new_sessions, new_caches)]
+        self.cache = tuple((torch.concat([c[i][0] for c in caches], dim=0), torch.concat([c[i][1] for c in caches], dim=0))
+                           for i in range(len(caches[0])))
+        self.cache_len = cache_len
+        self.active += new_sessions
+
+    def _retire(self):
+        keep = [i for i, s in enumerate(self.active) if s.finished is False and s.cancelled is False]
+        for i, session in enumerate(self.active):
+            if i not in keep:
+                session.output_queue.put(None)
+        self._keep(keep)
+
+    def _keep(self, keep: List[int]):
+        if len(keep) == len(self.active):
+            return
+        if len(keep) == 0:
+            self.active, self.cache, self.cache_len = [], None, 0
+            return
+        self.active = [self.active[i] for i in keep]
+        # drop left padding columns shared by all remaining rows
+        trim = self.cache_len - max([s.seq_len for s in self.active])
+        index = torch.tensor(keep, device=self.cache[0][0].device)
+        self.cache = tuple((k.index_select(0, index)[:, :, trim:], v.index_select(0, index)[:, :, trim:]) for k, v in self.cache)
+        self.cache_len -= trim
+
+    def _step(self):
+        device = self.cache[0][0].device
+        lm_input = torch.concat([s.lm_input for s in self.active], dim=0)
+        seq_len = torch.tensor([s.seq_len for s in self.active], device=device)
+        # valid cache positions are the right most seq_len ones, plus the current input
+        masks = torch.arange(self.cache_len, device=device).unsqueeze(0) >= (self.cache_len - seq_len).unsqueeze(1)
+        masks = F.pad(masks, (0, 1), value=True)
+        y_pred, cache = self.llm.llm.forward_batch_step(lm_input, masks=masks, position_ids=seq_len.unsqueeze(1), cache=self.cache)
+        self.cache = _to_legacy_cache(cache)
+        self.cache_len += 1
+        self.num_steps += 1
+        logp = self.llm.llm_decoder(y_pred[:, -1]).log_softmax(dim=-1)
+        for session in self.active:
+            session.seq_len += 1
+        self._sample(self.active, logp)
+        self._retire()
+
+
+def _to_legacy_cache(cache):
+    if hasattr(cache, 'to_legacy_cache'):
+        cache = cache.to_legacy_cache()
+    return cache
+
+
+def _left_pad_cache(cache, pad_len):
+    if pad_len == 0:
+        return cache
+    return tuple((F.pad(k, (0, 0, pad_len, 0)), F.pad(v, (0, 0, pad_len, 0))) for k, v in cache)
@@ -0,0 +1,149 @@
+# Copyright (c) 2025 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import threading
+import time
+from typing import List
+import torch
+from cosyvoice.llm.kv_cache import StaticKVCache
+
+
+class NgramDrafter:
+    """Propose draft tokens by looking up the latest n-gram of history in earlier history.
+
+    History starts with the prompt speech tokens and grows with every generated token,
+    index[n] maps every n-gram seen so far to the position right after its latest
+    occurrence, so a lookup is O(ngram_max).
+    """
+
+    def __init__(self, history: List[int], ngram_max: int = 3):
+        self.ngram_max = ngram_max
+        self.history = []
+        self.index = [dict() for _ in range(ngram_max + 1)]
+        for token in history:
+            self.append(token)
+
+    def append(self, token: int):
+        # register n-grams ending right before the new token, they are followed by it
+        L = len(self.history)
+        for n in range(1, self.ngram_max + 1):
+            if L >= n:
+                self.index[n][tuple(self.history[L - n:])] = L
+        self.history.append(token)
+
+    def draft(self, k: int) -> List[int]:
+        for n in range(min(self.ngram_max, len(self.history)), 0, -1):
+            start = self.index[n].get(tuple(self.history[-n:]))
+            if start is not None:
+                return self.history[start: start + k]
+        return []
+
+
+class SpeculativeDecoder:
+    """Prompt lookup speculative decode for Qwen2LM.
+
+    Every forward feeds the last token plus up to num_draft n-gram drafts, see
+    NgramDrafter. Tokens are sampled position by position from the verified logits
+    with the usual llm.sampling_ids, a draft is accepted only when the sampled token
+    equals it, so outputs follow the same distribution as one token per forward.
+    Rejected positions are cropped from the StaticKVCache. A session whose draft
+    acceptance rate drops below min_accept_rate stops drafting.
+    """
+
+    def __init__(self, llm: torch.nn.Module, num_draft: int = 4, ngram_max: int = 3, min_accept_rate: float = 0.2, warmup: int = 32):
+        self.llm = llm
+        self.num_draft = num_draft
+        self.ngram_max = ngram_max
+        self.min_accept_rate = min_accept_rate
+        # number of drafted tokens before acceptance rate is checked
+        self.warmup = warmup
+        self.lock = threading.Lock()
+        # statistics
+        self.num_drafted = 0
+        self.num_accepted = 0
+        self.num_forwards = 0
+        self.num_tokens = 0
+        self.num_fallbacks = 0
+        self.decode_time = 0.0
+
+    def get_stats(self):
+        with self.lock:
+            return {'drafted': self.num_drafted, 'accepted': self.num_accepted,
+                    'accept_rate': self.num_accepted / max(self.num_drafted, 1),
+                    'tokens_per_forward': self.num_tokens / max(self.num_forwards, 1),
+                    'tokens_per_second': self.num_tokens / max(self.decode_time, 1e-6),
+                    'fallbacks': self.num_fallbacks}
+
+    def decode(self, lm_input, sampling, min_len, max_len, history: List[int], prefix_cache=None):
+        llm = self.llm
+        if prefix_cache is not None:
+            cache = StaticKVCache.from_legacy_cache(prefix_cache, prefix_cache[0][0].size(2) + lm_input.shape[1] + max_len + self.num_draft + 1)
+        else:
+            cache = StaticKVCache(lm_input.shape[1] + max_len + self.num_draft + 1)
+        drafter = NgramDrafter(history, self.ngram_max)
+        # NOTE own generator per session, so the sampled tokens do not depend on concurrent sessions
+        generator = llm.batch_sampler.new_generator() if hasattr(llm, 'batch_sampler') else None
+        out_tokens, drafts = [], []
+        num_steps, num_drafted, num_accepted, num_forwards = 0, 0, 0, 0
+        drafting = self.num_draft > 0
+        start_time = time.time()
+        try:
+            while True:
+                base_len = cache.seq_len
+                y_pred, cache = llm.llm.forward_static_step(lm_input, cache)
+                num_forwards += 1
+                logp = llm.llm_decoder(y_pred[0, -(len(drafts) + 1):]).log_softmax(dim=-1)
+                # verify drafts position by position, row j predicts the token after input offset + j,
+                # offset is only non zero for the prefill
+                offset = lm_input.shape[1] - len(drafts) - 1
+                next_input = None
+                for j in range(len(drafts) + 1):
+                    if num_steps >= max_len:
+                        return
+                    top_ids = llm.sampling_ids(logp[j], out_tokens, sampling, ignore_eos=True if num_steps < min_len else False,
+                                               generator=generator).item()
+                    num_steps += 1
+                    if top_ids == llm.speech_token_size:
+                        return
+                    if top_ids > llm.speech_token_size:
+                        # NOTE same as batch 1 decode, skip it and feed the last input again
+                        cache.crop(base_len + offset + j + 1)
+                        next_input = lm_input[:, offset + j: offset + j + 1]
+                        break
+                    yield top_ids
+                    out_tokens.append(top_ids)
+                    drafter.append(top_ids)
+                    if j < len(drafts) and top_ids == drafts[j]:
+                        num_accepted += 1
+                        continue
+                    cache.crop(base_len + offset + j + 1)
+                    next_input = llm.speech_embedding.weight[top_ids].reshape(1, 1, -1)
+                    break
+                if drafting and num_drafted >= self.warmup and num_accepted < self.min_accept_rate * num_drafted:
+                    drafting = False
+                    with self.lock:
+                        self.num_fallbacks += 1
+                drafts = drafter.draft(self.num_draft) if drafting else []
+                num_drafted += len(drafts)
+                if len(drafts) != 0:
+                    draft_emb = llm.speech_embedding.weight[torch.tensor(drafts, device=next_input.device)].unsqueeze(dim=0)
+                    lm_input = torch.concat([next_input, draft_emb], dim=1)
+                else:
+                    lm_input = next_input
+        finally:
+            with self.lock:
+                self.num_drafted += num_drafted
+                self.num_accepted += num_accepted
+                self.num_forwards += num_forwards
+                self.num_tokens += len(out_tokens)
+                self.decode_time += time.time() - start_time
@@ -15,13 +15,14 @@
 # limitations under the License.
 # Modified from ESPnet(https://github.com/espnet/espnet)
 """Encoder definition."""
-from typing import Tuple
+from typing import Dict, Tuple
 
 import torch
 from torch import nn
 from torch.nn import functional as F
 
 from cosyvoice.transformer.convolution import ConvolutionModule
+from cosyvoice.transformer.embedding import EspnetRelPositionalEncoding
 from cosyvoice.transformer.encoder_layer import ConformerEncoderLayer
 from cosyvoice.transformer.positionwise_feed_forward import PositionwiseFeedForward
 from cosyvoice.utils.class_utils import (
@@ -31,7 +32,7 @@ from cosyvoice.utils.class_utils import (
     COSYVOICE_ACTIVATION_CLASSES,
 )
 from cosyvoice.utils.mask import make_pad_mask
-from cosyvoice.utils.mask import add_optional_chunk_mask
+from cosyvoice.utils.mask import add_optional_chunk_mask, subsequent_chunk_mask
 
 
 class Upsample1D(nn.Module):
@@ -318,3 +319,93 @@ class UpsampleConformerEncoder(torch.nn.Module):
         for layer in self.up_encoders:
             xs, chunk_masks, _, _ = layer(xs, chunk_masks, pos_emb, mask_pad)
         return xs
+
+    def init_chunk_cache(self, xs: torch.Tensor) -> Dict[str, torch.Tensor]:
+        """Empty cache for forward_chunk, zero conv states are the same as zero padding in forward."""
+        C = self.pre_lookahead_layer.channels
+        return {'offset': 0,
+                'xs': xs.new_zeros(1, 0, xs.size(2)),
+                'lookahead_cache': xs.new_zeros(1, C, self.pre_lookahead_layer.conv2.kernel_size[0] - 1),
+                'up_cache': xs.new_zeros(1, self.up_layer.stride, C),
+                'att_cache': [torch.zeros((0, 0, 0, 0), dtype=xs.dtype, device=xs.device) for _ in self.encoders],
+                'up_att_cache': [torch.zeros((0, 0, 0, 0), dtype=xs.dtype, device=xs.device) for _ in self.up_encoders],
+                'ys': xs.new_zeros(1, 0, self._output_size)}
+
+    def forward_chunk(
+        self,
+        xs: torch.Tensor,
+        cache: Dict[str, torch.Tensor],
+        context: torch.Tensor = torch.zeros(0, 0, 0),
+    ) -> Tuple[torch.Tensor, Dict[str, torch.Tensor]]:
+        """Incremental streaming forward, same result as forward(streaming=True) on all inputs so far.
+
+        Positions are final once their static chunk is complete, because a chunk only
+        attends to itself and to left chunks. For complete chunks the cache keeps attention
+        key/value of every layer, the last conv1 outputs of pre_lookahead_layer, the last
+        inputs of up_layer and the encoder output, only the incomplete tail chunk and the
+        new inputs are computed in every call.
+
+        Args:
+            xs: new input since last call (1, T, D), without lookahead context
+            cache: from init_chunk_cache or last call, not modified in place
+            context: lookahead input (1, pre_lookahead_len, D), empty for the last chunk
+        Returns:
+            encoder output of all inputs so far (1, 2 * total_T, D), and the new cache
+        """
+        assert self.training is False and xs.size(0) == 1
+        assert self.static_chunk_size > 0, 'forward_chunk needs static_chunk_size > 0'
+        assert isinstance(self.embed.pos_enc, EspnetRelPositionalEncoding), 'forward_chunk only supports rel_pos_espnet'
+        assert all(layer.conv_module is None for layer in self.encoders) and all(layer.conv_module is None for layer in self.up_encoders)
+        if self.global_cmvn is not None:
+            xs = self.global_cmvn(xs)
+        # recompute the incomplete chunk of last call together with the new input
+        offset = cache['offset']
+        xs = torch.concat([cache['xs'], xs], dim=1)
+        T, total_T = xs.size(1), offset + xs.size(1)
+        num_final = total_T // self.static_chunk_size * self.static_chunk_size - offset
+        masks = torch.ones(1, 1, T, dtype=torch.bool, device=xs.device)
+        new_cache = {'offset': offset + num_final, 'xs': xs[:, num_final:]}
+
+        # lookahead, conv2 left context comes from cache instead of zero padding
+        self.embed.pos_enc.extend_pe(torch.tensor(0.0).expand(1, total_T).to(xs))
+        ys, _, _ = self.embed(xs, masks)
+        pos_emb = self.embed.pos_enc.position_encoding(offset=0, size=total_T)
+        lookahead = self.pre_lookahead_layer
+        outputs = ys.transpose(1, 2)
+        if context.size(1) != 0:
+            context, _, _ = self.embed(context, torch.ones(1, 1, context.size(1)).to(masks))
+            outputs = torch.concat([outputs, context.transpose(1, 2)], dim=2)
+        outputs = F.pad(outputs, (0, T + lookahead.pre_lookahead_len - outputs.size(2)), mode='constant', value=0.0)
+        outputs = torch.concat([cache['lookahead_cache'], F.leaky_relu(lookahead.conv1(outputs))], dim=2)
+        new_cache['lookahead_cache'] = outputs[:, :, num_final: num_final + cache['lookahead_cache'].size(2)]
+        ys = lookahead.conv2(outputs).transpose(1, 2) + ys
+
+        # conformer encoder, queries are the tail, keys are everything so far
+        chunk_masks = subsequent_chunk_mask(total_T, self.static_chunk_size, device=xs.device)[offset:].unsqueeze(0)
+        new_cache['att_cache'] = []
+        for layer, att_cache in zip(self.encoders, cache['att_cache']):
+            ys, _, new_att_cache, _ = layer(ys, chunk_masks, pos_emb, masks, att_cache)
+            new_cache['att_cache'].append(new_att_cache[:, :, :offset + num_final])
+
+        # upsample, conv left context comes from cache instead of zero padding
+        stride = self.up_layer.stride
+        ys = torch.concat([cache['up_cache'], ys], dim=1)
+        new_cache['up_cache'] = ys[:, num_final: num_final + stride]
+        ys = F.interpolate(ys.transpose(1, 2), scale_factor=float(stride), mode="nearest")
+        ys = self.up_layer.conv(ys).transpose(1, 2)
+
+        # upsample conformer encoder
+        up_offset, up_total_T = offset * stride, total_T * stride
+        up_masks = torch.ones(1, 1, ys.size(1), dtype=torch.bool, device=xs.device)
+        self.up_embed.pos_enc.extend_pe(torch.tensor(0.0).expand(1, up_total_T).to(xs))
+        ys, _, _ = self.up_embed(ys, up_masks)
+        pos_emb = self.up_embed.pos_enc.position_encoding(offset=0, size=up_total_T)
+        chunk_masks = subsequent_chunk_mask(up_total_T, self.static_chunk_size * stride, device=xs.device)[up_offset:].unsqueeze(0)
+        new_cache['up_att_cache'] = []
+        for layer, att_cache in zip(self.up_encoders, cache['up_att_cache']):
+            ys, _, new_att_cache, _ = layer(ys, chunk_masks, pos_emb, up_masks, att_cache)
+            new_cache['up_att_cache'].append(new_att_cache[:, :, :up_offset + num_final * stride])
+        if self.normalize_before:
+            ys = self.after_norm(ys)
+        new_cache['ys'] = torch.concat([cache['ys'], ys[:, :num_final * stride]], dim=1)
+        return torch.concat([cache['ys'], ys], dim=1), new_cache
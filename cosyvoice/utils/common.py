@@ -18,10 +18,20 @@
 
 import queue
 import random
-from typing import List
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Callable, List
 
 import numpy as np
 import torch
+from torch.nn.utils import parametrize
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+from torch.nn.utils.weight_norm import WeightNorm
+
+from cosyvoice.transformer.convolution import ConvolutionModule
 
 IGNORE_ID = -1
 
@@ -140,14 +150,13 @@ def random_sampling(weighted_scores, decoded_tokens, sampling):
 
 
 def fade_in_out(fade_in_mel, fade_out_mel, window):
-    device = fade_in_mel.device
-    fade_in_mel, fade_out_mel = fade_in_mel.cpu(), fade_out_mel.cpu()
+    # NOTE stays on the device of fade_in_mel, window is moved only if it is not there yet
+    window = torch.as_tensor(window, dtype=fade_in_mel.dtype, device=fade_in_mel.device)
     mel_overlap_len = int(window.shape[0] / 2)
-    if fade_in_mel.device == torch.device('cpu'):
-        fade_in_mel = fade_in_mel.clone()
+    fade_in_mel = fade_in_mel.clone()
     fade_in_mel[..., :mel_overlap_len] = fade_in_mel[..., :mel_overlap_len] * window[:mel_overlap_len] + \
-        fade_out_mel[..., -mel_overlap_len:] * window[mel_overlap_len:]
-    return fade_in_mel.to(device)
+        fade_out_mel[..., -mel_overlap_len:].to(fade_in_mel) * window[mel_overlap_len:]
+    return fade_in_mel
 
 
 def set_all_random_seed(seed):
@@ -168,6 +177,63 @@ def mask_to_bias(mask: torch.Tensor, dtype: torch.dtype) -> torch.Tensor:
     return mask
 
 
+def num_bytes(obj) -> int:
+    """Bytes of all tensors in obj, nested dicts, lists and tuples are walked."""
+    if isinstance(obj, torch.Tensor):
+        return obj.numel() * obj.element_size()
+    if isinstance(obj, dict):
+        return sum(num_bytes(i) for i in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(num_bytes(i) for i in obj)
+    return 0
+
+
+def remove_weight_norms(module: torch.nn.Module) -> int:
+    """Fold weight norm of every submodule into a plain weight, returns the number of folded modules.
+
+    Works for both torch.nn.utils.parametrizations.weight_norm and the deprecated hook based
+    torch.nn.utils.weight_norm, modules without weight norm are skipped.
+    """
+    num = 0
+    for m in list(module.modules()):
+        if parametrize.is_parametrized(m, 'weight') and \
+                any(type(i).__name__ == '_WeightNorm' for i in m.parametrizations['weight']):
+            parametrize.remove_parametrizations(m, 'weight', leave_parametrized=True)
+            num += 1
+        elif any(isinstance(i, WeightNorm) for i in m._forward_pre_hooks.values()):
+            torch.nn.utils.remove_weight_norm(m)
+            num += 1
+    return num
+
+
+def fuse_conv_bn(module: torch.nn.Module) -> int:
+    """Fold eval mode batch norm into the conv before it, returns the number of fused pairs.
+
+    Only ConvolutionModule has a conv -> batch norm chain, layer norm and group norm
+    normalize over time or channel groups at runtime and can not be folded.
+    """
+    num = 0
+    for m in list(module.modules()):
+        if isinstance(m, ConvolutionModule) and isinstance(m.norm, torch.nn.BatchNorm1d) and m.training is False:
+            m.depthwise_conv = fuse_conv_bn_eval(m.depthwise_conv, m.norm)
+            m.norm = torch.nn.Identity()
+            num += 1
+    return num
+
+
+def prepare_for_inference(module: torch.nn.Module) -> dict:
+    """Rewrite module in place for inference only: fold weight norm and batch norm, freeze parameters.
+
+    NOTE channels last memory format only applies to 4d conv inputs, every conv here is 1d so it is not used.
+    Parameter names change after folding, load state dict before calling this.
+    """
+    module.eval()
+    stats = {'weight_norm': remove_weight_norms(module), 'conv_bn': fuse_conv_bn(module)}
+    module.requires_grad_(False)
+    stats['params'] = sum(i.numel() for i in module.parameters())
+    return stats
+
+
 class TrtContextWrapper:
     def __init__(self, trt_engine, trt_concurrent=1, device='cuda:0'):
         self.trt_context_pool = queue.Queue(maxsize=trt_concurrent)
@@ -184,3 +250,191 @@ class TrtContextWrapper:
 
     def release_estimator(self, context, stream):
         self.trt_context_pool.put([context, stream])
+
+
+class OrtSessionWrapper:
+    """Pool of onnxruntime sessions, same acquire/release usage as TrtContextWrapper.
+
+    Every session has its own intra/inter op thread pools and io binding, inputs are
+    bound to the memory of the torch tensors and the output to a per session buffer
+    which only grows, see ConditionalCFM.forward_estimator. Callers which only need
+    session.run check a session out with session(), see CosyVoiceFrontEnd.
+    """
+
+    def __init__(self, onnx_model, ort_concurrent=1, intra_op_num_threads=0, inter_op_num_threads=0, execution_mode='', providers=None):
+        import onnxruntime
+        option = onnxruntime.SessionOptions()
+        option.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # NOTE 0 means onnxruntime default, i.e. number of physical cores for intra op
+        option.intra_op_num_threads = intra_op_num_threads
+        option.inter_op_num_threads = inter_op_num_threads
+        if execution_mode == '':
+            execution_mode = 'parallel' if inter_op_num_threads > 1 else 'sequential'
+        assert execution_mode in ['parallel', 'sequential'], 'unknown onnxruntime execution mode {}'.format(execution_mode)
+        option.execution_mode = onnxruntime.ExecutionMode.ORT_PARALLEL if execution_mode == 'parallel' else onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+        providers = providers if providers is not None else ['CPUExecutionProvider']
+        self.ort_session_pool = queue.Queue(maxsize=ort_concurrent)
+        for _ in range(ort_concurrent):
+            ort_session = onnxruntime.InferenceSession(onnx_model, sess_options=option, providers=providers)
+            self.ort_session_pool.put([ort_session, ort_session.io_binding(), torch.zeros(0)])
+        self.input_names = [i.name for i in ort_session.get_inputs()]
+        self.output_name = ort_session.get_outputs()[0].name
+
+    def acquire_estimator(self):
+        return self.ort_session_pool.get()
+
+    def release_estimator(self, session, io_binding, buffer):
+        self.ort_session_pool.put([session, io_binding, buffer])
+
+    @contextmanager
+    def session(self):
+        # blocks until a session of the pool is free
+        entry = self.acquire_estimator()
+        try:
+            yield entry[0]
+        finally:
+            self.release_estimator(*entry)
+
+
+class BatchCollector:
+    """Collect items submitted by concurrent sessions and run them with one batch_fn call.
+
+    A worker thread waits at most max_wait seconds after the first pending item for more
+    items with the same key_fn value, then calls batch_fn(items) which must return one
+    result per item. submit() blocks until the result of its item is ready.
+    """
+
+    def __init__(self, batch_fn: Callable, max_batch_size: int = 8, max_wait: float = 0.01, key_fn: Callable = None):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.key_fn = key_fn if key_fn is not None else (lambda item: None)
+        self.pending = []
+        self.cond = threading.Condition()
+        # statistics
+        self.num_batches = 0
+        self.num_items = 0
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def after_fork(self):
+        """Start a new worker thread in a forked process, the thread of the parent is not forked."""
+        self.pending = []
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def submit(self, item):
+        future = Future()
+        with self.cond:
+            self.pending.append((item, future))
+            self.cond.notify()
+        return future.result()
+
+    def get_stats(self):
+        with self.cond:
+            return {'pending': len(self.pending), 'num_batches': self.num_batches, 'num_items': self.num_items,
+                    'avg_batch_size': self.num_items / max(self.num_batches, 1)}
+
+    def _collect(self):
+        key = self.key_fn(self.pending[0][0])
+        deadline = time.time() + self.max_wait
+        while True:
+            batch = [i for i in self.pending if self.key_fn(i[0]) == key][:self.max_batch_size]
+            remaining = deadline - time.time()
+            if len(batch) >= self.max_batch_size or remaining <= 0:
+                break
+            self.cond.wait(remaining)
+        for i in batch:
+            self.pending.remove(i)
+        return batch
+
+    def _loop(self):
+        while True:
+            with self.cond:
+                while len(self.pending) == 0:
+                    self.cond.wait()
+                batch = self._collect()
+                self.num_batches += 1
+                self.num_items += len(batch)
+            try:
+                results = self.batch_fn([i[0] for i in batch])
+                assert len(results) == len(batch), 'batch_fn should return {} results, got {}'.format(len(batch), len(results))
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+
+
+class LRUCache:
+    """Thread safe LRU cache with a byte budget, base of the llm prefix, speaker conditioning and prompt caches.
+
+    put() evicts the least recently used entries once max_entries or max_bytes is exceeded, a value
+    larger than max_bytes is not stored. Subclasses derive the keys, may override entry_bytes, and
+    may implement load() as a second tier which is looked up on a miss.
+    """
+
+    def __init__(self, max_bytes: int, max_entries: int):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.num_bytes = 0
+        self.lock = threading.Lock()
+        # statistics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def entry_bytes(self, value) -> int:
+        return num_bytes(value)
+
+    def load(self, key):
+        return None
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key][0]
+        value = self.load(key)
+        if value is None:
+            with self.lock:
+                self.misses += 1
+            return None
+        self._insert(key, value)
+        return value
+
+    def put(self, key, value):
+        self._insert(key, value)
+
+    def _insert(self, key, value):
+        # NOTE replaces an existing entry
+        entry_bytes = self.entry_bytes(value)
+        if entry_bytes > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.num_bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, entry_bytes)
+            self.num_bytes += entry_bytes
+            while len(self.entries) > self.max_entries or self.num_bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self.entries.popitem(last=False)
+                self.num_bytes -= evicted_bytes
+                self.evictions += 1
+
+    def pop(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.num_bytes -= self.entries.pop(key)[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.num_bytes = 0
+
+    def get_stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.num_bytes, 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions}
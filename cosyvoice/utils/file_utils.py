@@ -50,6 +50,22 @@ def load_wav(wav, target_sr):
     return speech
 
 
+def read_prompt_dir(prompt_dir):
+    # every <name>.wav with a <name>.txt next to it holding the prompt text is one speaker
+    prompts = []
+    for name in sorted(os.listdir(prompt_dir)):
+        wav, ext = os.path.join(prompt_dir, name), os.path.splitext(name)[1]
+        if ext.lower() not in ['.wav', '.flac', '.mp3']:
+            continue
+        txt = os.path.splitext(wav)[0] + '.txt'
+        if not os.path.exists(txt):
+            logging.warning('skip {}, no prompt text {}'.format(wav, txt))
+            continue
+        with open(txt, 'r', encoding='utf8') as fin:
+            prompts.append((wav, fin.read().strip(), os.path.splitext(name)[0]))
+    return prompts
+
+
 def convert_onnx_to_trt(trt_model, trt_kwargs, onnx_model, fp16):
     import tensorrt as trt
     logging.info("Converting onnx to trt...")
@@ -0,0 +1,68 @@
+"""
+批量克隆说话人节点
+从目录读取 <名称>.wav 及同名 <名称>.txt（参考文本），一次注册全部说话人
+"""
+import os
+import sys
+
+# 添加必要的路径
+nor_dir = os.path.dirname(os.path.dirname(__file__))
+Matcha_path = os.path.join(nor_dir, 'third_party/Matcha-TTS')
+sys.path.append(nor_dir)
+sys.path.append(Matcha_path)
+
+# 导入共享的 CosyVoice 实例
+from .shared_cosyvoice import get_shared_cosyvoice, cleanup_shared_cosyvoice
+
+
+class NTCosyVoiceBulkCloneSpeakers:
+    def __init__(self):
+        pass
+
+    @property
+    def cosyvoice(self):
+        """使用共享的 CosyVoice 实例"""
+        return get_shared_cosyvoice()
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "prompt_dir": ("STRING", {"default": "", "multiline": False}),
+                "batch_size": ("INT", {"default": 16, "min": 1, "max": 128, "step": 1}),
+            }
+        }
+
+    RETURN_TYPES = ("STRING",)
+    RETURN_NAMES = ("speaker_names",)
+    FUNCTION = "bulk_clone_speakers"
+    CATEGORY = "Nineton Nodes"
+    OUTPUT_NODE = True
+
+    def bulk_clone_speakers(self, prompt_dir, batch_size):
+        print("=== NTCosyVoiceBulkCloneSpeakers 执行开始 ===")
+
+        try:
+            if not os.path.isdir(prompt_dir):
+                print(f"错误: 目录不存在: {prompt_dir}")
+                return ("",)
+            # 批量提取语音 token 与说话人向量，全部完成后只写一次 spk2info.pt
+            speaker_names = self.cosyvoice.add_zero_shot_spks(prompt_dir, batch_size=batch_size, save=True)
+            print(f"已克隆 {len(speaker_names)} 个说话人: {speaker_names}")
+            print("=== NTCosyVoiceBulkCloneSpeakers 执行结束（成功） ===")
+            return ("\n".join(speaker_names),)
+        finally:
+            # 执行完成后释放GPU内存
+            cleanup_shared_cosyvoice()
+
+
+# 导出节点类
+NODE_CLASS_MAPPINGS = {
+    "NTCosyVoiceBulkCloneSpeakers": NTCosyVoiceBulkCloneSpeakers,
+}
+
+NODE_DISPLAY_NAME_MAPPINGS = {
+    "NTCosyVoiceBulkCloneSpeakers": "CosyVoice 批量克隆说话人",
+}
+
+__all__ = ['NTCosyVoiceBulkCloneSpeakers']
@@ -50,6 +50,9 @@ class NTCosyVoiceRefreshSpeakers:
             if os.path.exists(spk2info_path):
                 # 重新加载spk2info文件
                 self.cosyvoice.frontend.spk2info = torch.load(spk2info_path, map_location=self.cosyvoice.frontend.device)
+                # 说话人信息已变化，清空flow条件缓存
+                if hasattr(self.cosyvoice.model, 'spk_cond_cache'):
+                    self.cosyvoice.model.spk_cond_cache.clear()
                 print("已强制重新加载说话人信息文件")
             
             # 获取当前可用的说话人列表
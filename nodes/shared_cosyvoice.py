@@ -22,6 +22,8 @@ class SharedCosyVoiceManager:
     _instance = None
     _cosyvoice = None
     _initialized = False
+    # 参考音频特征缓存放在实例之外，cleanup 释放模型后重新加载仍可命中
+    _prompt_cache = None
     
     def __new__(cls):
         if cls._instance is None:
@@ -38,7 +40,15 @@ class SharedCosyVoiceManager:
         if self._cosyvoice is None:
             model_path = os.path.join(nor_dir, 'pretrained_models/CosyVoice2-0.5B')
             print(f"初始化共享 CosyVoice 实例，模型路径: {model_path}")
-            self._cosyvoice = CosyVoice2(model_path, load_jit=False, load_trt=False, load_vllm=False, fp16=False)
+            # 每次运行工作流都会传入相同的参考音频，缓存其特征以跳过重复提取
+            self._cosyvoice = CosyVoice2(model_path, load_jit=False, load_trt=False, load_vllm=False, fp16=False,
+                                          serving_conf={'caches': {'prompt_cache_size': 16}})
+            # 模型文件未变时沿用之前的缓存，最多 16 条特征（几 MB）会在 cleanup 后继续留在显存中
+            prompt_cache = self._cosyvoice.frontend.prompt_cache
+            if self._prompt_cache is not None and self._prompt_cache.model_id == prompt_cache.model_id:
+                self._cosyvoice.frontend.prompt_cache = self._prompt_cache
+            else:
+                self._prompt_cache = prompt_cache
         return self._cosyvoice
     
     def cleanup(self):
@@ -85,4 +95,38 @@ def cleanup_shared_cosyvoice():
 
 def reload_shared_cosyvoice():
     """重新加载共享的 CosyVoice 实例"""
-    return shared_manager.reload()
\ No newline at end of file
+    return shared_manager.reload()
+
+_shared_server = None
+
+
+def start_shared_server(host='127.0.0.1', port=50000, max_concurrency=4):
+    """启动本地流式 TTS 服务，复用共享的 CosyVoice 实例，不会重复加载模型"""
+    global _shared_server
+    if _shared_server is None:
+        from cosyvoice.cli.server import start_server
+        _shared_server = start_server(get_shared_cosyvoice, host=host, port=port, max_concurrency=max_concurrency)
+    return _shared_server
+
+
+def stop_shared_server():
+    """停止本地流式 TTS 服务"""
+    global _shared_server
+    if _shared_server is not None:
+        _shared_server.shutdown()
+        _shared_server.server_close()
+        _shared_server = None
+
+
+_shared_admission = None
+
+
+def get_shared_admission(max_concurrency=2, max_queue=64):
+    """获取共享模型前的准入控制器，支持请求优先级、截止时间以及交互请求抢占"""
+    global _shared_admission
+    cosyvoice = get_shared_cosyvoice()
+    # 模型被重新加载后，控制器需要重新绑定到新的实例
+    if _shared_admission is None or _shared_admission.cosyvoice is not cosyvoice:
+        from cosyvoice.cli.admission import AdmissionController
+        _shared_admission = AdmissionController(cosyvoice, max_concurrency=max_concurrency, max_queue=max_queue)
+    return _shared_admission
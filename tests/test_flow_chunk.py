@@ -0,0 +1,78 @@
+# Copyright (c) 2025 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Streaming flow chunk caches against full recompute on small randomly initialized modules"""
+import os
+import sys
+import unittest
+import torch
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append('{}/..'.format(ROOT_DIR))
+sys.path.append('{}/../third_party/Matcha-TTS'.format(ROOT_DIR))
+from omegaconf import DictConfig
+from cosyvoice.flow.decoder import CausalConditionalDecoder
+from cosyvoice.flow.flow_matching import CausalConditionalCFM
+from cosyvoice.transformer.upsample_encoder import UpsampleConformerEncoder
+
+# chunk ends of a streaming session, not aligned to the static chunk size on purpose
+CHUNK_ENDS = [37, 50, 75, 88, 100, 151, 197]
+
+
+def tiny_cfm():
+    torch.manual_seed(0)
+    estimator = CausalConditionalDecoder(in_channels=320, out_channels=80, channels=[64], dropout=0.0, attention_head_dim=16, n_blocks=2,
+                                         num_mid_blocks=3, num_heads=4, act_fn='gelu', static_chunk_size=50, num_decoding_left_chunks=-1)
+    cfm_params = DictConfig({'sigma_min': 1e-06, 'solver': 'euler', 't_scheduler': 'cosine', 'training_cfg_rate': 0.2,
+                             'inference_cfg_rate': 0.7, 'reg_loss_type': 'l1'})
+    return CausalConditionalCFM(240, cfm_params, spk_emb_dim=80, estimator=estimator).eval()
+
+
+class FlowChunkTest(unittest.TestCase):
+
+    def test_encoder_chunk_cache(self):
+        torch.manual_seed(0)
+        encoder = UpsampleConformerEncoder(input_size=512, output_size=512, attention_heads=8, linear_units=1024, num_blocks=2,
+                                           input_layer='linear', pos_enc_layer_type='rel_pos_espnet', selfattention_layer_type='rel_selfattn',
+                                           use_cnn_module=False, macaron_style=False, static_chunk_size=25).eval()
+        xs = torch.randn(1, 200, 512)
+        context_len = encoder.pre_lookahead_layer.pre_lookahead_len
+        with torch.inference_mode():
+            cache, offset = encoder.init_chunk_cache(xs), 0
+            for end in CHUNK_ENDS + [200]:
+                context = xs[:, end:end + context_len]
+                ref, _ = encoder(xs[:, :end], torch.tensor([end]), context=context, streaming=True)
+                out, cache = encoder.forward_chunk(xs[:, offset:end], cache, context=context)
+                offset = end
+                self.assertEqual(out.shape, ref.shape)
+                # same math, only the summation order of the attention over cached keys differs
+                self.assertLess((out - ref).abs().max().item(), 1e-5)
+            self.assertEqual(cache['offset'], 200)
+
+    def test_estimator_chunk_cache(self):
+        cfm = tiny_cfm()
+        torch.manual_seed(0)
+        mu, spks, cond = torch.randn(1, 80, 200), torch.randn(1, 80), torch.zeros(1, 80, 200)
+        cond[:, :, :74] = torch.randn(1, 80, 74)
+        cache = None
+        for end in CHUNK_ENDS + [200]:
+            mask = torch.ones(1, 1, end)
+            ref, _ = cfm(mu[:, :, :end], mask, 10, spks=spks, cond=cond[:, :, :end], streaming=True)
+            out, cache = cfm.forward_chunk(mu[:, :, :end], mask, 10, spks=spks, cond=cond[:, :, :end], cache=cache)
+            self.assertEqual(out.shape, ref.shape)
+            self.assertLess((out - ref).abs().max().item(), 1e-5)
+            # only complete static chunks are final
+            self.assertEqual(cache['feat'].size(2), end // 50 * 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
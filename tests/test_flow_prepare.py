@@ -0,0 +1,61 @@
+# Copyright (c) 2025 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Estimator calls with the conditioning prepared once per solve against per call conditioning"""
+import os
+import sys
+import unittest
+from unittest import mock
+import torch
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append('{}/..'.format(ROOT_DIR))
+sys.path.append('{}/../third_party/Matcha-TTS'.format(ROOT_DIR))
+from omegaconf import DictConfig
+from cosyvoice.flow.decoder import CausalConditionalDecoder
+from cosyvoice.flow.flow_matching import CausalConditionalCFM
+
+
+class FlowPrepareTest(unittest.TestCase):
+
+    def test_prepared_bit_identical(self):
+        torch.manual_seed(0)
+        estimator = CausalConditionalDecoder(in_channels=320, out_channels=80, channels=[64], dropout=0.0, attention_head_dim=16, n_blocks=2,
+                                             num_mid_blocks=3, num_heads=4, act_fn='gelu', static_chunk_size=50, num_decoding_left_chunks=-1)
+        cfm_params = DictConfig({'sigma_min': 1e-06, 'solver': 'euler', 't_scheduler': 'cosine', 'training_cfg_rate': 0.2,
+                                 'inference_cfg_rate': 0.7, 'reg_loss_type': 'l1'})
+        cfm = CausalConditionalCFM(240, cfm_params, spk_emb_dim=80, estimator=estimator).eval()
+        mu, spks, cond = torch.randn(2, 80, 120), torch.randn(2, 80), torch.randn(2, 80, 120)
+        forward = estimator.forward
+        batch_sizes = []
+
+        def checked_forward(x, mask, mu, t, spks=None, cond=None, streaming=False, prepared=None):
+            out = forward(x, mask, mu, t, spks, cond, streaming=streaming, prepared=prepared)
+            self.assertIsNotNone(prepared)
+            self.assertTrue(torch.equal(out, forward(x, mask, mu, t, spks, cond, streaming=streaming)))
+            batch_sizes.append(x.size(0))
+            return out
+
+        with mock.patch.object(estimator, 'forward', checked_forward):
+            for streaming in [True, False]:
+                for kwargs in [{}, {'solver': 'heun', 'n_timesteps': 3}, {'cfg_interval': 0.5}]:
+                    kwargs.setdefault('n_timesteps', 4)
+                    cfm(mu[:1], torch.ones(1, 1, 120), spks=spks[:1], cond=cond[:1], streaming=streaming, **kwargs)
+                    # padded batch of two requests
+                    cfm.forward_batch([mu[:1], mu[1:, :, :90]], [torch.ones(1, 1, 120), torch.ones(1, 1, 90)], spks=[spks[:1], spks[1:]],
+                                      cond=[cond[:1], cond[1:, :, :90]], streaming=streaming, **kwargs)
+        # cfg_interval narrows the prepared conditioning to the conditional half
+        self.assertEqual(set(batch_sizes), {1, 2, 4})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+# Copyright (c) 2025 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Batched prompt extraction of CosyVoiceFrontEnd against batch 1, with tiny onnx speech tokenizer and campplus"""
+import os
+import sys
+import tempfile
+import unittest
+import numpy as np
+import torch
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append('{}/..'.format(ROOT_DIR))
+try:
+    import onnx
+    from onnx import TensorProto, helper
+    from cosyvoice.cli.frontend import CosyVoiceFrontEnd
+except ImportError as e:
+    CosyVoiceFrontEnd, import_error = None, e
+
+
+def make_speech_tokenizer(path, ratio):
+    """feats (B, 128, T) and feats_length (B,) to (B, ceil(T / ratio)) tokens, frames after feats_length are masked."""
+    g = np.random.default_rng(0)
+    nodes = [
+        helper.make_node('Shape', ['feats'], ['shape']),
+        helper.make_node('Gather', ['shape', 'two'], ['T']),
+        helper.make_node('Cast', ['T'], ['T32'], to=TensorProto.INT32),
+        helper.make_node('Range', ['zero', 'T32', 'one'], ['t']),
+        helper.make_node('Unsqueeze', ['feats_length', 'axes1'], ['len']),
+        helper.make_node('Less', ['t', 'len'], ['mask']),
+        helper.make_node('Unsqueeze', ['mask', 'axes1'], ['mask3']),
+        helper.make_node('Where', ['mask3', 'feats', 'neg'], ['masked']),
+        helper.make_node('MaxPool', ['masked'], ['pooled'], kernel_shape=[ratio], strides=[ratio], ceil_mode=1),
+        helper.make_node('Transpose', ['pooled'], ['pooled_t'], perm=[0, 2, 1]),
+        helper.make_node('MatMul', ['pooled_t', 'codebook'], ['logits']),
+        helper.make_node('ArgMax', ['logits'], ['speech_token'], axis=2, keepdims=0),
+    ]
+    initializers = [
+        helper.make_tensor('two', TensorProto.INT64, [], [2]),
+        helper.make_tensor('zero', TensorProto.INT32, [], [0]),
+        helper.make_tensor('one', TensorProto.INT32, [], [1]),
+        helper.make_tensor('axes1', TensorProto.INT64, [1], [1]),
+        helper.make_tensor('neg', TensorProto.FLOAT, [], [-1e4]),
+        helper.make_tensor('codebook', TensorProto.FLOAT, [128, 64], g.standard_normal((128, 64)).astype(np.float32).flatten()),
+    ]
+    graph = helper.make_graph(nodes, 'speech_tokenizer',
+                              [helper.make_tensor_value_info('feats', TensorProto.FLOAT, ['B', 128, 'T']),
+                               helper.make_tensor_value_info('feats_length', TensorProto.INT32, ['B'])],
+                              [helper.make_tensor_value_info('speech_token', TensorProto.INT64, ['B', 'N'])], initializers)
+    onnx.save(helper.make_model(graph, opset_imports=[helper.make_opsetid('', 17)], ir_version=8), path)
+
+
+def make_campplus(path):
+    """fbank (B, T, 80) to (B, 192) embedding, mean over frames then a projection."""
+    g = np.random.default_rng(1)
+    nodes = [
+        helper.make_node('ReduceMean', ['input'], ['pooled'], axes=[1], keepdims=0),
+        helper.make_node('MatMul', ['pooled', 'proj'], ['embedding']),
+    ]
+    initializers = [helper.make_tensor('proj', TensorProto.FLOAT, [80, 192], g.standard_normal((80, 192)).astype(np.float32).flatten())]
+    graph = helper.make_graph(nodes, 'campplus', [helper.make_tensor_value_info('input', TensorProto.FLOAT, ['B', 'T', 80])],
+                              [helper.make_tensor_value_info('embedding', TensorProto.FLOAT, ['B', 192])], initializers)
+    onnx.save(helper.make_model(graph, opset_imports=[helper.make_opsetid('', 17)], ir_version=8), path)
+
+
+@unittest.skipIf(CosyVoiceFrontEnd is None, 'frontend dependencies are not installed')
+class FrontendBatchTest(unittest.TestCase):
+
+    def build(self, speech_token_frame_rate):
+        model_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(model_dir.cleanup)
+        campplus, speech_tokenizer = os.path.join(model_dir.name, 'campplus.onnx'), os.path.join(model_dir.name, 'speech_tokenizer.onnx')
+        make_campplus(campplus)
+        make_speech_tokenizer(speech_tokenizer, 100 // speech_token_frame_rate)
+        return CosyVoiceFrontEnd(lambda: None, None, campplus, speech_tokenizer, speech_token_frame_rate=speech_token_frame_rate)
+
+    def speechs(self):
+        g = torch.Generator().manual_seed(0)
+        # lengths which are and are not multiples of the mel to token ratio
+        return [0.1 * torch.randn(1, i, generator=g) for i in [16000, 12345, 32000, 8160, 12345]]
+
+    def check_speech_token(self, speech_token_frame_rate):
+        frontend = self.build(speech_token_frame_rate)
+        speechs = self.speechs()
+        batch = frontend._extract_speech_token_batch(speechs)
+        for speech, (speech_token, speech_token_len) in zip(speechs, batch):
+            ref_token, ref_token_len = frontend._extract_speech_token(speech)
+            self.assertTrue(torch.equal(speech_token, ref_token))
+            self.assertTrue(torch.equal(speech_token_len, ref_token_len))
+            self.assertEqual(speech_token.dtype, torch.int32)
+
+    def test_speech_token_v1(self):
+        self.check_speech_token(50)
+
+    def test_speech_token_v2(self):
+        self.check_speech_token(25)
+
+    def test_wrong_frame_rate(self):
+        frontend = self.build(25)
+        frontend.speech_token_mel_ratio = 2
+        with self.assertRaises(AssertionError):
+            frontend._extract_speech_token_batch(self.speechs())
+
+    def test_spk_embedding(self):
+        frontend = self.build(25)
+        speechs = self.speechs()
+        for speech, embedding in zip(speechs, frontend._extract_spk_embedding_batch(speechs)):
+            ref = frontend._extract_spk_embedding(speech)
+            self.assertEqual(embedding.shape, ref.shape)
+            self.assertTrue(torch.allclose(embedding, ref, atol=1e-5))
+
+
+if __name__ == '__main__':
+    unittest.main()
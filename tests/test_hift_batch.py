@@ -0,0 +1,55 @@
+# Copyright (c) 2025 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""HiFTGenerator.inference_batch against per session inference on randomly initialized weights"""
+import os
+import sys
+import unittest
+from unittest import mock
+import torch
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append('{}/..'.format(ROOT_DIR))
+from cosyvoice.hifigan.f0_predictor import ConvRNNF0Predictor
+from cosyvoice.hifigan.generator import HiFTGenerator
+
+
+def zeros(*size, **kwargs):
+    kwargs.pop('generator', None)
+    return torch.zeros(*size, **kwargs)
+
+
+class HiFTBatchTest(unittest.TestCase):
+
+    def test_batch_tolerance(self):
+        torch.manual_seed(0)
+        hift = HiFTGenerator(base_channels=64, sampling_rate=24000, upsample_rates=[8, 5, 3], upsample_kernel_sizes=[16, 11, 7],
+                             source_resblock_kernel_sizes=[7, 7, 11], source_resblock_dilation_sizes=[[1, 3, 5]] * 3,
+                             f0_predictor=ConvRNNF0Predictor(cond_channels=64)).eval()
+        with torch.no_grad():
+            hift.f0_predictor.classifier.bias.fill_(220)
+        speech_feat = [torch.randn(1, 80, i) for i in [50, 34, 50, 17]]
+        cache_source = [torch.zeros(1, 1, 0), torch.randn(1, 1, 480 * 8), torch.randn(1, 1, 480 * 8), torch.zeros(1, 1, 0)]
+        # no random source noise, it is drawn per call
+        with mock.patch('torch.randn_like', torch.zeros_like), mock.patch('torch.rand', zeros), torch.inference_mode():
+            ref = [hift.inference(i, j) for i, j in zip(speech_feat, cache_source)]
+            out = hift.inference_batch(speech_feat, cache_source)
+        self.assertEqual(len(out), len(ref))
+        for (speech, source), (ref_speech, ref_source) in zip(out, ref):
+            self.assertEqual(speech.shape, ref_speech.shape)
+            self.assertTrue(torch.equal(source, ref_source))
+            # the tolerance stated in HiFTGenerator.inference_batch
+            self.assertLess((speech - ref_speech).abs().max().item(), 1e-5)
+
+
+if __name__ == '__main__':
+    unittest.main()
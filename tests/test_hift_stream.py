@@ -0,0 +1,72 @@
+# Copyright (c) 2025 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""HiFTGenerator.inference_stream against offline inference on randomly initialized weights"""
+import os
+import sys
+import unittest
+from unittest import mock
+import torch
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append('{}/..'.format(ROOT_DIR))
+from cosyvoice.hifigan.f0_predictor import ConvRNNF0Predictor
+from cosyvoice.hifigan.generator import HiFTGenerator
+
+
+def zeros(*size, **kwargs):
+    kwargs.pop('generator', None)
+    return torch.zeros(*size, **kwargs)
+
+
+class HiFTStreamTest(unittest.TestCase):
+
+    def build(self, version):
+        torch.manual_seed(0)
+        if version == 2:
+            hift = HiFTGenerator(base_channels=64, sampling_rate=24000, upsample_rates=[8, 5, 3], upsample_kernel_sizes=[16, 11, 7],
+                                 source_resblock_kernel_sizes=[7, 7, 11], source_resblock_dilation_sizes=[[1, 3, 5]] * 3,
+                                 f0_predictor=ConvRNNF0Predictor(cond_channels=64))
+        else:
+            hift = HiFTGenerator(base_channels=64, f0_predictor=ConvRNNF0Predictor(cond_channels=64))
+        with torch.no_grad():
+            # voiced f0, so the sine source is not masked out
+            hift.f0_predictor.classifier.bias.fill_(220)
+        return hift.eval()
+
+    def check(self, version, chunks, atol):
+        hift = self.build(version)
+        mel = torch.randn(1, 80, sum(chunks))
+        # no random source noise and initial phase, they are drawn per chunk in streaming
+        with mock.patch('torch.randn_like', torch.zeros_like), mock.patch('torch.rand', zeros):
+            ref, _ = hift.inference(mel)
+            cache, speech, offset = None, [], 0
+            for i, chunk in enumerate(chunks):
+                this_speech, cache = hift.inference_stream(mel[:, :, offset:offset + chunk], cache, finalize=i == len(chunks) - 1)
+                speech.append(this_speech)
+                offset += chunk
+        speech = torch.concat(speech, dim=1)
+        self.assertEqual(speech.shape, ref.shape)
+        self.assertLess((speech - ref).abs().max().item(), atol)
+        self.assertGreater(ref.abs().max().item(), 100 * atol)
+
+    def test_cosyvoice2_stream(self):
+        for chunks in [[137], [50, 50, 37], [1, 2, 3, 40, 91], [7] * 19 + [4]]:
+            self.check(2, chunks, atol=1e-4)
+
+    def test_cosyvoice_stream(self):
+        for chunks in [[137], [60, 77], [1, 2, 3, 40, 91]]:
+            self.check(1, chunks, atol=1e-4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+# Copyright (c) 2025 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Qwen2LM decode backends against the batch 1 decode on a tiny randomly initialized Qwen2"""
+import functools
+import os
+import sys
+import tempfile
+import threading
+import unittest
+import torch
+from transformers import Qwen2Config, Qwen2ForCausalLM
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append('{}/..'.format(ROOT_DIR))
+from cosyvoice.llm.kv_cache import StaticKVCache
+from cosyvoice.llm.llm import Qwen2LM, Qwen2Encoder
+from cosyvoice.llm.sampler import BatchSampler
+from cosyvoice.llm.scheduler import ContinuousBatchScheduler
+from cosyvoice.utils.common import ras_sampling
+
+TEXT_LENS = [3, 5, 9]
+
+
+def tiny_qwen2lm(path, top_k=1, tau_r=100):
+    """top_k=1 and a large tau_r decode greedily, so every backend must give the same tokens."""
+    torch.manual_seed(0)
+    sampling = functools.partial(ras_sampling, top_p=0.8, top_k=top_k, win_size=10, tau_r=tau_r)
+    return Qwen2LM(64, 64, 30, Qwen2Encoder(path), sampling).eval()
+
+
+def decode(llm, text_len):
+    g = torch.Generator().manual_seed(text_len)
+    text = torch.randint(0, 100, (1, text_len), generator=g)
+    empty = torch.zeros(1, 0, dtype=torch.long)
+    return list(llm.inference(text, torch.tensor([text_len]), empty, torch.tensor([0]), empty, torch.tensor([0]), torch.zeros(1, 192),
+                              max_token_text_ratio=8, min_token_text_ratio=1, uuid=str(text_len)))
+
+
+def decode_concurrently(llm):
+    out = {}
+    threads = [threading.Thread(target=lambda n=n: out.__setitem__(n, decode(llm, n))) for n in TEXT_LENS]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return out
+
+
+class LLMDecodeTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        torch.manual_seed(0)
+        config = Qwen2Config(vocab_size=100, hidden_size=64, intermediate_size=128, num_hidden_layers=2,
+                             num_attention_heads=4, num_key_value_heads=2)
+        Qwen2ForCausalLM(config).save_pretrained(cls.tmpdir.name)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmpdir.cleanup()
+
+    def test_continuous_batching(self):
+        llm = tiny_qwen2lm(self.tmpdir.name)
+        with torch.inference_mode():
+            ref = {n: decode(llm, n) for n in TEXT_LENS}
+            llm.batch_scheduler = ContinuousBatchScheduler(llm, max_batch_size=4)
+            out = decode_concurrently(llm)
+        self.assertEqual(out, ref)
+        self.assertEqual(llm.batch_scheduler.get_stats()['num_tokens'], sum(len(i) for i in ref.values()))
+
+    def test_static_kv_cache(self):
+        llm = tiny_qwen2lm(self.tmpdir.name)
+        torch.manual_seed(0)
+        xs, steps, bistream = torch.randn(1, 7, 64), [torch.randn(1, 1, 64) for _ in range(20)], torch.randn(1, 5, 64)
+        with torch.inference_mode():
+            # a small capacity, so the cache grows twice, and a multi token append as in bistream decode
+            cache, static_cache = None, StaticKVCache(10)
+            for x in [xs] + steps + [bistream]:
+                y, cache = llm.decode_step(x, cache)
+                static_y, static_cache = llm.decode_step(x, static_cache)
+                self.assertLess((y - static_y).abs().max().item(), 1e-5)
+            self.assertEqual(static_cache.seq_len, cache[0][0].size(2))
+            ref = {n: decode(llm, n) for n in TEXT_LENS}
+            llm.static_kv_cache = True
+            out = {n: decode(llm, n) for n in TEXT_LENS}
+        self.assertEqual(out, ref)
+
+    def test_seeded_sampler(self):
+        llm = tiny_qwen2lm(self.tmpdir.name, top_k=25, tau_r=0.1)
+        llm.batch_sampler = BatchSampler.from_sampling(llm.sampling, llm.speech_token_size, seed=0)
+        with torch.inference_mode():
+            ref = {n: decode(llm, n) for n in TEXT_LENS}
+            self.assertEqual({n: decode(llm, n) for n in TEXT_LENS}, ref)
+            # every session draws from its own generator, the tokens do not depend on concurrent sessions
+            self.assertEqual(decode_concurrently(llm), ref)
+            llm.batch_scheduler = ContinuousBatchScheduler(llm, max_batch_size=4)
+            self.assertEqual(decode_concurrently(llm), ref)
+        llm.batch_sampler = BatchSampler.from_sampling(llm.sampling, llm.speech_token_size, seed=1)
+        with torch.inference_mode():
+            self.assertNotEqual(decode_concurrently(llm), ref)
+
+
+if __name__ == '__main__':
+    unittest.main()
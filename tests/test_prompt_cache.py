@@ -0,0 +1,95 @@
+# Copyright (c) 2025 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""PromptFeatCache hits, misses, LRU eviction and the disk tier"""
+import os
+import sys
+import tempfile
+import unittest
+import torch
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append('{}/..'.format(ROOT_DIR))
+from cosyvoice.cli.prompt_cache import PromptFeatCache
+
+
+def make_entry(seed):
+    g = torch.Generator().manual_seed(seed)
+    return {'speech_token': torch.randint(0, 100, (1, 25), generator=g, dtype=torch.int32),
+            'speech_feat': torch.randn(1, 50, 80, generator=g),
+            'embedding': torch.randn(1, 192, generator=g)}
+
+
+def assert_entry_equal(test, a, b):
+    test.assertEqual(sorted(a.keys()), sorted(b.keys()))
+    for k in a:
+        test.assertTrue(torch.equal(a[k], b[k]), k)
+
+
+class PromptFeatCacheTest(unittest.TestCase):
+
+    def test_key(self):
+        cache = PromptFeatCache('model_a')
+        speech = torch.randn(1, 16000)
+        self.assertEqual(cache.key(speech, 24000), cache.key(speech.clone(), 24000))
+        self.assertNotEqual(cache.key(speech, 24000), cache.key(speech, 22050))
+        self.assertNotEqual(cache.key(speech, 24000), PromptFeatCache('model_b').key(speech, 24000))
+        other = speech.clone()
+        other[0, -1] += 1
+        self.assertNotEqual(cache.key(speech, 24000), cache.key(other, 24000))
+
+    def test_hit_miss_eviction(self):
+        cache = PromptFeatCache('model', max_entries=2)
+        entries = {i: make_entry(i) for i in range(3)}
+        self.assertIsNone(cache.get('0'))
+        cache.put('0', entries[0])
+        cache.put('1', entries[1])
+        assert_entry_equal(self, cache.get('0'), entries[0])
+        # '1' is the least recently used entry
+        cache.put('2', entries[2])
+        self.assertIsNone(cache.get('1'))
+        assert_entry_equal(self, cache.get('2'), entries[2])
+        entry_bytes = sum(v.numel() * v.element_size() for v in entries[0].values())
+        self.assertEqual(cache.get_stats(), {'entries': 2, 'bytes': 2 * entry_bytes, 'hits': 2, 'misses': 2,
+                                             'evictions': 1, 'disk_hits': 0})
+
+    def test_byte_budget(self):
+        entry_bytes = sum(v.numel() * v.element_size() for v in make_entry(0).values())
+        cache = PromptFeatCache('model', max_bytes=int(2.5 * entry_bytes), max_entries=64)
+        for i in range(4):
+            cache.put(str(i), make_entry(i))
+        self.assertEqual([i for i in range(4) if cache.get(str(i)) is not None], [2, 3])
+        self.assertEqual(cache.get_stats()['bytes'], 2 * entry_bytes)
+        # an entry over the whole budget is not stored
+        small = PromptFeatCache('model', max_bytes=entry_bytes - 1)
+        small.put('0', make_entry(0))
+        self.assertEqual(small.get_stats()['entries'], 0)
+
+    def test_disk_tier(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = PromptFeatCache('model', max_entries=1, cache_dir=cache_dir)
+            cache.put('0', make_entry(0))
+            cache.put('1', make_entry(1))
+            # evicted from memory, loaded back from disk
+            assert_entry_equal(self, cache.get('0'), make_entry(0))
+            self.assertEqual(cache.get_stats()['disk_hits'], 1)
+            # a new process, e.g. after a restart, starts from the files
+            restarted = PromptFeatCache('model', max_entries=1, cache_dir=cache_dir)
+            assert_entry_equal(self, restarted.get('1'), make_entry(1))
+            self.assertIsNone(restarted.get('2'))
+            self.assertEqual(restarted.get_stats(), {'entries': 1, 'bytes': restarted.num_bytes, 'hits': 0, 'misses': 1,
+                                                     'evictions': 0, 'disk_hits': 1})
+            self.assertEqual([i for i in os.listdir(cache_dir) if i.endswith('.tmp')], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,220 @@
+# Copyright (c) 2025 Alibaba Inc (authors: Xiang Lyu)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Run cosyvoice/cli/server.py against localhost with a stub model, python -m unittest tests.test_server"""
+import base64
+import http.client
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+import unittest
+import torch
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append('{}/..'.format(ROOT_DIR))
+from cosyvoice.cli.server import start_server, speech_to_pcm16
+
+
+class StubCosyVoice:
+    """Yields num_chunks constant chunks, records started and closed requests."""
+
+    sample_rate = 24000
+
+    def __init__(self, num_chunks=3, chunk_len=2400, delay=0.0):
+        self.num_chunks = num_chunks
+        self.chunk_len = chunk_len
+        self.delay = delay
+        self.num_started = 0
+        self.num_closed = 0
+        self.closed = threading.Event()
+
+    def list_available_spks(self):
+        return ['spk']
+
+    def chunks(self):
+        return [torch.full((1, self.chunk_len), 0.1 * (i + 1)) for i in range(self.num_chunks)]
+
+    def generate(self):
+        self.num_started += 1
+        try:
+            for chunk in self.chunks():
+                time.sleep(self.delay)
+                yield {'tts_speech': chunk}
+        finally:
+            self.num_closed += 1
+            self.closed.set()
+
+    def inference_sft(self, tts_text, spk_id, stream=False, speed=1.0):
+        return self.generate()
+
+    def inference_zero_shot(self, tts_text, prompt_text, prompt_speech_16k, zero_shot_spk_id='', stream=False, speed=1.0):
+        self.zero_shot_args = (tts_text, prompt_text, prompt_speech_16k, zero_shot_spk_id)
+        return self.generate()
+
+
+class TTSServerTest(unittest.TestCase):
+
+    def start(self, model, max_concurrency=4):
+        self.model = model
+        self.server = start_server(lambda: model, port=0, max_concurrency=max_concurrency)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        return self.server.server_address[1]
+
+    def test_sft_chunked(self):
+        model = StubCosyVoice()
+        port = self.start(model)
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        conn.request('GET', '/inference_sft?tts_text=hi&spk_id=spk')
+        response = conn.getresponse()
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.getheader('Transfer-Encoding'), 'chunked')
+        self.assertEqual(response.getheader('X-Sample-Rate'), '24000')
+        self.assertIsNotNone(response.getheader('X-First-Chunk-Time'))
+        self.assertEqual(response.read(), b''.join(speech_to_pcm16(c) for c in model.chunks()))
+        conn.close()
+
+    def test_unknown_speaker(self):
+        port = self.start(StubCosyVoice())
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        conn.request('GET', '/inference_sft?tts_text=hi&spk_id=unknown')
+        response = conn.getresponse()
+        self.assertEqual(response.status, 400)
+        self.assertIn('unknown spk_id', json.loads(response.read())['error'])
+        conn.close()
+
+    def test_max_concurrency(self):
+        model = StubCosyVoice(num_chunks=20, delay=0.05)
+        port = self.start(model, max_concurrency=1)
+        busy = http.client.HTTPConnection('127.0.0.1', port)
+        busy.request('GET', '/inference_sft?tts_text=hi&spk_id=spk')
+        self.assertEqual(busy.getresponse().status, 200)
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        conn.request('GET', '/inference_sft?tts_text=hi&spk_id=spk')
+        response = conn.getresponse()
+        self.assertEqual(response.status, 503)
+        response.read()
+        conn.close()
+        busy.close()
+
+    def test_model_loaded_once(self):
+        calls = []
+        model = StubCosyVoice()
+        self.server = start_server(lambda: calls.append(1) or model, port=0)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        for _ in range(2):
+            conn = http.client.HTTPConnection('127.0.0.1', self.server.server_address[1])
+            conn.request('GET', '/inference_sft?tts_text=hi&spk_id=spk')
+            conn.getresponse().read()
+            conn.close()
+        # get_model is asked for the shared instance on every request, the stub is never rebuilt
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(model.num_started, 2)
+
+    def test_client_disconnect_closes_generator(self):
+        model = StubCosyVoice(num_chunks=1000, delay=0.01)
+        port = self.start(model, max_concurrency=1)
+        # number of closed requests seen when the concurrency slot is given back
+        closed_at_release = []
+        release = self.server.release
+        self.server.release = lambda: closed_at_release.append(model.num_closed) or release()
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        conn.request('GET', '/inference_sft?tts_text=hi&spk_id=spk')
+        response = conn.getresponse()
+        response.read(100)
+        conn.sock.shutdown(socket.SHUT_RDWR)
+        conn.close()
+        self.assertTrue(model.closed.wait(10))
+        self.assertEqual(model.num_closed, 1)
+        # the dropped request is stopped by the handler itself, not left to garbage collection
+        self.assertEqual(closed_at_release, [1])
+        # the slot of the dropped request is released
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        conn.request('GET', '/speakers')
+        self.assertEqual(json.loads(conn.getresponse().read())['speakers'], ['spk'])
+        conn.close()
+
+    def ws_connect(self, port):
+        sock = socket.create_connection(('127.0.0.1', port))
+        self.addCleanup(sock.close)
+        key = base64.b64encode(os.urandom(16)).decode('ascii')
+        sock.sendall('GET /ws HTTP/1.1\r\nHost: 127.0.0.1\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                     'Sec-WebSocket-Key: {}\r\nSec-WebSocket-Version: 13\r\n\r\n'.format(key).encode('ascii'))
+        f = sock.makefile('rb')
+        self.assertIn(b'101', f.readline())
+        while f.readline() not in [b'\r\n', b'']:
+            pass
+        return sock, f
+
+    def ws_send_frame(self, sock, opcode, payload, fin=True):
+        if len(payload) < 126:
+            header = bytes([(0x80 if fin else 0) | opcode, 0x80 | len(payload)])
+        elif len(payload) < 65536:
+            header = bytes([(0x80 if fin else 0) | opcode, 0x80 | 126]) + struct.pack('>H', len(payload))
+        else:
+            header = bytes([(0x80 if fin else 0) | opcode, 0x80 | 127]) + struct.pack('>Q', len(payload))
+        mask = os.urandom(4)
+        sock.sendall(header + mask + bytes(b ^ mask[i % 4] for i, b in enumerate(payload)))
+
+    def ws_read_frame(self, f):
+        header = f.read(2)
+        opcode, length = header[0] & 0x0F, header[1] & 0x7F
+        if length == 126:
+            length = struct.unpack('>H', f.read(2))[0]
+        elif length == 127:
+            length = struct.unpack('>Q', f.read(8))[0]
+        return opcode, f.read(length)
+
+    def ws_read_audio(self, f):
+        audio = b''
+        while True:
+            opcode, data = self.ws_read_frame(f)
+            if opcode == 0x2:
+                audio += data
+            elif opcode == 0x1:
+                self.assertTrue(json.loads(data)['done'])
+                return audio
+
+    def test_websocket(self):
+        model = StubCosyVoice()
+        sock, f = self.ws_connect(self.start(model))
+        self.ws_send_frame(sock, 0x1, json.dumps({'mode': 'sft', 'tts_text': 'hi', 'spk_id': 'spk'}).encode('utf-8'))
+        self.assertEqual(self.ws_read_audio(f), b''.join(speech_to_pcm16(c) for c in model.chunks()))
+
+    def test_websocket_fragmented(self):
+        model = StubCosyVoice()
+        sock, f = self.ws_connect(self.start(model))
+        # large enough for the 64 bit length header, split in three frames with a ping in between
+        tts_text = 'hi' * 40000
+        payload = json.dumps({'mode': 'sft', 'tts_text': tts_text, 'spk_id': 'spk'}).encode('utf-8')
+        self.ws_send_frame(sock, 0x1, payload[:70000], fin=False)
+        self.ws_send_frame(sock, 0x9, b'ping')
+        self.ws_send_frame(sock, 0x0, payload[70000:70100], fin=False)
+        self.ws_send_frame(sock, 0x0, payload[70100:])
+        self.assertEqual(self.ws_read_frame(f), (0xA, b'ping'))
+        self.assertEqual(self.ws_read_audio(f), b''.join(speech_to_pcm16(c) for c in model.chunks()))
+
+    def test_websocket_zero_shot_spk_id(self):
+        model = StubCosyVoice()
+        sock, f = self.ws_connect(self.start(model))
+        self.ws_send_frame(sock, 0x1, json.dumps({'mode': 'zero_shot', 'tts_text': 'hi', 'zero_shot_spk_id': 'spk'}).encode('utf-8'))
+        self.ws_read_audio(f)
+        # a registered speaker needs no prompt speech, the frontend takes it from spk2info
+        self.assertEqual(model.zero_shot_args, ('hi', '', None, 'spk'))
+
+if __name__ == '__main__':
+    unittest.main()